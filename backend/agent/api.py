@@ -3,9 +3,10 @@ from fastapi.responses import StreamingResponse
 import asyncio
 import json
 import traceback
+import time
 from datetime import datetime, timezone
 import uuid
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import jwt
 from pydantic import BaseModel
 import tempfile
@@ -13,14 +14,14 @@ import os
 
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
-from services import redis
+from services import redis, usage, agent_run_stream, agent_run_archive, admission, active_runs
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger
 from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
-from services.llm import make_llm_api_call
-from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from services.llm import make_llm_api_call, AUXILIARY_CACHE_TTL
+from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status, finish_queued_run, dispatch_queued_runs
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
 
@@ -32,6 +33,10 @@ instance_id = None # Global instance ID for this backend instance
 # TTL for Redis response lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
+# Seconds without a frame after which an SSE heartbeat comment is sent, so proxies keep idle streams open
+SSE_HEARTBEAT_SECONDS = 15
+SSE_HEARTBEAT = ": heartbeat\n\n"
+
 
 class AgentStartRequest(BaseModel):
     model_name: Optional[str] = None  # Will be set from config.MODEL_TO_USE in the endpoint
@@ -137,17 +142,11 @@ async def cleanup():
     # Use the instance_id to find and clean up this instance's keys
     try:
         if instance_id: # Ensure instance_id is set
-            running_keys = await redis.keys(f"active_run:{instance_id}:*")
-            logger.info(f"Found {len(running_keys)} running agent runs for instance {instance_id} to clean up")
-
-            for key in running_keys:
-                # Key format: active_run:{instance_id}:{agent_run_id}
-                parts = key.split(":")
-                if len(parts) == 3:
-                    agent_run_id = parts[2]
-                    await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
-                else:
-                    logger.warning(f"Unexpected key format found: {key}")
+            running_run_ids = await active_runs.get_instance_runs(instance_id)
+            logger.info(f"Found {len(running_run_ids)} running agent runs for instance {instance_id} to clean up")
+
+            for agent_run_id in running_run_ids:
+                await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
         else:
             logger.warning("Instance ID not set, cannot clean up instance-specific agent runs.")
 
@@ -164,26 +163,25 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
+    # A queued run has no worker yet; dropping it from the queue is enough
     try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
+        await admission.cancel_queued(agent_run_id)
     except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
-
-    # Update the agent run status in the database
-    update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
+        logger.warning(f"Failed to remove agent run {agent_run_id} from the admission queue: {str(e)}")
+
+    # Update the agent run status in the database; responses are archived by the worker.
+    # A run that never left the queue is finalized without counting its wait as usage.
+    update_success = await finish_queued_run(
+        client, agent_run_id, final_status, error=error_message
+    ) or await update_agent_run_status(
+        client, agent_run_id, final_status, error=error_message
     )
 
     if not update_success:
         logger.error(f"Failed to update database status for stopped/failed run {agent_run_id}")
 
-    # Send STOP signal to the global control channel
+    # Send STOP signal to stream readers and the global control channel
+    await agent_run_stream.append_control(agent_run_id, "STOP")
     global_control_channel = f"agent_run:{agent_run_id}:control"
     try:
         await redis.publish(global_control_channel, "STOP")
@@ -193,22 +191,16 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
 
     # Find all instances handling this agent run and send STOP to instance-specific channels
     try:
-        instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
-        logger.debug(f"Found {len(instance_keys)} active instance keys for agent run {agent_run_id}")
-
-        for key in instance_keys:
-            # Key format: active_run:{instance_id}:{agent_run_id}
-            parts = key.split(":")
-            if len(parts) == 3:
-                instance_id_from_key = parts[1]
-                instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id_from_key}"
-                try:
-                    await redis.publish(instance_control_channel, "STOP")
-                    logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
-                except Exception as e:
-                    logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
-            else:
-                 logger.warning(f"Unexpected key format found: {key}")
+        run_instance_ids = await active_runs.get_run_instances(agent_run_id)
+        logger.debug(f"Found {len(run_instance_ids)} active instances for agent run {agent_run_id}")
+
+        for run_instance_id in run_instance_ids:
+            instance_control_channel = f"agent_run:{agent_run_id}:control:{run_instance_id}"
+            try:
+                await redis.publish(instance_control_channel, "STOP")
+                logger.debug(f"Published STOP signal to instance channel {instance_control_channel}")
+            except Exception as e:
+                logger.warning(f"Failed to publish STOP signal to instance channel {instance_control_channel}: {str(e)}")
 
         # Clean up the response list immediately on stop/fail
         await _cleanup_redis_response_list(agent_run_id)
@@ -260,11 +252,52 @@ async def check_for_active_project_agent_run(client, project_id: str):
     project_thread_ids = [t['thread_id'] for t in project_threads.data]
 
     if project_thread_ids:
-        active_runs = await client.table('agent_runs').select('id').in_('thread_id', project_thread_ids).eq('status', 'running').execute()
+        active_runs = await client.table('agent_runs').select('id').in_('thread_id', project_thread_ids).in_('status', ['running', 'queued']).execute()
         if active_runs.data and len(active_runs.data) > 0:
             return active_runs.data[0]['id']
     return None
 
+async def launch_agent_run(client, thread_id: str, account_id: str, subscription: Optional[Dict], run_kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    """Create an agent run and send it to a worker, or queue it when admission caps are reached.
+
+    Returns:
+        (agent_run_id, status) with status "running" or "queued"
+    """
+    agent_run_id = str(uuid.uuid4())
+    lane = admission.lane_for_subscription(subscription)
+    run_kwargs = {**run_kwargs, "agent_run_id": agent_run_id, "thread_id": thread_id, "instance_id": instance_id}
+    admitted = await admission.admit(agent_run_id, account_id, lane)
+    status = "running" if admitted else "queued"
+
+    try:
+        agent_run = await client.table('agent_runs').insert({
+            "id": agent_run_id, "thread_id": thread_id, "status": status,
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }).execute()
+    except Exception:
+        if admitted:
+            await admission.release(agent_run_id)
+        raise
+    logger.info(f"Created new agent run: {agent_run_id} (status: {status}, lane: {lane})")
+
+    if not admitted:
+        await admission.enqueue(agent_run_id, account_id, lane, run_kwargs)
+        # A slot may have been freed since the admission check
+        await dispatch_queued_runs()
+        return agent_run_id, status
+
+    await usage.record_run_started(account_id, agent_run_id, agent_run.data[0]['started_at'])
+
+    # Register this run as active on this instance
+    try:
+        await active_runs.register(instance_id, agent_run_id)
+    except Exception as e:
+        logger.warning(f"Failed to register agent run {agent_run_id} as active on instance {instance_id}: {str(e)}")
+
+    # Run the agent in the background
+    run_agent_background.send(**run_kwargs)
+    return agent_run_id, status
+
 async def get_agent_run_with_access_check(client, agent_run_id: str, user_id: str):
     """Get agent run data after verifying user access."""
     agent_run = await client.table('agent_runs').select('*').eq('id', agent_run_id).execute()
@@ -321,7 +354,8 @@ Transform this basic information into a comprehensive, effective system prompt t
             messages=messages,
             model_name="openai/gpt-4o",
             max_tokens=2000,
-            temperature=0.7
+            temperature=0,
+            cache_ttl=AUXILIARY_CACHE_TTL
         )
 
         if response and response.get('choices') and response['choices'][0].get('message'):
@@ -450,23 +484,7 @@ async def start_agent(
         logger.error(f"Failed to start sandbox for project {project_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to initialize sandbox: {str(e)}")
 
-    agent_run = await client.table('agent_runs').insert({
-        "thread_id": thread_id, "status": "running",
-        "started_at": datetime.now(timezone.utc).isoformat()
-    }).execute()
-    agent_run_id = agent_run.data[0]['id']
-    logger.info(f"Created new agent run: {agent_run_id}")
-
-    # Register this run in Redis with TTL using instance ID
-    instance_key = f"active_run:{instance_id}:{agent_run_id}"
-    try:
-        await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
-    except Exception as e:
-        logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
-
-    # Run the agent in the background
-    run_agent_background.send(
-        agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+    agent_run_id, run_status = await launch_agent_run(client, thread_id, account_id, subscription, dict(
         project_id=project_id,
         model_name=model_name,  # Already resolved above
         enable_thinking=body.enable_thinking, reasoning_effort=body.reasoning_effort,
@@ -474,9 +492,9 @@ async def start_agent(
         agent_config=agent_config,  # Pass agent configuration
         is_agent_builder=is_agent_builder,
         target_agent_id=target_agent_id
-    )
+    ))
 
-    return {"agent_run_id": agent_run_id, "status": "running"}
+    return {"agent_run_id": agent_run_id, "status": run_status}
 
 @router.post("/agent-run/{agent_run_id}/stop")
 async def stop_agent(agent_run_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
@@ -498,13 +516,17 @@ async def get_agent_runs(thread_id: str, user_id: str = Depends(get_current_user
     return {"agent_runs": agent_runs.data}
 
 @router.get("/agent-run/{agent_run_id}")
-async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
-    """Get agent run status and responses."""
+async def get_agent_run(
+    agent_run_id: str,
+    include_responses: bool = False,
+    user_id: str = Depends(get_current_user_id_from_jwt)
+):
+    """Get agent run status and, with include_responses, its archived responses."""
     logger.info(f"Fetching agent run details: {agent_run_id}")
     client = await db.client
     agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
     # Note: Responses are not included here by default, they are in the stream or DB
-    return {
+    result = {
         "id": agent_run_data['id'],
         "threadId": agent_run_data['thread_id'],
         "status": agent_run_data['status'],
@@ -512,6 +534,22 @@ async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_us
         "completedAt": agent_run_data['completed_at'],
         "error": agent_run_data['error']
     }
+    if include_responses:
+        try:
+            result["responses"] = await agent_run_archive.load_responses(client, agent_run_id)
+        except Exception as e:
+            logger.error(f"Error loading archived responses of agent run {agent_run_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to load agent run responses: {str(e)}")
+    return result
+
+@router.get("/agent-runs/queue")
+async def get_agent_run_queue(user_id: str = Depends(get_current_user_id_from_jwt)):
+    """Get running and queued agent run counts, globally and for the user's account."""
+    try:
+        return await admission.get_queue_depth(user_id)
+    except Exception as e:
+        logger.error(f"Error fetching agent run queue depth: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch queue depth: {str(e)}")
 
 @router.get("/thread/{thread_id}/agent", response_model=ThreadAgentResponse)
 async def get_thread_agent(thread_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
@@ -596,20 +634,31 @@ async def get_thread_agent(thread_id: str, user_id: str = Depends(get_current_us
 async def stream_agent_run(
     agent_run_id: str,
     token: Optional[str] = None,
+    cursor: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run from its Redis stream.
+
+    Every frame carries an SSE `id:` (the stream entry ID). Clients resume after
+    a frame by reconnecting with a Last-Event-ID header or a `cursor` parameter.
+    Runs started by workers that still write to a Redis list are streamed from
+    the list with Pub/Sub notifications, using list indexes as IDs.
+    """
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
     user_id = await get_user_id_from_stream_auth(request, token)
     agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
+    resume_from = (request.headers.get('last-event-id') if request else None) or cursor
+    if resume_from:
+        logger.info(f"Resuming stream for agent run {agent_run_id} after {resume_from}")
+
+    response_list_key = agent_run_stream.legacy_response_list_key(agent_run_id)
+    response_channel = agent_run_stream.legacy_response_channel(agent_run_id)
     control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
 
-    async def stream_generator():
+    async def legacy_stream_generator():
         logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
         last_processed_index = -1
         pubsub_response = None
@@ -619,22 +668,24 @@ async def stream_agent_run(
         initial_yield_complete = False
 
         try:
-            # 1. Fetch and yield initial responses from Redis list
-            initial_responses_json = await redis.lrange(response_list_key, 0, -1)
+            # 1. Fetch and yield initial responses from Redis list, after the resumed index if any
+            if resume_from and resume_from.isdigit():
+                last_processed_index = int(resume_from)
+            initial_responses_json = await redis.lrange(response_list_key, last_processed_index + 1, -1)
             initial_responses = []
             if initial_responses_json:
                 initial_responses = [json.loads(r) for r in initial_responses_json]
                 logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
-                for response in initial_responses:
-                    yield f"data: {json.dumps(response)}\n\n"
-                last_processed_index = len(initial_responses) - 1
+                for offset, response in enumerate(initial_responses):
+                    yield f"id: {last_processed_index + 1 + offset}\ndata: {json.dumps(response)}\n\n"
+                last_processed_index += len(initial_responses)
             initial_yield_complete = True
 
             # 2. Check run status *after* yielding initial data
             run_status = await client.table('agent_runs').select('status').eq("id", agent_run_id).maybe_single().execute()
             current_status = run_status.data.get('status') if run_status.data else None
 
-            if current_status != 'running':
+            if current_status not in ('running', 'queued'):
                 logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
                 yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
                 return
@@ -701,7 +752,11 @@ async def stream_agent_run(
             # 4. Main loop to process messages from the queue
             while not terminate_stream:
                 try:
-                    queue_item = await message_queue.get()
+                    try:
+                        queue_item = await asyncio.wait_for(message_queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield SSE_HEARTBEAT
+                        continue
 
                     if queue_item["type"] == "new_response":
                         # Fetch new responses from Redis list starting after the last processed index
@@ -712,8 +767,8 @@ async def stream_agent_run(
                             new_responses = [json.loads(r) for r in new_responses_json]
                             num_new = len(new_responses)
                             # logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
-                            for response in new_responses:
-                                yield f"data: {json.dumps(response)}\n\n"
+                            for offset, response in enumerate(new_responses):
+                                yield f"id: {new_start_index + offset}\ndata: {json.dumps(response)}\n\n"
                                 # Check if this response signals completion
                                 if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
                                     logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
@@ -769,6 +824,102 @@ async def stream_agent_run(
             await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
+    async def stream_generator():
+        if await agent_run_stream.uses_legacy_list(agent_run_id):
+            async for chunk in legacy_stream_generator():
+                yield chunk
+            return
+
+        logger.debug(f"Streaming responses for {agent_run_id} using Redis stream {agent_run_stream.response_stream_key(agent_run_id)}")
+        last_entry_id = resume_from if resume_from and agent_run_stream.is_entry_id(resume_from) else None
+        last_frame_at = time.monotonic()
+        initial_yield_complete = False
+
+        def format_entry(entry):
+            """Returns the SSE frame of an entry and whether it ends the stream."""
+            if entry.control is not None:
+                if entry.control in agent_run_stream.CONTROL_SIGNALS:
+                    logger.info(f"Received control signal '{entry.control}' for {agent_run_id}")
+                    return f"id: {entry.entry_id}\ndata: {json.dumps({'type': 'status', 'status': entry.control})}\n\n", True
+                return None, False
+            response = entry.response
+            ends_stream = response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']
+            if ends_stream:
+                logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
+            return f"id: {entry.entry_id}\ndata: {json.dumps(response)}\n\n", ends_stream
+
+        try:
+            # Subscribe before replaying so no entry falls between the replay and the feed
+            async with agent_run_stream.run_stream_hub.subscribe(agent_run_id) as feed:
+                # 1. Replay the responses already in the stream, after the resumed entry if any
+                initial_entries = await agent_run_stream.read_range(agent_run_id, after_id=last_entry_id)
+                logger.debug(f"Sending {len(initial_entries)} initial entries for {agent_run_id}")
+                for entry in initial_entries:
+                    last_entry_id = entry.entry_id
+                    frame, ends_stream = format_entry(entry)
+                    if frame:
+                        yield frame
+                    if ends_stream:
+                        return
+                initial_yield_complete = True
+
+                # 2. Check run status *after* yielding initial data
+                run_status = await client.table('agent_runs').select('status').eq("id", agent_run_id).maybe_single().execute()
+                current_status = run_status.data.get('status') if run_status.data else None
+
+                if current_status not in ('running', 'queued'):
+                    if not initial_entries and last_entry_id is None:
+                        # The stream of a finished run has expired; replay it from the archive
+                        archived_responses = await agent_run_archive.load_responses(client, agent_run_id)
+                        logger.debug(f"Sending {len(archived_responses)} archived responses for {agent_run_id}")
+                        for response in archived_responses:
+                            yield f"data: {json.dumps(response)}\n\n"
+                            if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
+                                return
+                    logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+                    yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                    return
+
+                # 3. Read new entries from the shared feed of this run
+                while True:
+                    try:
+                        entry = await asyncio.wait_for(feed.get(), timeout=agent_run_stream.READ_BLOCK_MS / 1000)
+                    except asyncio.TimeoutError:
+                        # A worker that predates streams may have started writing to the list meanwhile
+                        if last_entry_id is None and await agent_run_stream.uses_legacy_list(agent_run_id):
+                            async for chunk in legacy_stream_generator():
+                                yield chunk
+                            return
+                        if time.monotonic() - last_frame_at >= SSE_HEARTBEAT_SECONDS:
+                            last_frame_at = time.monotonic()
+                            yield SSE_HEARTBEAT
+                        continue
+                    if entry is None:
+                        logger.error(f"Stream feed failed for {agent_run_id}")
+                        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
+                        return
+                    if not agent_run_stream.entry_id_after(entry.entry_id, last_entry_id):
+                        continue  # Already sent during the replay
+                    last_entry_id = entry.entry_id
+                    frame, ends_stream = format_entry(entry)
+                    if frame:
+                        last_frame_at = time.monotonic()
+                        yield frame
+                    if ends_stream:
+                        return
+
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
+            if not initial_yield_complete:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
+        finally:
+            logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
+
     return StreamingResponse(stream_generator(), media_type="text/event-stream", headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
         "X-Accel-Buffering": "no", "Content-Type": "text/event-stream",
@@ -788,7 +939,7 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
 
         logger.debug(f"Calling LLM ({model_name}) for project {project_id} naming.")
-        response = await make_llm_api_call(messages=messages, model_name=model_name, max_tokens=20, temperature=0.7)
+        response = await make_llm_api_call(messages=messages, model_name=model_name, max_tokens=20, temperature=0, cache_ttl=AUXILIARY_CACHE_TTL)
 
         generated_name = None
         if response and response.get('choices') and response['choices'][0].get('message'):
@@ -1031,23 +1182,7 @@ async def initiate_agent_with_files(
         logger.info(f"Initiate Agent - User: {user_id} - Initial message added to thread {thread_id}")
 
         # 6. Start Agent Run
-        agent_run = await client.table('agent_runs').insert({
-            "thread_id": thread_id, "status": "running",
-            "started_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-        agent_run_id = agent_run.data[0]['id']
-        logger.info(f"Initiate Agent - User: {user_id} - Agent run created: {agent_run_id} for thread {thread_id}")
-
-        # Register run in Redis
-        instance_key = f"active_run:{instance_id}:{agent_run_id}"
-        try:
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
-        except Exception as e:
-            logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
-
-        # Run agent in background
-        run_agent_background.send(
-            agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        agent_run_id, run_status = await launch_agent_run(client, thread_id, account_id, subscription, dict(
             project_id=project_id,
             model_name=model_name,  # Already resolved above
             enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
@@ -1055,10 +1190,11 @@ async def initiate_agent_with_files(
             agent_config=agent_config,  # Pass agent configuration
             is_agent_builder=is_agent_builder,
             target_agent_id=target_agent_id
-        )
+        ))
+        logger.info(f"Initiate Agent - User: {user_id} - Agent run created: {agent_run_id} for thread {thread_id} (status: {run_status})")
 
         logger.info(f"Initiate Agent - User: {user_id} - Successfully initiated agent. Returning Thread ID: {thread_id}, Agent Run ID: {agent_run_id}")
-        return {"thread_id": thread_id, "agent_run_id": agent_run_id}
+        return {"thread_id": thread_id, "agent_run_id": agent_run_id, "status": run_status}
 
     except Exception as e:
         logger.error(f"Initiate Agent - User: {user_id} - ERROR: {str(e)} - Traceback: {traceback.format_exc()}")
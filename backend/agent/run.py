@@ -1,6 +1,7 @@
 import os
 import json
 import re
+import asyncio
 from uuid import uuid4
 from typing import Optional
 
@@ -34,6 +35,16 @@ from agentpress.tool import SchemaType
 
 load_dotenv()
 
+async def get_iteration_snapshot(client, thread_id: str) -> dict:
+    """Fetch the thread state the agent loop checks before each iteration in one round-trip.
+
+    Returns a dict with latest_message_type, browser_state, image_context and
+    image_context_id. The RPC does not modify the thread; the caller deletes the
+    image_context message once it has been used.
+    """
+    result = await client.rpc('get_agent_iteration_snapshot', {'p_thread_id': thread_id}).execute()
+    return result.data or {}
+
 async def run_agent(
     thread_id: str,
     project_id: str,
@@ -57,7 +68,7 @@ async def run_agent(
 
     if not trace:
         trace = langfuse.trace(name="run_agent", session_id=thread_id, metadata={"project_id": project_id})
-    thread_manager = ThreadManager(trace=trace, is_agent_builder=is_agent_builder, target_agent_id=target_agent_id)
+    thread_manager = ThreadManager(trace=trace, is_agent_builder=is_agent_builder, target_agent_id=target_agent_id, token_model=model_name)
 
     client = await thread_manager.db.client
 
@@ -299,8 +310,11 @@ async def run_agent(
         iteration_count += 1
         logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
 
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
+        # Billing check and thread state snapshot on each iteration, fetched concurrently
+        (can_run, message, subscription), snapshot = await asyncio.gather(
+            check_billing_status(client, account_id),
+            get_iteration_snapshot(client, thread_id)
+        )
         if not can_run:
             error_msg = f"Billing limit reached: {message}"
             trace.event(name="billing_limit_reached", level="ERROR", status_message=(f"{error_msg}"))
@@ -311,25 +325,21 @@ async def run_agent(
                 "message": error_msg
             }
             break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
-                logger.info(f"Last message was from assistant, stopping execution")
-                trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
-                continue_execution = False
-                break
+        # Check if last message is from assistant
+        if snapshot.get('latest_message_type') == 'assistant':
+            logger.info(f"Last message was from assistant, stopping execution")
+            trace.event(name="last_message_from_assistant", level="DEFAULT", status_message=(f"Last message was from assistant, stopping execution"))
+            continue_execution = False
+            break
 
         # ---- Temporary Message Handling (Browser State & Image Context) ----
         temporary_message = None
         temp_message_content_list = [] # List to hold text/image blocks
 
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
+        # Latest browser_state message; the screenshot base64 is omitted when an image_url exists
+        browser_content = snapshot.get('browser_state')
+        if browser_content:
             try:
-                browser_content = latest_browser_state_msg.data[0]["content"]
                 if isinstance(browser_content, str):
                     browser_content = json.loads(browser_content)
                 screenshot_base64 = browser_content.get("screenshot_base64")
@@ -370,11 +380,12 @@ async def run_agent(
                 logger.error(f"Error parsing browser state: {e}")
                 trace.event(name="error_parsing_browser_state", level="ERROR", status_message=(f"{e}"))
 
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+        # Latest image_context message; deleted once used since it is only shown to the model once
+        image_context_content = snapshot.get('image_context')
+        if image_context_content:
             try:
-                image_context_content = latest_image_context_msg.data[0]["content"] if isinstance(latest_image_context_msg.data[0]["content"], dict) else json.loads(latest_image_context_msg.data[0]["content"])
+                if isinstance(image_context_content, str):
+                    image_context_content = json.loads(image_context_content)
                 base64_image = image_context_content.get("base64")
                 mime_type = image_context_content.get("mime_type")
                 file_path = image_context_content.get("file_path", "unknown file")
@@ -393,7 +404,8 @@ async def run_agent(
                 else:
                     logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
 
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
+                if snapshot.get('image_context_id'):
+                    await client.table('messages').delete().eq('message_id', snapshot['image_context_id']).execute()
             except Exception as e:
                 logger.error(f"Error parsing image context: {e}")
                 trace.event(name="error_parsing_image_context", level="ERROR", status_message=(f"{e}"))
@@ -422,6 +434,9 @@ async def run_agent(
                 llm_temperature=0,
                 llm_max_tokens=max_tokens,
                 tool_choice="auto",
+                # One tool call per turn: the model never continues past a call whose result it
+                # has not seen. With execute_on_invoke that call starts as soon as its <invoke>
+                # closes, and the stream stops there instead of at the end of the block
                 max_xml_tool_calls=1,
                 temporary_message=temporary_message,
                 processor_config=ProcessorConfig(
@@ -429,6 +444,9 @@ async def run_agent(
                     native_tool_calling=False,
                     execute_tools=True,
                     execute_on_stream=True,
+                    execute_on_invoke=True,
+                    stream_coalesce_ms=30,
+                    stream_coalesce_bytes=256,
                     tool_execution_strategy="parallel",
                     xml_adding_strategy="user_message"
                 ),
@@ -7,7 +7,7 @@ import logging
 from typing import Optional, Dict
 import os
 
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_policy
 from agentpress.thread_manager import ThreadManager # Added for __init__ type hint
 from sandbox.tool_base import SandboxToolsBase
 # from sandbox.tool_base import Sandbox # No longer Sandbox direct type
@@ -25,6 +25,7 @@ KEYBOARD_KEYS = [
     'alt+tab', 'alt+f4', 'ctrl+alt+delete'
 ]
 
+@execution_policy(concurrency_group="computer:{project_id}", max_parallel=1, timeout=120)
 class ComputerUseTool(SandboxToolsBase):
     """Computer automation tool for controlling the sandbox browser and GUI."""
     
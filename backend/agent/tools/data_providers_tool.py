@@ -1,13 +1,17 @@
 import json
 from typing import Union, Dict, Any
 
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_policy, cacheable
 from agent.tools.data_providers.LinkedinProvider import LinkedinProvider
 from agent.tools.data_providers.YahooFinanceProvider import YahooFinanceProvider
 from agent.tools.data_providers.AmazonProvider import AmazonProvider
 from agent.tools.data_providers.ZillowProvider import ZillowProvider
 from agent.tools.data_providers.TwitterProvider import TwitterProvider
 
+# Seconds that provider responses are shared across threads
+DATA_PROVIDER_CACHE_TTL = 1800
+
+@execution_policy(concurrency_group="data_providers", max_parallel=5, timeout=120, read_only=True)
 class DataProvidersTool(Tool):
     """Tool for making requests to various data providers."""
 
@@ -85,6 +89,7 @@ Use this tool when you need to discover what endpoints are available.
                 simplified_message += "..."
             return self.fail_response(simplified_message)
 
+    @cacheable(ttl=DATA_PROVIDER_CACHE_TTL)
     @openapi_schema({
         "type": "function",
         "function": {
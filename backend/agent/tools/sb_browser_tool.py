@@ -1,13 +1,14 @@
 import traceback
 import json
 
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, openapi_schema, xml_schema, execution_policy
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
 from utils.s3_upload_utils import upload_base64_image
 
 
+@execution_policy(concurrency_group="browser:{project_id}", max_parallel=1, timeout=300)
 class SandboxBrowserTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities."""
     
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, openapi_schema, xml_schema, execution_policy
 from sandbox.tool_base import SandboxToolsBase
 from utils.files_utils import clean_path
 from agentpress.thread_manager import ThreadManager
@@ -8,6 +8,7 @@ from agentpress.thread_manager import ThreadManager
 # Load environment variables
 load_dotenv()
 
+@execution_policy(concurrency_group="workspace:{project_id}")
 class SandboxDeployTool(SandboxToolsBase):
     """Tool for deploying static websites from a Daytona sandbox to Cloudflare Pages."""
 
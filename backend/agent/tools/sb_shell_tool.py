@@ -1,10 +1,13 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
 import time
+import asyncio
 from uuid import uuid4
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, openapi_schema, xml_schema, execution_policy
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
 
+# Commands run one at a time, in their own group so a blocking command does not hold up file operations
+@execution_policy(concurrency_group="shell:{project_id}")
 class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
     Uses sessions for maintaining state between commands and provides comprehensive process management."""
@@ -12,6 +15,7 @@ class SandboxShellTool(SandboxToolsBase):
     def __init__(self, project_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self._sessions: Dict[str, str] = {}  # Maps session names to session IDs
+        self._blocking_sessions: Set[str] = set()  # tmux sessions of blocking commands in progress
         self.workspace_path = "/workspace"  # Ensure we're always operating in /workspace
 
     async def _ensure_session(self, session_name: str = "default") -> str:
@@ -146,10 +150,11 @@ class SandboxShellTool(SandboxToolsBase):
             
             if blocking:
                 # For blocking execution, wait and capture output
+                self._blocking_sessions.add(session_name)
                 start_time = time.time()
                 while (time.time() - start_time) < timeout:
-                    # Wait a bit before checking
-                    time.sleep(2)
+                    # Wait a bit before checking; yields to the event loop so the call can be cancelled
+                    await asyncio.sleep(2)
                     
                     # Check if session still exists (command might have exited)
                     check_result = await self._execute_raw_command(f"tmux has-session -t {session_name} 2>/dev/null || echo 'ended'")
@@ -172,6 +177,7 @@ class SandboxShellTool(SandboxToolsBase):
                 
                 # Kill the session after capture
                 await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+                self._blocking_sessions.discard(session_name)
                 
                 return self.success_response({
                     "output": final_output,
@@ -190,6 +196,7 @@ class SandboxShellTool(SandboxToolsBase):
                 
         except Exception as e:
             # Attempt to clean up session in case of error
+            self._blocking_sessions.discard(session_name)
             if session_name:
                 try:
                     await self._execute_raw_command(f"tmux kill-session -t {session_name}")
@@ -230,6 +237,7 @@ class SandboxShellTool(SandboxToolsBase):
             "exit_code": response.exit_code
         }
 
+    @execution_policy(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -308,6 +316,8 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error checking command output: {str(e)}")
 
+    # Runs immediately, even while a blocking command holds the shell group
+    @execution_policy()
     @openapi_schema({
         "type": "function",
         "function": {
@@ -361,6 +371,7 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error terminating command: {str(e)}")
 
+    @execution_policy(read_only=True)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -414,6 +425,17 @@ class SandboxShellTool(SandboxToolsBase):
         except Exception as e:
             return self.fail_response(f"Error listing commands: {str(e)}")
 
+    async def on_cancel(self, method_name: str, arguments: Dict[str, Any]):
+        """Kill the tmux sessions of blocking commands interrupted by a stop."""
+        if method_name != "execute_command":
+            return
+        for session_name in list(self._blocking_sessions):
+            try:
+                await self._execute_raw_command(f"tmux kill-session -t {session_name}")
+            except Exception as e:
+                print(f"Warning: Failed to kill session {session_name} on cancel: {str(e)}")
+            self._blocking_sessions.discard(session_name)
+
     async def cleanup(self):
         """Clean up all sessions."""
         for session_name in list(self._sessions.keys()):
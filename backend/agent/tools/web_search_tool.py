@@ -1,7 +1,8 @@
 from tavily import AsyncTavilyClient
 import httpx
 from dotenv import load_dotenv
-from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, execution_policy, cacheable
+from agentpress.tool_cache import tool_result_cache
 from utils.config import config
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
@@ -13,6 +14,11 @@ import logging
 
 # TODO: add subpages, etc... in filters as sometimes its necessary 
 
+# Seconds that search results and scraped pages are shared across threads
+WEB_SEARCH_CACHE_TTL = 3600
+SCRAPE_CACHE_TTL = 3600
+
+@execution_policy(concurrency_group="web_search", max_parallel=5, read_only=True)
 class SandboxWebSearchTool(SandboxToolsBase):
     """Tool for performing web searches using Tavily API and web scraping using Firecrawl."""
 
@@ -33,6 +39,7 @@ class SandboxWebSearchTool(SandboxToolsBase):
         # Tavily asynchronous search client
         self.tavily_client = AsyncTavilyClient(api_key=self.tavily_api_key)
 
+    @cacheable(ttl=WEB_SEARCH_CACHE_TTL)
     @openapi_schema({
         "type": "function",
         "function": {
@@ -264,6 +271,53 @@ class SandboxWebSearchTool(SandboxToolsBase):
             logging.error(f"Error in scrape_webpage: {error_message}")
             return self.fail_response(f"Error processing scrape request: {error_message[:200]}")
     
+    async def _fetch_with_firecrawl(self, url: str) -> dict:
+        """
+        Fetch a page through the Firecrawl scrape endpoint, retrying on timeouts.
+        """
+        logging.info(f"Sending request to Firecrawl for URL: {url}")
+        async with httpx.AsyncClient() as client:
+            headers = {
+                "Authorization": f"Bearer {self.firecrawl_api_key}",
+                "Content-Type": "application/json",
+            }
+            payload = {
+                "url": url,
+                "formats": ["markdown"]
+            }
+            
+            # Use longer timeout and retry logic for more reliability
+            max_retries = 3
+            timeout_seconds = 120
+            retry_count = 0
+            
+            while retry_count < max_retries:
+                try:
+                    logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
+                    response = await client.post(
+                        f"{self.firecrawl_url}/v1/scrape",
+                        json=payload,
+                        headers=headers,
+                        timeout=timeout_seconds,
+                    )
+                    response.raise_for_status()
+                    data = response.json()
+                    logging.info(f"Successfully received response from Firecrawl for {url}")
+                    break
+                except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
+                    retry_count += 1
+                    logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
+                    if retry_count >= max_retries:
+                        raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
+                    # Exponential backoff
+                    logging.info(f"Waiting {2 ** retry_count}s before retry")
+                    await asyncio.sleep(2 ** retry_count)
+                except Exception as e:
+                    # Don't retry on non-timeout errors
+                    logging.error(f"Error during scraping: {str(e)}")
+                    raise e
+        return data
+
     async def _scrape_single_url(self, url: str) -> dict:
         """
         Helper function to scrape a single URL and return the result information.
@@ -272,47 +326,14 @@ class SandboxWebSearchTool(SandboxToolsBase):
         
         try:
             # ---------- Firecrawl scrape endpoint ----------
-            logging.info(f"Sending request to Firecrawl for URL: {url}")
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "Authorization": f"Bearer {self.firecrawl_api_key}",
-                    "Content-Type": "application/json",
-                }
-                payload = {
-                    "url": url,
-                    "formats": ["markdown"]
-                }
-                
-                # Use longer timeout and retry logic for more reliability
-                max_retries = 3
-                timeout_seconds = 120
-                retry_count = 0
-                
-                while retry_count < max_retries:
-                    try:
-                        logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
-                        response = await client.post(
-                            f"{self.firecrawl_url}/v1/scrape",
-                            json=payload,
-                            headers=headers,
-                            timeout=timeout_seconds,
-                        )
-                        response.raise_for_status()
-                        data = response.json()
-                        logging.info(f"Successfully received response from Firecrawl for {url}")
-                        break
-                    except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
-                        retry_count += 1
-                        logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
-                        if retry_count >= max_retries:
-                            raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
-                        # Exponential backoff
-                        logging.info(f"Waiting {2 ** retry_count}s before retry")
-                        await asyncio.sleep(2 ** retry_count)
-                    except Exception as e:
-                        # Don't retry on non-timeout errors
-                        logging.error(f"Error during scraping: {str(e)}")
-                        raise e
+            # The page content is shared across threads; the file below is written
+            # to this thread's sandbox either way
+            data = await tool_result_cache.get_value("firecrawl_scrape", {"url": url})
+            if data is None:
+                data = await self._fetch_with_firecrawl(url)
+                await tool_result_cache.set_value("firecrawl_scrape", {"url": url}, data, SCRAPE_CACHE_TTL)
+            else:
+                logging.info(f"Using cached Firecrawl response for {url}")
 
             # Format the response
             title = data.get("data", {}).get("metadata", {}).get("title", "")
@@ -6,17 +6,23 @@ reaching the context window limitations of LLM models.
 """
 
 import json
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
 
 from litellm import token_counter, completion_cost
 from services.supabase import DBConnection
-from services.llm import make_llm_api_call
+from services.llm import make_llm_api_call, AUXILIARY_CACHE_TTL
+from services import redis
 from utils.logger import logger
 
 # Constants for token management
 DEFAULT_TOKEN_THRESHOLD = 120000  # 80k tokens threshold for summarization
 SUMMARY_TARGET_TOKENS = 10000    # Target ~10k tokens for the summary message
 RESERVE_TOKENS = 5000            # Reserve tokens for new messages
+SUMMARY_SOFT_THRESHOLD_RATIO = 0.7  # Schedule a background summary at 70% of the threshold
+SUMMARY_CHUNK_TOKENS = 60000     # Max conversation tokens sent in a single summarization call
+SUMMARY_MAX_DEPTH = 4            # Max levels of hierarchical summarization
+SUMMARY_LOCK_TTL = 600           # Seconds a scheduled summary blocks rescheduling for the thread
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
@@ -29,6 +35,16 @@ class ContextManager:
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        self.soft_token_threshold = int(token_threshold * SUMMARY_SOFT_THRESHOLD_RATIO)
+
+    def summary_window_threshold(self, prompt_tokens: int = 0) -> int:
+        """Tokens of the summary window at which the context crosses the soft threshold.
+
+        The soft threshold applies to the whole context, system prompt and latest summary
+        included, while summarization only sees the messages after the summary. Windows smaller than a summary are never
+        worth summarizing, whatever the prompt size.
+        """
+        return max(self.soft_token_threshold - prompt_tokens, SUMMARY_TARGET_TOKENS)
     
     async def get_thread_token_count(self, thread_id: str) -> int:
         """Get the current token count for a thread using LiteLLM.
@@ -59,6 +75,50 @@ class ContextManager:
         except Exception as e:
             logger.error(f"Error getting token count: {str(e)}")
             return 0
+
+    async def _get_summary_window(self, thread_id: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get the messages after the most recent summary and the created_at of the newest one.
+        
+        The window is resolved server-side by the get_llm_message_window SQL function,
+        so only the latest summary and the messages after it are transferred.
+        
+        Args:
+            thread_id: ID of the thread to get messages from
+            
+        Returns:
+            Tuple of (messages to summarize, created_at of the last message or None)
+        """
+        client = await self.db.client
+        result = await client.rpc('get_llm_message_window', {'p_thread_id': thread_id}).execute()
+
+        # Parse the message content if needed
+        messages = []
+        last_created_at = None
+        for msg in result.data or []:
+            # Skip existing summary messages - we don't want to summarize summaries
+            if msg.get('type') == 'summary':
+                logger.debug(f"Skipping summary message from {msg.get('created_at')}")
+                continue
+                
+            # Parse content if it's a string
+            content = msg['content']
+            if isinstance(content, str):
+                try:
+                    content = json.loads(content)
+                except json.JSONDecodeError:
+                    pass  # Keep as string if not valid JSON
+            
+            # Ensure we have the proper format for the LLM
+            if 'role' not in content and 'type' in msg:
+                # Convert message type to role if needed
+                role = msg['type']
+                if role == 'assistant' or role == 'user' or role == 'system' or role == 'tool':
+                    content = {'role': role, 'content': content}
+            
+            messages.append(content)
+            last_created_at = msg.get('created_at') or last_created_at
+
+        return messages, last_created_at
     
     async def get_messages_for_summarization(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all LLM messages from the thread that need to be summarized.
@@ -74,64 +134,9 @@ class ContextManager:
             List of message objects to summarize
         """
         logger.debug(f"Getting messages for summarization for thread {thread_id}")
-        client = await self.db.client
         
         try:
-            # Find the most recent summary message
-            summary_result = await client.table('messages').select('created_at') \
-                .eq('thread_id', thread_id) \
-                .eq('type', 'summary') \
-                .eq('is_llm_message', True) \
-                .order('created_at', desc=True) \
-                .limit(1) \
-                .execute()
-            
-            # Get messages after the most recent summary or all messages if no summary
-            if summary_result.data and len(summary_result.data) > 0:
-                last_summary_time = summary_result.data[0]['created_at']
-                logger.debug(f"Found last summary at {last_summary_time}")
-                
-                # Get all messages after the summary, but NOT including the summary itself
-                messages_result = await client.table('messages').select('*') \
-                    .eq('thread_id', thread_id) \
-                    .eq('is_llm_message', True) \
-                    .gt('created_at', last_summary_time) \
-                    .order('created_at') \
-                    .execute()
-            else:
-                logger.debug("No previous summary found, getting all messages")
-                # Get all messages
-                messages_result = await client.table('messages').select('*') \
-                    .eq('thread_id', thread_id) \
-                    .eq('is_llm_message', True) \
-                    .order('created_at') \
-                    .execute()
-            
-            # Parse the message content if needed
-            messages = []
-            for msg in messages_result.data:
-                # Skip existing summary messages - we don't want to summarize summaries
-                if msg.get('type') == 'summary':
-                    logger.debug(f"Skipping summary message from {msg.get('created_at')}")
-                    continue
-                    
-                # Parse content if it's a string
-                content = msg['content']
-                if isinstance(content, str):
-                    try:
-                        content = json.loads(content)
-                    except json.JSONDecodeError:
-                        pass  # Keep as string if not valid JSON
-                
-                # Ensure we have the proper format for the LLM
-                if 'role' not in content and 'type' in msg:
-                    # Convert message type to role if needed
-                    role = msg['type']
-                    if role == 'assistant' or role == 'user' or role == 'system' or role == 'tool':
-                        content = {'role': role, 'content': content}
-                
-                messages.append(content)
-            
+            messages, _ = await self._get_summary_window(thread_id)
             logger.info(f"Got {len(messages)} messages to summarize for thread {thread_id}")
             return messages
             
@@ -139,32 +144,49 @@ class ContextManager:
             logger.error(f"Error getting messages for summarization: {str(e)}", exc_info=True)
             return []
     
-    async def create_summary(
-        self, 
-        thread_id: str, 
-        messages: List[Dict[str, Any]], 
-        model: str = "gpt-4o-mini"
-    ) -> Optional[Dict[str, Any]]:
-        """Generate a summary of conversation messages.
+    def _format_messages_for_summary(self, messages: List[Dict[str, Any]]) -> str:
+        """Render messages as plain role-prefixed text for the summarizer."""
+        parts = []
+        for msg in messages:
+            role = msg.get('role', 'unknown') if isinstance(msg, dict) else 'unknown'
+            content = msg.get('content', '') if isinstance(msg, dict) else msg
+            if not isinstance(content, str):
+                content = json.dumps(content, default=str)
+            parts.append(f"[{role}]: {content}")
+        return "\n\n".join(parts)
+
+    def _chunk_messages(self, messages: List[Dict[str, Any]], max_chunk_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[List[Dict[str, Any]]]:
+        """Split messages into consecutive chunks that each fit in one summarization call.
         
-        Args:
-            thread_id: ID of the thread to summarize
-            messages: Messages to summarize
-            model: LLM model to use for summarization
-            
-        Returns:
-            Summary message object or None if summarization failed
+        A single message larger than a chunk is truncated so it fits on its own.
         """
-        if not messages:
-            logger.warning("No messages to summarize")
-            return None
-        
-        logger.info(f"Creating summary for thread {thread_id} with {len(messages)} messages")
-        
+        chunks = []
+        current_chunk = []
+        current_tokens = 0
+        for msg in messages:
+            if not isinstance(msg, dict):
+                msg = {"role": "user", "content": str(msg)}
+            msg_tokens = token_counter(model="gpt-4", messages=[msg])
+            if msg_tokens > max_chunk_tokens:
+                text = self._format_messages_for_summary([msg])
+                msg = {"role": msg.get('role', 'user'), "content": text[:max_chunk_tokens * 3] + "... (truncated)"}
+                msg_tokens = token_counter(model="gpt-4", messages=[msg])
+            if current_chunk and current_tokens + msg_tokens > max_chunk_tokens:
+                chunks.append(current_chunk)
+                current_chunk = []
+                current_tokens = 0
+            current_chunk.append(msg)
+            current_tokens += msg_tokens
+        if current_chunk:
+            chunks.append(current_chunk)
+        return chunks
+
+    async def _summarize_text(self, history: str, model: str) -> Optional[str]:
+        """Run a single summarization call over already formatted history."""
         # Create system message with summarization instructions
         system_message = {
             "role": "system",
-            "content": f"""You are a specialized summarization assistant. Your task is to create a concise but comprehensive summary of the conversation history.
+            "content": """You are a specialized summarization assistant. Your task is to create a concise but comprehensive summary of the conversation history.
 
 The summary should:
 1. Preserve all key information including decisions, conclusions, and important context
@@ -180,25 +202,82 @@ VERY IMPORTANT: This summary will replace older parts of the conversation in the
 THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
 ===============================================================
 ==================== CONVERSATION HISTORY ====================
-{messages}
+""" + history + """
 ==================== END OF CONVERSATION HISTORY ====================
 ===============================================================
 """
         }
+
+        response = await make_llm_api_call(
+            model_name=model,
+            messages=[system_message, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
+            temperature=0,
+            max_tokens=SUMMARY_TARGET_TOKENS,
+            stream=False,
+            cache_ttl=AUXILIARY_CACHE_TTL
+        )
+
+        if response and hasattr(response, 'choices') and response.choices:
+            return response.choices[0].message.content
+        logger.error("Failed to generate summary: Invalid response")
+        return None
+
+    async def _summarize_messages(self, messages: List[Dict[str, Any]], model: str, depth: int = 0) -> Optional[str]:
+        """Summarize messages hierarchically so no single call exceeds SUMMARY_CHUNK_TOKENS.
+        
+        Each chunk is summarized on its own, then the partial summaries are summarized
+        again until everything fits in one call.
+        """
+        chunks = self._chunk_messages(messages)
+        if len(chunks) > 1 and depth >= SUMMARY_MAX_DEPTH:
+            # Fold every message into the final call, each truncated to an equal share
+            share = max(SUMMARY_CHUNK_TOKENS // len(messages), 1)
+            logger.warning(f"Reached max summarization depth {depth}, truncating {len(messages)} messages to {share} tokens each")
+            chunks = [[msg for chunk in self._chunk_messages(messages, share) for msg in chunk]]
+        if len(chunks) == 1:
+            return await self._summarize_text(self._format_messages_for_summary(chunks[0]), model)
+
+        logger.info(f"Summarizing {len(messages)} messages in {len(chunks)} chunks (depth {depth})")
+        partial_summaries = await asyncio.gather(*[
+            self._summarize_text(self._format_messages_for_summary(chunk), model)
+            for chunk in chunks
+        ])
+        if any(summary is None for summary in partial_summaries):
+            logger.error(f"Failed to summarize {sum(1 for summary in partial_summaries if summary is None)} of {len(chunks)} chunks")
+            return None
+
+        partial_messages = [
+            {"role": "user", "content": f"Summary of part {i + 1} of {len(chunks)} of the conversation:\n{summary}"}
+            for i, summary in enumerate(partial_summaries)
+        ]
+        return await self._summarize_messages(partial_messages, model, depth + 1)
+
+    async def create_summary(
+        self, 
+        thread_id: str, 
+        messages: List[Dict[str, Any]], 
+        model: str = "gpt-4o-mini"
+    ) -> Optional[Dict[str, Any]]:
+        """Generate a summary of conversation messages.
+        
+        Args:
+            thread_id: ID of the thread to summarize
+            messages: Messages to summarize
+            model: LLM model to use for summarization
+            
+        Returns:
+            Summary message object or None if summarization failed
+        """
+        if not messages:
+            logger.warning("No messages to summarize")
+            return None
+        
+        logger.info(f"Creating summary for thread {thread_id} with {len(messages)} messages")
         
         try:
-            # Call LLM to generate summary
-            response = await make_llm_api_call(
-                model_name=model,
-                messages=[system_message, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
-                temperature=0,
-                max_tokens=SUMMARY_TARGET_TOKENS,
-                stream=False
-            )
+            summary_content = await self._summarize_messages(messages, model)
             
-            if response and hasattr(response, 'choices') and response.choices:
-                summary_content = response.choices[0].message.content
-                
+            if summary_content:
                 # Track token usage
                 try:
                     token_count = token_counter(model=model, messages=[{"role": "user", "content": summary_content}])
@@ -232,6 +311,41 @@ The above is a summary of the conversation history. The conversation continues b
         except Exception as e:
             logger.error(f"Error creating summary: {str(e)}", exc_info=True)
             return None
+
+    async def schedule_summary_if_needed(self, thread_id: str, token_count: int, model: str = "gpt-4o-mini", prompt_tokens: int = 0) -> bool:
+        """Enqueue a background summarization job once a thread crosses the soft threshold.
+        
+        A Redis lock per thread keeps the job from being scheduled again while one is
+        pending or running, so the LLM call path never waits on summarization.
+        
+        Args:
+            thread_id: ID of the thread to check
+            token_count: Current token count of the thread's context window
+            model: LLM model to use for summarization
+            prompt_tokens: Tokens of token_count outside the summary window (system prompt
+                and latest summary)
+            
+        Returns:
+            True if a job was scheduled, False otherwise
+        """
+        window_threshold = self.summary_window_threshold(prompt_tokens)
+        if token_count - prompt_tokens < window_threshold:
+            return False
+
+        try:
+            lock_acquired = await redis.set(f"thread_summary_lock:{thread_id}", "scheduled", nx=True, ex=SUMMARY_LOCK_TTL)
+            if not lock_acquired:
+                logger.debug(f"Summarization already scheduled for thread {thread_id}")
+                return False
+
+            # Imported here to avoid a circular import with the worker module
+            from run_agent_background import summarize_thread_background
+            summarize_thread_background.send(thread_id, model, prompt_tokens)
+            logger.info(f"Scheduled background summarization for thread {thread_id} ({token_count - prompt_tokens} >= {window_threshold} window tokens)")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to schedule summarization for thread {thread_id}: {str(e)}", exc_info=True)
+            return False
         
     async def check_and_summarize_if_needed(
         self, 
@@ -252,8 +366,11 @@ The above is a summary of the conversation history. The conversation continues b
             True if summarization was performed, False otherwise
         """
         try:
-            # Get token count using LiteLLM (accurate model-specific counting)
-            token_count = await self.get_thread_token_count(thread_id)
+            # Get messages to summarize
+            messages, summarized_until = await self._get_summary_window(thread_id)
+
+            # Get token count using LiteLLM, with the tokenizer the run counted the context with
+            token_count = token_counter(model=model, messages=messages) if messages else 0
             
             # If token count is below threshold and not forcing, no summarization needed
             if token_count < self.token_threshold and not force:
@@ -266,9 +383,6 @@ The above is a summary of the conversation history. The conversation continues b
             else:
                 logger.info(f"Thread {thread_id} exceeds token threshold ({token_count} >= {self.token_threshold}), summarizing...")
             
-            # Get messages to summarize
-            messages = await self.get_messages_for_summarization(thread_id)
-            
             # If there are too few messages, don't summarize
             if len(messages) < 3:
                 logger.info(f"Thread {thread_id} has too few messages ({len(messages)}) to summarize")
@@ -284,7 +398,7 @@ The above is a summary of the conversation history. The conversation continues b
                     type="summary",
                     content=summary,
                     is_llm_message=True,
-                    metadata={"token_count": token_count}
+                    metadata={"token_count": token_count, "summarized_until": summarized_until}
                 )
                 
                 logger.info(f"Successfully added summary to thread {thread_id}")
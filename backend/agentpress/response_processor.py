@@ -11,19 +11,23 @@ This module handles the processing of LLM responses, including:
 import json
 import re
 import uuid
+import time
 import asyncio
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union, Callable, Literal
 from dataclasses import dataclass
 from utils.logger import logger
-from agentpress.tool import ToolResult
+from agentpress.tool import Tool, ToolResult, ToolExecutionPolicy
+from agentpress.tool_scheduler import tool_scheduler, ToolCallTimeout
+from agentpress.tool_cache import tool_result_cache
 from agentpress.tool_registry import ToolRegistry
 from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.xml_stream_scanner import StreamingXMLScanner
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
 from agentpress.utils.json_helpers import (
     ensure_dict, ensure_list, safe_json_parse, 
-    to_json_string, format_for_yield
+    to_json_string, format_for_yield, IncrementalJSONValidator
 )
 from litellm import token_counter
 
@@ -33,6 +37,9 @@ XmlAddingStrategy = Literal["user_message", "assistant_message", "inline_edit"]
 # Type alias for tool execution strategy
 ToolExecutionStrategy = Literal["sequential", "parallel"]
 
+# Seconds cancelled tool calls get to run their cleanup before the run moves on
+TOOL_CANCEL_GRACE_SECONDS = 5
+
 @dataclass
 class ToolExecutionContext:
     """Context for a tool execution including call details, result, and display info."""
@@ -61,6 +68,13 @@ class ProcessorConfig:
         tool_execution_strategy: How to execute multiple tools ("sequential" or "parallel")
         xml_adding_strategy: How to add XML tool results to the conversation
         max_xml_tool_calls: Maximum number of XML tool calls to process (0 = no limit)
+        execute_on_invoke: With execute_on_stream, start each <invoke> of a <function_calls>
+                           block as soon as it closes; every invoke counts as one XML tool call,
+                           so max_xml_tool_calls can stop the stream inside a block
+        stream_coalesce_ms: Merge consecutive content deltas into one chunk for up to this many
+                            milliseconds (0 = no time window)
+        stream_coalesce_bytes: Merge consecutive content deltas until a chunk reaches this many
+                               characters (0 = no size window); with both at 0 every delta is yielded
     """
 
     xml_tool_calling: bool = True  
@@ -71,6 +85,9 @@ class ProcessorConfig:
     tool_execution_strategy: ToolExecutionStrategy = "sequential"
     xml_adding_strategy: XmlAddingStrategy = "assistant_message"
     max_xml_tool_calls: int = 0  # 0 means no limit
+    execute_on_invoke: bool = False
+    stream_coalesce_ms: int = 0
+    stream_coalesce_bytes: int = 0
     
     def __post_init__(self):
         """Validate configuration after initialization."""
@@ -83,19 +100,26 @@ class ProcessorConfig:
         if self.max_xml_tool_calls < 0:
             raise ValueError("max_xml_tool_calls must be a non-negative integer (0 = no limit)")
 
+        if self.stream_coalesce_ms < 0 or self.stream_coalesce_bytes < 0:
+            raise ValueError("stream_coalesce_ms and stream_coalesce_bytes must be non-negative (0 = disabled)")
+
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
-    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
+    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, flush_messages_callback: Optional[Callable] = None):
         """Initialize the ResponseProcessor.
         
         Args:
             tool_registry: Registry of available tools
             add_message_callback: Callback function to add messages to the thread.
                 MUST return the full saved message object (dict) or None.
+                Status messages are added with write_behind=True.
+            flush_messages_callback: Optional callback that waits until every
+                write-behind message has been persisted. Awaited before a run ends.
         """
         self.tool_registry = tool_registry
         self.add_message = add_message_callback
+        self.flush_messages = flush_messages_callback
         self.trace = trace
         if not self.trace:
             self.trace = langfuse.trace(name="anonymous:response_processor")
@@ -112,6 +136,18 @@ class ResponseProcessor:
         if message_obj:
             return format_for_yield(message_obj)
 
+    def _make_content_chunk(self, thread_id: str, thread_run_id: str, sequence: int, content: str) -> Dict[str, Any]:
+        """Build a transient (unsaved) assistant content chunk for yielding."""
+        now_chunk = datetime.now(timezone.utc).isoformat()
+        return {
+            "sequence": sequence,
+            "message_id": None, "thread_id": thread_id, "type": "assistant",
+            "is_llm_message": True,
+            "content": to_json_string({"role": "assistant", "content": content}),
+            "metadata": to_json_string({"stream_status": "chunk", "thread_run_id": thread_run_id}),
+            "created_at": now_chunk, "updated_at": now_chunk
+        }
+
     async def process_streaming_response(
         self,
         llm_response: AsyncGenerator,
@@ -134,8 +170,13 @@ class ResponseProcessor:
         """
         accumulated_content = ""
         tool_calls_buffer = {}
-        current_xml_content = ""
-        xml_chunks_buffer = []
+        tool_call_validators = {} # index -> IncrementalJSONValidator for the buffered arguments
+        parsed_native_arguments = {} # index -> arguments parsed when the call completed mid-stream
+        xml_scanner = StreamingXMLScanner(
+            self.tool_registry.xml_tools.keys(),
+            emit_invokes=config.execute_on_invoke and config.execute_tools and config.execute_on_stream
+        )
+        xml_chunks_buffer = [] # ScannedXMLChunk objects in the order they were found
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
         tool_index = 0
@@ -165,25 +206,31 @@ class ResponseProcessor:
                    f"Execute on stream={config.execute_on_stream}, Strategy={config.tool_execution_strategy}")
 
         thread_run_id = str(uuid.uuid4())
+        cancelled = False
 
         try:
             # --- Save and Yield Start Events ---
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
             start_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=start_content, 
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
             assist_start_content = {"status_type": "assistant_response_start"}
             assist_start_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=assist_start_content, 
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
             )
             if assist_start_msg_obj: yield format_for_yield(assist_start_msg_obj)
             # --- End Start Events ---
 
             __sequence = 0
+            # Coalescing window for assistant content chunks
+            coalesce_chunks = config.stream_coalesce_ms > 0 or config.stream_coalesce_bytes > 0
+            pending_chunk_parts = []
+            pending_chunk_size = 0
+            pending_chunk_started = 0.0
 
             async for chunk in llm_response:
                 # Extract streaming metadata from chunks
@@ -227,31 +274,30 @@ class ResponseProcessor:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            # Yield ONLY content chunk (don't save)
-                            now_chunk = datetime.now(timezone.utc).isoformat()
-                            yield {
-                                "sequence": __sequence,
-                                "message_id": None, "thread_id": thread_id, "type": "assistant",
-                                "is_llm_message": True,
-                                "content": to_json_string({"role": "assistant", "content": chunk_content}),
-                                "metadata": to_json_string({"stream_status": "chunk", "thread_run_id": thread_run_id}),
-                                "created_at": now_chunk, "updated_at": now_chunk
-                            }
-                            __sequence += 1
+                            # Yield ONLY content chunk (don't save), merging deltas within the coalescing window
+                            if not pending_chunk_parts:
+                                pending_chunk_started = time.monotonic()
+                            pending_chunk_parts.append(chunk_content)
+                            pending_chunk_size += len(chunk_content)
+                            if not coalesce_chunks or \
+                                (config.stream_coalesce_bytes > 0 and pending_chunk_size >= config.stream_coalesce_bytes) or \
+                                (config.stream_coalesce_ms > 0 and (time.monotonic() - pending_chunk_started) * 1000 >= config.stream_coalesce_ms):
+                                yield self._make_content_chunk(thread_id, thread_run_id, __sequence, "".join(pending_chunk_parts))
+                                __sequence += 1
+                                pending_chunk_parts, pending_chunk_size = [], 0
                         else:
                             logger.info("XML tool call limit reached - not yielding more content chunks")
                             self.trace.event(name="xml_tool_call_limit_reached", level="DEFAULT", status_message=(f"XML tool call limit reached - not yielding more content chunks"))
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
+                            # Only the new delta is scanned; complete blocks are returned once
+                            xml_chunks = xml_scanner.feed(chunk_content)
                             for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
                                 xml_chunks_buffer.append(xml_chunk)
-                                result = self._parse_xml_tool_call(xml_chunk)
+                                result = self._parse_xml_tool_call(xml_chunk.xml)
                                 if result:
                                     tool_call, parsing_details = result
                                     xml_tool_call_count += 1
@@ -261,6 +307,12 @@ class ResponseProcessor:
                                     )
 
                                     if config.execute_tools and config.execute_on_stream:
+                                        # Content that precedes the tool call goes out before its status
+                                        if pending_chunk_parts:
+                                            yield self._make_content_chunk(thread_id, thread_run_id, __sequence, "".join(pending_chunk_parts))
+                                            __sequence += 1
+                                            pending_chunk_parts, pending_chunk_size = [], 0
+
                                         # Save and Yield tool_started status
                                         started_msg_obj = await self._yield_and_save_tool_started(context, thread_id, thread_run_id)
                                         if started_msg_obj: yield format_for_yield(started_msg_obj)
@@ -280,6 +332,11 @@ class ResponseProcessor:
 
                     # --- Process Native Tool Call Chunks ---
                     if config.native_tool_calling and delta and hasattr(delta, 'tool_calls') and delta.tool_calls:
+                        # Content that precedes the tool call chunks goes out first
+                        if pending_chunk_parts:
+                            yield self._make_content_chunk(thread_id, thread_run_id, __sequence, "".join(pending_chunk_parts))
+                            __sequence += 1
+                            pending_chunk_parts, pending_chunk_size = [], 0
                         for tool_call_chunk in delta.tool_calls:
                             # Yield Native Tool Call Chunk (transient status, not saved)
                             # ... (safe extraction logic for tool_call_data_chunk) ...
@@ -305,25 +362,33 @@ class ResponseProcessor:
 
                             # --- Buffer and Execute Complete Native Tool Calls ---
                             if not hasattr(tool_call_chunk, 'function'): continue
-                            idx = tool_call_chunk.index if hasattr(tool_call_chunk, 'index') else 0
-                            # ... (buffer update logic remains same) ...
-                            # ... (check complete logic remains same) ...
-                            has_complete_tool_call = False # Placeholder
-                            if (tool_calls_buffer.get(idx) and
-                                tool_calls_buffer[idx]['id'] and
-                                tool_calls_buffer[idx]['function']['name'] and
-                                tool_calls_buffer[idx]['function']['arguments']):
-                                try:
-                                    safe_json_parse(tool_calls_buffer[idx]['function']['arguments'])
-                                    has_complete_tool_call = True
-                                except json.JSONDecodeError: pass
-
+                            idx = tool_call_chunk.index if hasattr(tool_call_chunk, 'index') and tool_call_chunk.index is not None else 0
+                            if idx not in tool_calls_buffer:
+                                tool_calls_buffer[idx] = {'id': None, 'type': 'function', 'function': {'name': None, 'arguments': ''}}
+                                tool_call_validators[idx] = IncrementalJSONValidator()
+                            current_tool = tool_calls_buffer[idx]
+                            if getattr(tool_call_chunk, 'id', None): current_tool['id'] = tool_call_chunk.id
+                            if getattr(tool_call_chunk, 'type', None): current_tool['type'] = tool_call_chunk.type
+                            if getattr(tool_call_chunk.function, 'name', None): current_tool['function']['name'] = tool_call_chunk.function.name
+                            arguments_delta = getattr(tool_call_chunk.function, 'arguments', None)
+                            if arguments_delta:
+                                if not isinstance(arguments_delta, str): arguments_delta = json.dumps(arguments_delta)
+                                current_tool['function']['arguments'] += arguments_delta
+                                # Only the delta is scanned; the buffer is parsed once when complete
+                                tool_call_validators[idx].feed(arguments_delta)
+
+                            has_complete_tool_call = (
+                                idx not in parsed_native_arguments and
+                                current_tool['id'] and
+                                current_tool['function']['name'] and
+                                tool_call_validators[idx].is_complete
+                            )
 
                             if has_complete_tool_call and config.execute_tools and config.execute_on_stream:
-                                current_tool = tool_calls_buffer[idx]
+                                parsed_native_arguments[idx] = safe_json_parse(current_tool['function']['arguments'])
                                 tool_call_data = {
                                     "function_name": current_tool['function']['name'],
-                                    "arguments": safe_json_parse(current_tool['function']['arguments']),
+                                    "arguments": parsed_native_arguments[idx],
                                     "id": current_tool['id']
                                 }
                                 current_assistant_id = last_assistant_message_object['message_id'] if last_assistant_message_object else None
@@ -350,6 +415,12 @@ class ResponseProcessor:
 
             # print() # Add a final newline after the streaming loop finishes
 
+            # Flush content still held in the coalescing window
+            if pending_chunk_parts:
+                yield self._make_content_chunk(thread_id, thread_run_id, __sequence, "".join(pending_chunk_parts))
+                __sequence += 1
+                pending_chunk_parts, pending_chunk_size = [], 0
+
             # --- After Streaming Loop ---
             
             if (
@@ -459,7 +530,7 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": "xml_tool_limit_reached"}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
                 logger.info(f"Stream finished with reason: xml_tool_limit_reached after {xml_tool_call_count} XML tool calls")
@@ -470,9 +541,12 @@ class ResponseProcessor:
                 # ... (Truncate accumulated_content logic) ...
                 if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and xml_chunks_buffer:
                     last_xml_chunk = xml_chunks_buffer[-1]
-                    last_chunk_end_pos = accumulated_content.find(last_xml_chunk) + len(last_xml_chunk)
+                    last_chunk_end_pos = accumulated_content.find(last_xml_chunk.raw) + len(last_xml_chunk.raw)
                     if last_chunk_end_pos > 0:
                         accumulated_content = accumulated_content[:last_chunk_end_pos]
+                        if last_xml_chunk.is_invoke:
+                            # Keep the saved message well-formed after cutting inside a block
+                            accumulated_content += "\n</function_calls>"
 
                 # ... (Extract complete_native_tool_calls logic) ...
                 # Update complete_native_tool_calls from buffer (initialized earlier)
@@ -480,7 +554,7 @@ class ResponseProcessor:
                     for idx, tc_buf in tool_calls_buffer.items():
                         if tc_buf['id'] and tc_buf['function']['name'] and tc_buf['function']['arguments']:
                             try:
-                                args = safe_json_parse(tc_buf['function']['arguments'])
+                                args = parsed_native_arguments[idx] if idx in parsed_native_arguments else safe_json_parse(tc_buf['function']['arguments'])
                                 complete_native_tool_calls.append({
                                     "id": tc_buf['id'], "type": "function",
                                     "function": {"name": tc_buf['function']['name'],"arguments": args}
@@ -512,7 +586,7 @@ class ResponseProcessor:
                     err_content = {"role": "system", "status_type": "error", "message": "Failed to save final assistant message"}
                     err_msg_obj = await self.add_message(
                         thread_id=thread_id, type="status", content=err_content, 
-                        is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                        is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                     )
                     if err_msg_obj: yield format_for_yield(err_msg_obj)
 
@@ -531,15 +605,13 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # The streaming scanner has already collected every complete chunk
                     # Process only chunks not already handled in the stream loop
-                    remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
+                    remaining_limit = max(0, config.max_xml_tool_calls - xml_tool_call_count) if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
 
                     for chunk in xml_chunks_to_process:
-                         parsed_result = self._parse_xml_tool_call(chunk)
+                         parsed_result = self._parse_xml_tool_call(chunk.xml)
                          if parsed_result:
                              tool_call, parsing_details = parsed_result
                              # Avoid adding if already processed during streaming
@@ -646,7 +718,7 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
 
@@ -662,7 +734,7 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": "agent_terminated"}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
                 
@@ -707,7 +779,7 @@ class ResponseProcessor:
                             thread_id=thread_id,
                             type="assistant_response_end",
                             content=assistant_end_content,
-                            is_llm_message=False,
+                            is_llm_message=False, write_behind=True,
                             metadata={"thread_run_id": thread_run_id}
                         )
                         logger.info("Assistant response end saved for stream (before termination)")
@@ -759,7 +831,7 @@ class ResponseProcessor:
                         thread_id=thread_id,
                         type="assistant_response_end",
                         content=assistant_end_content,
-                        is_llm_message=False,
+                        is_llm_message=False, write_behind=True,
                         metadata={"thread_run_id": thread_run_id}
                     )
                     logger.info("Assistant response end saved for stream")
@@ -767,6 +839,15 @@ class ResponseProcessor:
                     logger.error(f"Error saving assistant response end for stream: {str(e)}")
                     self.trace.event(name="error_saving_assistant_response_end_for_stream", level="ERROR", status_message=(f"Error saving assistant response end for stream: {str(e)}"))
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # The run was stopped: stop the LLM stream and the tools still running
+            cancelled = True
+            logger.info(f"Stream processing cancelled for thread {thread_id}")
+            self.trace.event(name="stream_processing_cancelled", level="WARNING", status_message=(f"Stream processing cancelled for thread {thread_id}"))
+            await self._cancel_pending_tool_executions(pending_tool_executions)
+            await self._close_llm_stream(llm_response)
+            raise
+
         except Exception as e:
             logger.error(f"Error processing stream: {str(e)}", exc_info=True)
             self.trace.event(name="error_processing_stream", level="ERROR", status_message=(f"Error processing stream: {str(e)}"))
@@ -774,7 +855,7 @@ class ResponseProcessor:
             err_content = {"role": "system", "status_type": "error", "message": str(e)}
             err_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=err_content, 
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
             if err_msg_obj: yield format_for_yield(err_msg_obj) # Yield the saved error message
             
@@ -789,9 +870,12 @@ class ResponseProcessor:
                 end_content = {"status_type": "thread_run_end"}
                 end_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=end_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                    is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
                 )
-                if end_msg_obj: yield format_for_yield(end_msg_obj)
+                # Barrier: every buffered row of this run is persisted before it ends
+                await self._flush_messages()
+                # Nothing consumes the generator any more once it was cancelled
+                if end_msg_obj and not cancelled: yield format_for_yield(end_msg_obj)
             except Exception as final_e:
                 logger.error(f"Error in finally block: {str(final_e)}", exc_info=True)
                 self.trace.event(name="error_in_finally_block", level="ERROR", status_message=(f"Error in finally block: {str(final_e)}"))
@@ -818,6 +902,7 @@ class ResponseProcessor:
         """
         content = ""
         thread_run_id = str(uuid.uuid4())
+        cancelled = False
         all_tool_data = [] # Stores {'tool_call': ..., 'parsing_details': ...}
         tool_index = 0
         assistant_message_object = None
@@ -830,7 +915,7 @@ class ResponseProcessor:
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
             start_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=start_content,
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
@@ -891,7 +976,7 @@ class ResponseProcessor:
                  err_content = {"role": "system", "status_type": "error", "message": "Failed to save assistant message"}
                  err_msg_obj = await self.add_message(
                      thread_id=thread_id, type="status", content=err_content, 
-                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                     is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                  )
                  if err_msg_obj: yield format_for_yield(err_msg_obj)
 
@@ -946,7 +1031,7 @@ class ResponseProcessor:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
                 finish_msg_obj = await self.add_message(
                     thread_id=thread_id, type="status", content=finish_content, 
-                    is_llm_message=False, metadata={"thread_run_id": thread_run_id}
+                    is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id}
                 )
                 if finish_msg_obj: yield format_for_yield(finish_msg_obj)
 
@@ -966,6 +1051,11 @@ class ResponseProcessor:
                     logger.error(f"Error saving assistant response end for non-stream: {str(e)}")
                     self.trace.event(name="error_saving_assistant_response_end_for_non_stream", level="ERROR", status_message=(f"Error saving assistant response end for non-stream: {str(e)}"))
 
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            logger.info(f"Response processing cancelled for thread {thread_id}")
+            raise
+
         except Exception as e:
              logger.error(f"Error processing non-streaming response: {str(e)}", exc_info=True)
              self.trace.event(name="error_processing_non_streaming_response", level="ERROR", status_message=(f"Error processing non-streaming response: {str(e)}"))
@@ -973,7 +1063,7 @@ class ResponseProcessor:
              err_content = {"role": "system", "status_type": "error", "message": str(e)}
              err_msg_obj = await self.add_message(
                  thread_id=thread_id, type="status", content=err_content, 
-                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                 is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
              )
              if err_msg_obj: yield format_for_yield(err_msg_obj)
              
@@ -987,9 +1077,45 @@ class ResponseProcessor:
             end_content = {"status_type": "thread_run_end"}
             end_msg_obj = await self.add_message(
                 thread_id=thread_id, type="status", content=end_content, 
-                is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
+                is_llm_message=False, write_behind=True, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield format_for_yield(end_msg_obj)
+            await self._flush_messages()
+            if end_msg_obj and not cancelled: yield format_for_yield(end_msg_obj)
+
+    async def _cancel_pending_tool_executions(self, pending_tool_executions: List[Dict[str, Any]]):
+        """Cancel tool tasks still running and give them a bounded time to clean up."""
+        tasks = [execution["task"] for execution in pending_tool_executions if not execution["task"].done()]
+        if not tasks:
+            return
+        logger.info(f"Cancelling {len(tasks)} pending tool executions")
+        self.trace.event(name="cancelling_pending_tool_executions", level="WARNING", status_message=(f"Cancelling {len(tasks)} pending tool executions"))
+        for task in tasks:
+            task.cancel()
+        _, still_running = await asyncio.wait(tasks, timeout=TOOL_CANCEL_GRACE_SECONDS)
+        if still_running:
+            logger.warning(f"{len(still_running)} tool executions did not finish within {TOOL_CANCEL_GRACE_SECONDS}s of cancellation")
+
+    async def _close_llm_stream(self, llm_response: Any):
+        """Close the LLM response stream so its connection is released."""
+        for stream in (llm_response, getattr(llm_response, 'completion_stream', None)):
+            close = getattr(stream, 'aclose', None)
+            if close is None:
+                continue
+            try:
+                await close()
+            except Exception as e:
+                logger.debug(f"Error closing LLM stream: {str(e)}")
+            return
+
+    async def _flush_messages(self):
+        """Wait until every write-behind message has been persisted."""
+        if not self.flush_messages:
+            return
+        try:
+            await self.flush_messages()
+        except Exception as e:
+            logger.error(f"Error flushing buffered messages: {str(e)}", exc_info=True)
+            self.trace.event(name="error_flushing_buffered_messages", level="ERROR", status_message=(f"Error flushing buffered messages: {str(e)}"))
 
     # XML parsing methods
     def _extract_tag_content(self, xml_chunk: str, tag_name: str) -> Tuple[Optional[str], Optional[str]]:
@@ -1317,6 +1443,7 @@ class ResponseProcessor:
     async def _execute_tool(self, tool_call: Dict[str, Any]) -> ToolResult:
         """Execute a single tool call and return the result."""
         span = self.trace.span(name=f"execute_tool.{tool_call['function_name']}", input=tool_call["arguments"])            
+        tool_instance = None
         try:
             function_name = tool_call["function_name"]
             arguments = tool_call["arguments"]
@@ -1341,10 +1468,42 @@ class ResponseProcessor:
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
             
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            tool_instance = getattr(tool_fn, '__self__', None)
+            policy = tool_instance.get_execution_policy(function_name) if isinstance(tool_instance, Tool) else ToolExecutionPolicy()
+            cache_ttl = tool_instance.get_cache_ttl(function_name) if isinstance(tool_instance, Tool) else None
+
+            if cache_ttl:
+                cached_result = await tool_result_cache.get(function_name, arguments)
+                if cached_result:
+                    logger.info(f"Tool cache hit: {function_name}")
+                    self.trace.event(name="tool_cache_hit", level="DEFAULT", status_message=(f"Tool cache hit: {function_name}"))
+                    span.end(status_message="tool_cache_hit", output=cached_result)
+                    return cached_result
+
+            try:
+                result = await tool_scheduler.run(policy, lambda: tool_fn(**arguments), name=function_name)
+            except ToolCallTimeout as e:
+                logger.warning(str(e))
+                span.end(status_message="tool_timeout", level="WARNING")
+                return ToolResult(success=False, output=str(e))
+
+            if cache_ttl and isinstance(result, ToolResult):
+                await tool_result_cache.set(function_name, arguments, result, cache_ttl)
             logger.info(f"Tool execution complete: {function_name} -> {result}")
             span.end(status_message="tool_executed", output=result)
             return result
+        except asyncio.CancelledError:
+            logger.info(f"Tool execution cancelled: {tool_call['function_name']}")
+            if isinstance(tool_instance, Tool):
+                try:
+                    await asyncio.wait_for(
+                        tool_instance.on_cancel(tool_call['function_name'], arguments),
+                        timeout=TOOL_CANCEL_GRACE_SECONDS
+                    )
+                except Exception as e:
+                    logger.warning(f"Cancel hook of tool {tool_call['function_name']} failed: {str(e)}")
+            span.end(status_message="tool_cancelled", level="WARNING")
+            raise
         except Exception as e:
             logger.error(f"Error executing tool {tool_call['function_name']}: {str(e)}", exc_info=True)
             span.end(status_message="tool_execution_error", output=f"Error executing tool: {str(e)}", level="ERROR")
@@ -1443,6 +1602,8 @@ class ResponseProcessor:
         
         This method executes all tool calls simultaneously using asyncio.gather, which
         can significantly improve performance when executing multiple independent tools.
+        Calls that share a concurrency group (e.g. browser actions on one sandbox) are
+        still queued by the tool scheduler according to their execution policy.
         
         Args:
             tool_calls: List of tool calls to execute
@@ -1528,6 +1689,10 @@ class ResponseProcessor:
                 logger.info("Adding parsing_details to tool result metadata")
                 self.trace.event(name="adding_parsing_details_to_tool_result_metadata", level="DEFAULT", status_message=(f"Adding parsing_details to tool result metadata"), metadata={"parsing_details": parsing_details})
             # ---
+
+            # Execution details reported by the tool layer, e.g. cache hits
+            if getattr(result, 'metadata', None):
+                metadata.update(result.metadata)
             
             # Check if this is a native function call (has id field)
             if "id" in tool_call:
@@ -1806,7 +1971,7 @@ class ResponseProcessor:
         }
         metadata = {"thread_run_id": thread_run_id}
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, write_behind=True, metadata=metadata
         )
         return saved_message_obj # Return the full object (or None if saving failed)
 
@@ -1839,7 +2004,7 @@ class ResponseProcessor:
         # <<< END ADDED >>>
 
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, write_behind=True, metadata=metadata
         )
         return saved_message_obj
 
@@ -1857,6 +2022,6 @@ class ResponseProcessor:
         metadata = {"thread_run_id": thread_run_id}
         # Save the status message with is_llm_message=False
         saved_message_obj = await self.add_message(
-            thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
+            thread_id=thread_id, type="status", content=content, is_llm_message=False, write_behind=True, metadata=metadata
         )
         return saved_message_obj
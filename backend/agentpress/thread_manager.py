@@ -11,7 +11,11 @@ This module provides comprehensive conversation management, including:
 """
 
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
+import hashlib
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, Tuple
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
@@ -30,6 +34,20 @@ from litellm import token_counter
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+# Write-behind buffering of messages whose IDs are not needed synchronously
+WRITE_BEHIND_FLUSH_DELAY = 0.05  # seconds to wait for more rows before a background flush
+WRITE_BEHIND_MAX_BATCH = 100     # rows per bulk insert
+WRITE_BEHIND_MAX_ATTEMPTS = 2
+
+@dataclass
+class CompressionPlan:
+    """Result of planning a compression pass over a message list."""
+    messages: List[Dict[str, Any]]
+    original_tokens: int
+    compressed_tokens: int
+    max_tokens: int
+    truncated_message_ids: List[str] = field(default_factory=list)
+
 class ThreadManager:
     """Manages conversation threads with LLM models and tool execution.
 
@@ -38,13 +56,14 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
+    def __init__(self, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, token_model: Optional[str] = None):
         """Initialize ThreadManager.
 
         Args:
             trace: Optional trace client for logging
             is_agent_builder: Whether this is an agent builder session
             target_agent_id: ID of the agent being built (if in agent builder mode)
+            token_model: Model whose tokenizer counts messages added before run_thread sets it
         """
         self.db = DBConnection()
         self.tool_registry = ToolRegistry()
@@ -58,9 +77,23 @@ class ThreadManager:
             add_message_callback=self.add_message,
             trace=self.trace,
             is_agent_builder=self.is_agent_builder,
-            target_agent_id=self.target_agent_id
+            target_agent_id=self.target_agent_id,
+            flush_messages_callback=self.flush_pending_messages
         )
         self.context_manager = ContextManager()
+        # (model, message_id or content hash for id-less messages) -> (content hash, token count)
+        self._token_count_cache: Dict[Tuple[str, str], Tuple[str, int]] = {}
+        # Model whose tokenizer counts new messages in add_message; run_thread sets it to the run's model
+        self._token_model: Optional[str] = token_model
+        # thread_id -> {'messages': [...], 'message_ids': set, 'created_at': {message_id: created_at},
+        #               'cursor': latest created_at, 'summary_window': bool, 'summary_id': latest summary in the window}
+        self._message_cache: Dict[str, Dict[str, Any]] = {}
+        # Rows accepted by add_message(write_behind=True) but not inserted yet
+        self._pending_writes: List[Dict[str, Any]] = []
+        # thread_id -> (latest created_at the database assigned to a row inserted here, buffered rows stamped after it)
+        self._created_at_sequence: Dict[str, Tuple[datetime.datetime, int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
 
     def _is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         if not ("content" in msg and msg['content']):
@@ -76,6 +109,36 @@ class ThreadManager:
                 pass
         return False
     
+    def _message_content_hash(self, msg: Dict[str, Any]) -> str:
+        """Hash a message's content, ignoring the message_id we attach after loading."""
+        payload = {k: v for k, v in msg.items() if k != 'message_id'}
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _count_message_tokens(self, msg: Dict[str, Any], llm_model: Optional[str]) -> int:
+        """Count the tokens of a single message, reusing the cached count while its content is unchanged."""
+        content_hash = self._message_content_hash(msg)
+        cache_key = (llm_model or '', msg.get('message_id') or f"hash:{content_hash}")
+        cached = self._token_count_cache.get(cache_key)
+        if cached and cached[0] == content_hash:
+            return cached[1]
+        token_count = token_counter(model=llm_model, messages=[msg])
+        self._token_count_cache[cache_key] = (content_hash, token_count)
+        return token_count
+
+    def _count_messages_tokens(self, messages: List[Dict[str, Any]], llm_model: Optional[str]) -> int:
+        """Sum the per-message token counts so only new or modified messages are re-tokenized."""
+        return sum(self._count_message_tokens(msg, llm_model) for msg in messages)
+
+    def _seed_token_count(self, message_id: Optional[str], metadata: Optional[Dict[str, Any]]):
+        """Seed the token count cache from counts persisted in message metadata."""
+        if not message_id or not isinstance(metadata, dict):
+            return
+        token_count = metadata.get('llm_token_count')
+        content_hash = metadata.get('llm_content_hash')
+        cache_key = (metadata.get('llm_token_model') or '', message_id)
+        if isinstance(token_count, int) and content_hash and cache_key not in self._token_count_cache:
+            self._token_count_cache[cache_key] = (content_hash, token_count)
+
     def _compress_message(self, msg_content: Union[str, dict], message_id: Optional[str] = None, max_length: int = 3000) -> Union[str, dict]:
         """Compress the message content."""
         # print("max_length", max_length)
@@ -103,106 +166,111 @@ class ThreadManager:
             else:
                 return msg_content
   
-    def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
-        """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-
-        if uncompressed_total_token_count > (max_tokens or (64 * 1000)):
-            _i = 0 # Count the number of ToolResult messages
-            for msg in reversed(messages): # Start from the end and work backwards
-                if self._is_tool_result_message(msg): # Only compress ToolResult messages
-                    _i += 1 # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
-                    if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent ToolResult message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
-        return messages
-
-    def _compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
-        """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-
-        if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
-            _i = 0 # Count the number of User messages
-            for msg in reversed(messages): # Start from the end and work backwards
-                if msg.get('role') == 'user': # Only compress User messages
-                    _i += 1 # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
-                    if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent User message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
-        return messages
-
-    def _compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
-        """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
-            _i = 0 # Count the number of Assistant messages
-            for msg in reversed(messages): # Start from the end and work backwards
-                if msg.get('role') == 'assistant': # Only compress Assistant messages
-                    _i += 1 # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
-                    if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent Assistant message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
-                            
-        return messages
-
-    def _compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: Optional[int] = 4096, max_iterations: int = 5) -> List[Dict[str, Any]]:
-        """Compress the messages.
-            token_threshold: must be a power of 2
-        """
-
+    def _get_model_max_tokens(self, llm_model: str) -> int:
+        """Get the prompt token budget for a model, leaving room for the completion."""
         if 'sonnet' in llm_model.lower():
-            max_tokens = 200 * 1000 - 64000
+            return 200 * 1000 - 64000
         elif 'gpt' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
+            return 128 * 1000 - 28000
         elif 'gemini' in llm_model.lower():
-            max_tokens = 1000 * 1000 - 300000
+            return 1000 * 1000 - 300000
         elif 'deepseek' in llm_model.lower():
-            max_tokens = 128 * 1000 - 28000
+            return 128 * 1000 - 28000
         else:
-            max_tokens = 41 * 1000 - 10000
-
-        if max_iterations <= 0:
-            logger.warning(f"_compress_messages: Max iterations reached, returning uncompressed messages")
-            return messages
+            return 41 * 1000 - 10000
 
-        result = messages
+    def _plan_compression(self, messages: List[Dict[str, Any]], llm_model: str, token_threshold: int = 4096) -> CompressionPlan:
+        """Plan the compression of a message list in a single pass.
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        Candidates are ranked deterministically: older tool results first, then older
+        user messages, then older assistant messages, each oldest first. Every candidate
+        is truncated only as much as needed to bring the total within the model budget,
+        never below token_threshold // 16 tokens. The most recent message of each kind is
+        never compressed, only safe-truncated to the model budget.
 
-        result = self._compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
-        result = self._compress_user_messages(result, llm_model, max_tokens, token_threshold)
-        result = self._compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
-
-        compressed_token_count = token_counter(model=llm_model, messages=result)
-
-        logger.info(f"_compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}") # Log the token compression for debugging later
-
-        if (compressed_token_count > max_tokens):
-            logger.warning(f"Further token compression is needed: {compressed_token_count} > {max_tokens}")
-            result = self._compress_messages(messages, llm_model, max_tokens, int(token_threshold / 2), max_iterations - 1)
-
-        return result
+        The input list and its messages are not modified; truncated messages are copies.
+        """
+        max_tokens = self._get_model_max_tokens(llm_model)
+        token_counts = [self._count_message_tokens(msg, llm_model) for msg in messages]
+        original_tokens = sum(token_counts)
+
+        plan = CompressionPlan(
+            messages=messages,
+            original_tokens=original_tokens,
+            compressed_tokens=original_tokens,
+            max_tokens=max_tokens
+        )
+        if original_tokens <= max_tokens:
+            return plan
+
+        # Bucket messages by kind; a message belongs to the first kind it matches
+        tool_results, user_messages, assistant_messages = [], [], []
+        for i, msg in enumerate(messages):
+            if self._is_tool_result_message(msg):
+                tool_results.append(i)
+            elif msg.get('role') == 'user':
+                user_messages.append(i)
+            elif msg.get('role') == 'assistant':
+                assistant_messages.append(i)
+
+        result = list(messages)
+        total_tokens = original_tokens
+
+        # The latest message of each kind is kept whole unless it alone blows the budget
+        for bucket in (tool_results, user_messages, assistant_messages):
+            if not bucket:
+                continue
+            i = bucket.pop()
+            msg = result[i]
+            if token_counts[i] > token_threshold and isinstance(msg.get('content'), (str, dict)):
+                truncated = dict(msg)
+                truncated['content'] = self._safe_truncate(msg['content'], int(max_tokens * 2))
+                if truncated['content'] is msg['content']:
+                    continue
+                new_count = token_counter(model=llm_model, messages=[truncated])
+                total_tokens -= token_counts[i] - new_count
+                token_counts[i] = new_count
+                result[i] = truncated
+                if msg.get('message_id'):
+                    plan.truncated_message_ids.append(msg['message_id'])
+
+        min_tokens = max(token_threshold // 16, 1)
+        for i in tool_results + user_messages + assistant_messages:
+            if total_tokens <= max_tokens:
+                break
+            msg = result[i]
+            if token_counts[i] <= min_tokens or not isinstance(msg.get('content'), (str, dict)):
+                continue
+            message_id = msg.get('message_id')
+            if not message_id:
+                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
+                continue
+
+            target_tokens = max(min_tokens, token_counts[i] - (total_tokens - max_tokens))
+            compressed = dict(msg)
+            compressed['content'] = self._compress_message(msg['content'], message_id, target_tokens * 3)
+            new_count = token_counter(model=llm_model, messages=[compressed])
+            if new_count >= token_counts[i]:
+                continue
+            total_tokens -= token_counts[i] - new_count
+            token_counts[i] = new_count
+            result[i] = compressed
+            plan.truncated_message_ids.append(message_id)
+
+        plan.messages = result
+        plan.compressed_tokens = total_tokens
+        return plan
+
+    def _compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, token_threshold: int = 4096) -> List[Dict[str, Any]]:
+        """Compress the messages to fit the model's context budget."""
+        plan = self._plan_compression(messages, llm_model, token_threshold)
+
+        if plan.truncated_message_ids:
+            logger.info(f"_compress_messages: {plan.original_tokens} -> {plan.compressed_tokens}, truncated {len(plan.truncated_message_ids)} messages: {plan.truncated_message_ids}")
+        if plan.compressed_tokens > plan.max_tokens:
+            logger.warning(f"_compress_messages: could not fit messages into budget: {plan.compressed_tokens} > {plan.max_tokens}")
+
+        return plan.messages
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -214,7 +282,8 @@ class ThreadManager:
         type: str,
         content: Union[Dict[str, Any], List[Any], str],
         is_llm_message: bool = False,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        write_behind: bool = False
     ):
         """Add a message to the thread in the database.
 
@@ -227,17 +296,45 @@ class ThreadManager:
                             Defaults to False (user message).
             metadata: Optional dictionary for additional message metadata.
                       Defaults to None, stored as an empty JSONB object if None.
+            write_behind: Buffer the row and insert it in a background bulk insert
+                          instead of waiting for the database. The message_id is
+                          generated client-side, created_at follows the thread's last
+                          directly inserted row, and the returned row is built locally.
+                          Ignored for LLM messages, which are cached and counted by
+                          their persisted row, and for the first message of a thread
+                          in this manager, whose database timestamp the others follow.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id}")
+
+        # Buffered rows are stamped after a row this manager inserted, so the first one is written directly
+        if write_behind and not is_llm_message and thread_id in self._created_at_sequence:
+            return self._buffer_message(thread_id, type, content, metadata)
+
         client = await self.db.client
 
+        metadata = dict(metadata or {})
+        token_entry = None
+        if is_llm_message and self._token_model:
+            # Count tokens once at write time so later runs can sum persisted counts;
+            # without a model the count would come from the wrong tokenizer
+            try:
+                llm_content = json.loads(content) if isinstance(content, str) else content
+                if isinstance(llm_content, dict):
+                    content_hash = self._message_content_hash(llm_content)
+                    token_entry = (content_hash, token_counter(model=self._token_model, messages=[llm_content]))
+                    metadata['llm_token_count'] = token_entry[1]
+                    metadata['llm_content_hash'] = content_hash
+                    metadata['llm_token_model'] = self._token_model
+            except Exception as e:
+                logger.warning(f"Failed to count tokens for new message in thread {thread_id}: {str(e)}")
+
         # Prepare data for insertion
         data_to_insert = {
             'thread_id': thread_id,
             'type': type,
             'content': content,
             'is_llm_message': is_llm_message,
-            'metadata': metadata or {},
+            'metadata': metadata,
         }
 
         try:
@@ -246,6 +343,11 @@ class ThreadManager:
             logger.info(f"Successfully added message to thread {thread_id}")
 
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
+                self._note_created_at(thread_id, result.data[0].get('created_at'))
+                if token_entry:
+                    self._token_count_cache[(self._token_model, result.data[0]['message_id'])] = token_entry
+                if is_llm_message:
+                    self._append_to_message_cache(thread_id, result.data[0])
                 return result.data[0]
             else:
                 logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
@@ -254,14 +356,151 @@ class ThreadManager:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
             raise
 
-    async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+    def _buffer_message(
+        self,
+        thread_id: str,
+        type: str,
+        content: Union[Dict[str, Any], List[Any], str],
+        metadata: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Queue a non-LLM message for a background bulk insert and return its row."""
+        now = self._next_buffered_created_at(thread_id)
+        row = {
+            'message_id': str(uuid.uuid4()),
+            'thread_id': thread_id,
+            'type': type,
+            'content': content,
+            'is_llm_message': False,
+            'metadata': dict(metadata or {}),
+            'created_at': now,
+            'updated_at': now,
+        }
+        self._pending_writes.append(row)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending_messages_later())
+        return dict(row)
+
+    def _note_created_at(self, thread_id: str, created_at: Optional[str]):
+        """Record the created_at the database assigned to an inserted row; buffered rows are stamped after it."""
+        if not created_at:
+            return
+        try:
+            stamp = datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        except ValueError:
+            return
+        latest = self._created_at_sequence.get(thread_id)
+        if latest is None or stamp > latest[0]:
+            self._created_at_sequence[thread_id] = (stamp, 0)
+
+    def _next_buffered_created_at(self, thread_id: str) -> str:
+        """created_at of the next buffered row of a thread.
+
+        Rows are stamped a microsecond apart after the latest database-assigned
+        created_at, so they sort after the rows inserted before them and before
+        those inserted after, whatever the skew between this clock and the
+        database's.
+        """
+        stamp, count = self._created_at_sequence[thread_id]
+        self._created_at_sequence[thread_id] = (stamp, count + 1)
+        return (stamp + datetime.timedelta(microseconds=count + 1)).isoformat()
+
+    async def _flush_pending_messages_later(self):
+        """Background flush, delayed briefly so rows added close together share an insert."""
+        await asyncio.sleep(WRITE_BEHIND_FLUSH_DELAY)
+        await self.flush_pending_messages(keep_failed=True)
+
+    async def flush_pending_messages(self, keep_failed: bool = False):
+        """Insert every buffered write-behind message.
+
+        Acts as a barrier: when it returns, every row buffered before the call
+        has been written (or its failure logged with the message IDs). Call it
+        before a run is reported as complete so readers of the messages table
+        see all rows.
+
+        Args:
+            keep_failed: Keep a batch that still fails after WRITE_BEHIND_MAX_ATTEMPTS
+                         buffered for the next flush instead of dropping it; used by
+                         background flushes, so only a barrier gives up on rows
+        """
+        async with self._flush_lock:
+            while self._pending_writes:
+                batch = self._pending_writes[:WRITE_BEHIND_MAX_BATCH]
+                del self._pending_writes[:WRITE_BEHIND_MAX_BATCH]
+                for attempt in range(1, WRITE_BEHIND_MAX_ATTEMPTS + 1):
+                    try:
+                        client = await self.db.client
+                        await client.table('messages').insert(batch, returning='minimal').execute()
+                        logger.debug(f"Flushed {len(batch)} buffered messages")
+                        break
+                    except Exception as e:
+                        if attempt < WRITE_BEHIND_MAX_ATTEMPTS:
+                            logger.warning(f"Failed to flush {len(batch)} buffered messages (attempt {attempt}): {str(e)}")
+                            continue
+                        if keep_failed:
+                            logger.warning(f"Keeping {len(batch)} buffered messages for the next flush: {str(e)}")
+                            self._pending_writes[:0] = batch
+                            return
+                        message_ids = [row['message_id'] for row in batch]
+                        logger.error(f"Dropping {len(batch)} buffered messages after failed flush: {str(e)}; message_ids: {message_ids}", exc_info=True)
+                        self.trace.event(name="failed_to_flush_buffered_messages", level="ERROR", status_message=(f"Dropping {len(batch)} buffered messages after failed flush: {str(e)}; message_ids: {message_ids}"))
+
+    def _parse_llm_message_row(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Turn a messages row into an LLM message dict carrying its message_id."""
+        self._seed_token_count(item['message_id'], item.get('metadata'))
+        if isinstance(item['content'], str):
+            try:
+                parsed_item = json.loads(item['content'])
+                parsed_item['message_id'] = item['message_id']
+                return parsed_item
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse message: {item['content']}")
+                return None
+        content = item['content']
+        content['message_id'] = item['message_id']
+        return content
+
+    def _append_to_message_cache(self, thread_id: str, item: Dict[str, Any]):
+        """Append a freshly inserted or fetched row to the thread's message cache."""
+        cache = self._message_cache.get(thread_id)
+        if cache is None or item['message_id'] in cache['message_ids']:
+            return
+        message = self._parse_llm_message_row(item)
+        if message is None:
+            return
+        created_at = item.get('created_at')
+        if cache['summary_window'] and item.get('type') == 'summary':
+            # A new summary replaces everything it covers; it opens the window
+            window_start = (item.get('metadata') or {}).get('summarized_until') or created_at
+            kept = [m for m in cache['messages'] if window_start and cache['created_at'].get(m['message_id'], '') > window_start]
+            cache['messages'] = [message] + kept
+            cache['message_ids'] = {m['message_id'] for m in cache['messages']}
+            cache['created_at'] = {mid: ts for mid, ts in cache['created_at'].items() if mid in cache['message_ids']}
+            cache['summary_id'] = item['message_id']
+        else:
+            cache['messages'].append(message)
+            cache['message_ids'].add(item['message_id'])
+        cache['created_at'][item['message_id']] = created_at or ''
+        if created_at and (cache['cursor'] is None or created_at > cache['cursor']):
+            cache['cursor'] = created_at
+
+    def _copy_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy a cached message deeply enough that callers can modify it in place."""
+        copied = dict(message)
+        if isinstance(copied.get('content'), list):
+            copied['content'] = [dict(part) if isinstance(part, dict) else part for part in copied['content']]
+        return copied
+
+    async def get_llm_messages(self, thread_id: str, summary_window: bool = False) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
 
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        The first call for a thread loads the history; later calls only fetch
+        rows created since the newest cached message, and messages written through
+        add_message are appended to the cache directly.
 
         Args:
             thread_id: The ID of the thread to get messages for.
+            summary_window: Only load the latest summary and the messages after it,
+                            using the get_llm_message_window SQL function.
 
         Returns:
             List of message objects.
@@ -270,29 +509,29 @@ class ThreadManager:
         client = await self.db.client
 
         try:
-            # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').execute()
-
-            # Parse the returned data which might be stringified JSON
-            if not result.data:
-                return []
+            cache = self._message_cache.get(thread_id)
+            if cache is not None and cache['summary_window'] != summary_window:
+                cache = None
 
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result.data:
-                if isinstance(item['content'], str):
-                    try:
-                        parsed_item = json.loads(item['content'])
-                        parsed_item['message_id'] = item['message_id']
-                        messages.append(parsed_item)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse message: {item['content']}")
+            if cache is None:
+                if summary_window:
+                    result = await client.rpc('get_llm_message_window', {'p_thread_id': thread_id}).execute()
                 else:
-                    content = item['content']
-                    content['message_id'] = item['message_id']
-                    messages.append(content)
+                    result = await client.table('messages').select('message_id, type, content, metadata, created_at').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').execute()
+                cache = {'messages': [], 'message_ids': set(), 'created_at': {}, 'cursor': None, 'summary_window': summary_window, 'summary_id': None}
+                self._message_cache[thread_id] = cache
+            else:
+                query = client.table('messages').select('message_id, type, content, metadata, created_at').eq('thread_id', thread_id).eq('is_llm_message', True)
+                if cache['cursor'] is not None:
+                    # Delta fetch; gte plus message_id dedupe tolerates equal timestamps
+                    query = query.gte('created_at', cache['cursor'])
+                result = await query.order('created_at').execute()
+
+            for item in result.data or []:
+                self._append_to_message_cache(thread_id, item)
 
-            return messages
+            # Hand out copies so compression and request preparation never touch the cache
+            return [self._copy_message(message) for message in cache['messages']]
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
@@ -349,6 +588,7 @@ class ThreadManager:
 
         # Log model info
         logger.info(f"🤖 Thread {thread_id}: Using model {llm_model}")
+        self._token_model = llm_model
 
         # Apply max_xml_tool_calls if specified and not already set in config
         if max_xml_tool_calls > 0 and not processor_config.max_xml_tool_calls:
@@ -411,34 +651,27 @@ Here are the XML tools available with examples:
                 # Note: processor_config is now guaranteed to exist due to check above
 
                 # 1. Get messages from thread for LLM call
-                messages = await self.get_llm_messages(thread_id)
+                messages = await self.get_llm_messages(thread_id, summary_window=enable_context_manager)
 
                 # 2. Check token count before proceeding
                 token_count = 0
                 try:
                     # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
+                    # The summary job only counts the window after the latest summary, so report the rest separately
+                    summary_id = (self._message_cache.get(thread_id) or {}).get('summary_id')
+                    prompt_messages = [working_system_prompt] + [m for m in messages if summary_id and m.get('message_id') == summary_id]
+                    window_messages = [m for m in messages if not summary_id or m.get('message_id') != summary_id]
+                    prompt_tokens = self._count_messages_tokens(prompt_messages, llm_model)
+                    token_count = prompt_tokens + self._count_messages_tokens(window_messages, llm_model)
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
 
-                    # if token_count >= token_threshold and enable_context_manager:
-                    #     logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
-                    #     summarized = await self.context_manager.check_and_summarize_if_needed(
-                    #         thread_id=thread_id,
-                    #         add_message_callback=self.add_message,
-                    #         model=llm_model,
-                    #         force=True
-                    #     )
-                    #     if summarized:
-                    #         logger.info("Summarization complete, fetching updated messages with summary")
-                    #         messages = await self.get_llm_messages(thread_id)
-                    #         # Recount tokens after summarization, using the modified prompt
-                    #         new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
-                    #         logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
-                    #     else:
-                    #         logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
-                    # elif not enable_context_manager:
-                    #     logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
+                    if enable_context_manager:
+                        # Summaries are written by a background job once the soft threshold is crossed;
+                        # the summary window picks them up on a later turn
+                        await self.context_manager.schedule_summary_if_needed(thread_id, token_count, model=llm_model, prompt_tokens=prompt_tokens)
+                    else:
+                        logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
 
                 except Exception as e:
                     logger.error(f"Error counting tokens or summarizing: {str(e)}")
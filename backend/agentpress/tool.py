@@ -4,11 +4,13 @@ Core tool system providing the foundation for creating and managing tools.
 This module defines the base classes and decorators for creating tools in AgentPress:
 - Tool base class for implementing tool functionality
 - Schema decorators for OpenAPI and XML tool definitions
+- Execution policy decorator for concurrency groups and timeouts
+- Cacheable decorator for idempotent tool functions
 - Result containers for standardized tool outputs
 """
 
 from typing import Dict, Any, Union, Optional, List
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from abc import ABC
 import json
 import inspect
@@ -82,6 +84,23 @@ class ToolSchema:
     schema: Dict[str, Any]
     xml_schema: Optional[XMLTagSchema] = None
 
+@dataclass
+class ToolExecutionPolicy:
+    """How calls to a tool function may be scheduled.
+    
+    Attributes:
+        concurrency_group (str, optional): Calls in the same group share limits.
+            May reference tool instance attributes, e.g. "browser:{project_id}".
+        max_parallel (int, optional): Maximum calls of the group running at once
+        timeout (float, optional): Per-call timeout in seconds
+        read_only (bool): Read-only calls may overlap within their group; other
+            calls run alone in it
+    """
+    concurrency_group: Optional[str] = None
+    max_parallel: Optional[int] = None
+    timeout: Optional[float] = None
+    read_only: bool = False
+
 @dataclass
 class ToolResult:
     """Container for tool execution results.
@@ -89,9 +108,12 @@ class ToolResult:
     Attributes:
         success (bool): Whether the tool execution succeeded
         output (str): Output message or error description
+        metadata (Dict[str, Any]): Execution details added to the tool result message
+            metadata (e.g. cache hits); not shown to the LLM
     """
     success: bool
     output: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
 
 class Tool(ABC):
     """Abstract base class for all tools.
@@ -129,6 +151,58 @@ class Tool(ABC):
         """
         return self._schemas
 
+    def get_execution_policy(self, method_name: str) -> ToolExecutionPolicy:
+        """Get the execution policy of a tool method.
+        
+        A policy set on the method takes precedence over one set on the class.
+        The concurrency group template is resolved against instance attributes.
+        
+        Args:
+            method_name: Name of the tool method
+            
+        Returns:
+            ToolExecutionPolicy with the concurrency group resolved
+        """
+        method = getattr(self, method_name, None)
+        policy = getattr(method, 'tool_execution_policy', None) or getattr(type(self), 'tool_execution_policy', None)
+        if policy is None:
+            return ToolExecutionPolicy()
+        if policy.concurrency_group:
+            try:
+                return replace(policy, concurrency_group=policy.concurrency_group.format_map(vars(self)))
+            except (KeyError, AttributeError, ValueError) as e:
+                logger.warning(f"Could not resolve concurrency group '{policy.concurrency_group}' for {self.__class__.__name__}.{method_name}: {str(e)}")
+        return policy
+
+    def get_cache_ttl(self, method_name: str) -> Optional[int]:
+        """Get the result cache TTL of a tool method, if it is cacheable.
+        
+        Args:
+            method_name: Name of the tool method
+            
+        Returns:
+            TTL in seconds set by the cacheable decorator on the method or the
+            class, or None if results must not be cached
+        """
+        method = getattr(self, method_name, None)
+        ttl = getattr(method, 'tool_cache_ttl', None)
+        if ttl is None:
+            ttl = getattr(type(self), 'tool_cache_ttl', None)
+        return ttl
+
+    async def on_cancel(self, method_name: str, arguments: Dict[str, Any]) -> None:
+        """Release resources held by a call that was cancelled mid-execution.
+        
+        Called when the agent run is stopped while a call of this tool is still
+        running. Override to stop external work the call started (processes,
+        sessions, remote jobs). Must be quick; it is bounded by a short timeout.
+        
+        Args:
+            method_name: Name of the cancelled tool method
+            arguments: Arguments of the cancelled call
+        """
+        pass
+
     def success_response(self, data: Union[Dict[str, Any], str]) -> ToolResult:
         """Create a successful tool result.
         
@@ -238,3 +312,53 @@ def custom_schema(schema: Dict[str, Any]):
             schema=schema
         ))
     return decorator
+
+def execution_policy(
+    concurrency_group: Optional[str] = None,
+    max_parallel: Optional[int] = None,
+    timeout: Optional[float] = None,
+    read_only: bool = False
+):
+    """
+    Decorator declaring how a tool class or tool method may be scheduled.
+    
+    Args:
+        concurrency_group: Name of the group whose calls share limits. May
+            reference instance attributes, e.g. "browser:{project_id}"
+        max_parallel: Maximum calls of the group running at once
+        timeout: Per-call timeout in seconds
+        read_only: Whether calls may overlap with other read-only calls of the group
+    
+    Example:
+        @execution_policy(concurrency_group="browser:{project_id}", max_parallel=1)
+        class SandboxBrowserTool(SandboxToolsBase):
+            ...
+    """
+    policy = ToolExecutionPolicy(
+        concurrency_group=concurrency_group,
+        max_parallel=max_parallel,
+        timeout=timeout,
+        read_only=read_only
+    )
+    def decorator(target):
+        logger.debug(f"Applying execution policy {policy} to {target.__name__}")
+        target.tool_execution_policy = policy
+        return target
+    return decorator
+
+def cacheable(ttl: int):
+    """
+    Decorator marking a tool class or tool method as idempotent.
+    
+    Successful results are shared across threads through the tool result cache
+    for `ttl` seconds, keyed by function name and canonicalized arguments. Only
+    use it for tools whose result does not depend on the thread or sandbox.
+    
+    Args:
+        ttl: Seconds a cached result stays valid
+    """
+    def decorator(target):
+        logger.debug(f"Marking {target.__name__} as cacheable for {ttl}s")
+        target.tool_cache_ttl = ttl
+        return target
+    return decorator
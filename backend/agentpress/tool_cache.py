@@ -0,0 +1,108 @@
+"""
+Redis-backed cache for results of idempotent tool calls.
+
+Tools opt in with the cacheable decorator. Results are keyed by function name
+and canonicalized arguments, so the same search or provider request made from
+any thread or user is served from Redis until its TTL expires. Hits and misses
+are counted per function in a Redis hash shared by every API and worker process.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from agentpress.tool import ToolResult
+from services import redis
+from utils.logger import logger
+
+# Cached values larger than this are not stored
+MAX_CACHED_VALUE_BYTES = 512 * 1024
+
+
+def canonicalize_arguments(arguments: Dict[str, Any]) -> str:
+    """Serialize tool arguments so equivalent calls produce the same string."""
+    normalized = {
+        key: value.strip() if isinstance(value, str) else value
+        for key, value in (arguments or {}).items()
+    }
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+class ToolResultCache:
+    """Cache of tool call results shared across threads."""
+
+    KEY_PREFIX = "tool_cache"
+    STATS_KEY = "tool_cache:stats"
+
+    def make_key(self, name: str, arguments: Dict[str, Any]) -> str:
+        """Build the Redis key of a call from its name and canonicalized arguments."""
+        digest = hashlib.sha256(canonicalize_arguments(arguments).encode()).hexdigest()
+        return f"{self.KEY_PREFIX}:{name}:{digest}"
+
+    async def get_value(self, name: str, arguments: Dict[str, Any]) -> Optional[Any]:
+        """Get a cached JSON value and count the hit or miss.
+
+        Cache errors are logged and treated as a miss.
+        """
+        try:
+            raw = await redis.get(self.make_key(name, arguments))
+        except Exception as e:
+            logger.warning(f"Tool cache lookup failed for {name}: {str(e)}")
+            return None
+        await self._count(name, "hits" if raw is not None else "misses")
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring malformed tool cache entry for {name}")
+            return None
+
+    async def set_value(self, name: str, arguments: Dict[str, Any], value: Any, ttl: int):
+        """Store a JSON-serializable value for `ttl` seconds. Errors are logged."""
+        try:
+            raw = json.dumps(value, ensure_ascii=False, default=str)
+            if len(raw.encode()) > MAX_CACHED_VALUE_BYTES:
+                logger.debug(f"Not caching {name} result of {len(raw)} chars")
+                return
+            await redis.set(self.make_key(name, arguments), raw, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Tool cache store failed for {name}: {str(e)}")
+
+    async def get(self, name: str, arguments: Dict[str, Any]) -> Optional[ToolResult]:
+        """Get a cached tool result, marked as a cache hit in its metadata."""
+        entry = await self.get_value(name, arguments)
+        if not isinstance(entry, dict) or 'output' not in entry:
+            return None
+        return ToolResult(
+            success=True,
+            output=entry['output'],
+            metadata={"cache_hit": True, "cached_at": entry.get('cached_at')}
+        )
+
+    async def set(self, name: str, arguments: Dict[str, Any], result: ToolResult, ttl: int):
+        """Cache a successful tool result."""
+        if not result.success:
+            return
+        await self.set_value(name, arguments, {
+            'output': result.output,
+            'cached_at': datetime.now(timezone.utc).isoformat()
+        }, ttl)
+
+    async def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get hit and miss counts per function name."""
+        stats: Dict[str, Dict[str, int]] = {}
+        for field, count in (await redis.hgetall(self.STATS_KEY)).items():
+            name, _, kind = field.rpartition(':')
+            stats.setdefault(name, {"hits": 0, "misses": 0})[kind] = int(count)
+        return stats
+
+    async def _count(self, name: str, kind: str):
+        try:
+            await redis.hincrby(self.STATS_KEY, f"{name}:{kind}")
+        except Exception as e:
+            logger.debug(f"Failed to count tool cache {kind} for {name}: {str(e)}")
+
+
+tool_result_cache = ToolResultCache()
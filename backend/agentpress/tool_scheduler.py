@@ -0,0 +1,145 @@
+"""
+Resource-aware scheduling of tool calls.
+
+Tool classes and methods declare a ToolExecutionPolicy with the execution_policy
+decorator. The scheduler uses it to let independent calls overlap while calls
+that compete for the same resource queue behind each other:
+
+- Calls without a concurrency group run immediately
+- Calls in a group run at most max_parallel at a time
+- A call that is not read-only runs alone in its group; read-only calls of the
+  group may overlap with each other
+- Calls are admitted to a group in the order they were submitted
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from agentpress.tool import ToolExecutionPolicy
+from utils.logger import logger
+
+
+class ToolCallTimeout(Exception):
+    """Raised when a tool call exceeds the timeout of its execution policy."""
+
+
+class _ConcurrencyGroup:
+    """Admission state of one concurrency group."""
+
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.running = 0
+        self.exclusive = False
+        # Tickets are handed out on arrival and admitted in order
+        self.next_ticket = 0
+        self.serving = 0
+        # Tickets of calls cancelled while queued
+        self.abandoned = set()
+
+    def can_start(self, ticket: int, policy: ToolExecutionPolicy) -> bool:
+        if ticket != self.serving or self.exclusive:
+            return False
+        if policy.max_parallel and self.running >= policy.max_parallel:
+            return False
+        return policy.read_only or self.running == 0
+
+    def advance(self):
+        """Move on to the next ticket still waiting."""
+        self.serving += 1
+        while self.serving in self.abandoned:
+            self.abandoned.discard(self.serving)
+            self.serving += 1
+
+    @property
+    def idle(self) -> bool:
+        return self.running == 0 and self.next_ticket == self.serving
+
+
+class ToolScheduler:
+    """Runs tool calls under the limits of their execution policies.
+
+    Group state is kept per resolved group name (e.g. "browser:<project_id>"),
+    so calls for the same resource are coordinated across every run that
+    shares the scheduler, and is dropped once a group is idle.
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, _ConcurrencyGroup] = {}
+
+    async def run(
+        self,
+        policy: ToolExecutionPolicy,
+        call: Callable[[], Awaitable[Any]],
+        name: Optional[str] = None
+    ) -> Any:
+        """Run a tool call once its concurrency group admits it.
+
+        Args:
+            policy: Execution policy of the called tool function
+            call: Zero-argument callable returning the call's coroutine
+            name: Name used in log messages
+
+        Returns:
+            The call's result
+
+        Raises:
+            ToolCallTimeout: If the call exceeds the policy timeout. Time spent
+                queued in the group does not count towards it.
+        """
+        group_name = policy.concurrency_group
+        if not group_name and policy.max_parallel:
+            # A limit without a group applies to the function itself
+            group_name = name
+        if not group_name:
+            return await self._run_with_timeout(policy, call, name)
+
+        group = self._groups.get(group_name)
+        if group is None:
+            group = self._groups[group_name] = _ConcurrencyGroup()
+
+        ticket = group.next_ticket
+        group.next_ticket += 1
+        admitted = False
+        try:
+            async with group.condition:
+                if not group.can_start(ticket, policy):
+                    logger.debug(f"Tool call {name} queued in concurrency group {group_name}")
+                await group.condition.wait_for(lambda: group.can_start(ticket, policy))
+                admitted = True
+                group.advance()
+                group.running += 1
+                group.exclusive = not policy.read_only
+                group.condition.notify_all()
+
+            return await self._run_with_timeout(policy, call, name)
+        finally:
+            async with group.condition:
+                if admitted:
+                    group.running -= 1
+                    if not policy.read_only:
+                        group.exclusive = False
+                elif ticket == group.serving:
+                    # Cancelled while queued: give up the ticket without blocking later ones
+                    group.advance()
+                else:
+                    group.abandoned.add(ticket)
+                group.condition.notify_all()
+            if group.idle and self._groups.get(group_name) is group:
+                del self._groups[group_name]
+
+    async def _run_with_timeout(
+        self,
+        policy: ToolExecutionPolicy,
+        call: Callable[[], Awaitable[Any]],
+        name: Optional[str]
+    ) -> Any:
+        if not policy.timeout:
+            return await call()
+        try:
+            return await asyncio.wait_for(call(), timeout=policy.timeout)
+        except asyncio.TimeoutError:
+            raise ToolCallTimeout(f"Tool {name} timed out after {policy.timeout} seconds")
+
+
+# Shared by every run in the process so per-resource groups are coordinated
+tool_scheduler = ToolScheduler()
@@ -6,6 +6,7 @@ them as proper JSONB objects in the database.
 """
 
 import json
+import re
 from typing import Any, Union, Dict, List
 
 
@@ -171,4 +172,67 @@ def format_for_yield(message_object: Dict[str, Any]) -> Dict[str, Any]:
     if 'metadata' in formatted and not isinstance(formatted['metadata'], str):
         formatted['metadata'] = json.dumps(formatted['metadata'])
         
-    return formatted 
\ No newline at end of file
+    return formatted 
+
+# Characters that can change the state of an IncrementalJSONValidator
+_JSON_STRUCTURAL_CHARS = re.compile(r'["\\\[\]{}]')
+
+
+class IncrementalJSONValidator:
+    """
+    Track whether a streamed JSON document is complete without re-parsing it.
+    
+    Bracket depth and string/escape state are carried across feed() calls, so
+    each delta is only scanned once and completeness is known at any time.
+    The document still has to be parsed once it is complete.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether the top-level object or array has been closed."""
+        return self.started and self.depth == 0 and not self.in_string
+
+    def feed(self, text: str) -> bool:
+        """
+        Consume the next fragment of the document.
+        
+        Args:
+            text: The new fragment
+            
+        Returns:
+            True if the document is complete after this fragment
+        """
+        pos = 0
+        if self.escaped and text:
+            # The previous fragment ended with a backslash inside a string
+            self.escaped = False
+            pos = 1
+
+        skip_until = pos
+        for match in _JSON_STRUCTURAL_CHARS.finditer(text, pos):
+            i = match.start()
+            if i < skip_until:
+                continue
+            char = text[i]
+            if self.in_string:
+                if char == '\\':
+                    if i + 1 >= len(text):
+                        self.escaped = True
+                    skip_until = i + 2
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+                self.started = True
+            elif char in ']}':
+                self.depth -= 1
+
+        return self.is_complete
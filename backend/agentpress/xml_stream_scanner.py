@@ -0,0 +1,271 @@
+"""
+Incremental XML tool call scanner for streaming responses.
+
+This module detects complete XML tool call blocks while an LLM response is
+being streamed. Unlike re-running a full extraction over the accumulated
+content on every delta, the scanner keeps its position between deltas, so
+each character of the response is examined a bounded number of times.
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+# Characters that terminate a tag name
+TAG_NAME_DELIMITERS = ' \t\r\n>/'
+
+
+@dataclass
+class ScannedXMLChunk:
+    """A complete XML tool call chunk found in a streamed response."""
+    raw: str        # Text exactly as it appears in the response
+    xml: str        # Self-contained XML to hand to the tool call parser
+    is_invoke: bool = False  # A single <invoke> of a still-open <function_calls> block
+
+
+class StreamingXMLScanner:
+    """
+    Stateful scanner that yields complete XML tool call blocks as deltas arrive.
+
+    Recognizes the Cursor-style format:
+
+    <function_calls>
+    <invoke name="function_name">
+    ...
+    </invoke>
+    </function_calls>
+
+    and, for backwards compatibility, legacy blocks whose tag is one of the
+    registered XML tool tags (e.g. <create-file ...>...</create-file>), including
+    nested blocks of the same tag. As in the non-streaming extraction, legacy
+    blocks are only a fallback: once a <function_calls> block has started, legacy
+    tags in the rest of the response are ignored.
+
+    Only text that could still belong to an unfinished tag or block is kept
+    between calls to feed().
+
+    With emit_invokes, each <invoke> inside a <function_calls> block is returned
+    as soon as its </invoke> arrives, wrapped in its own <function_calls> block,
+    and the enclosing block itself is not returned again.
+    """
+
+    FUNCTION_CALLS_TAG = 'function_calls'
+    INVOKE_TAG = 'invoke'
+
+    def __init__(self, legacy_tags: Iterable[str] = (), emit_invokes: bool = False):
+        """
+        Initialize the scanner.
+
+        Args:
+            legacy_tags: Registered XML tool tag names to detect in the legacy format
+            emit_invokes: Return each <invoke> as soon as it closes instead of
+                          waiting for the end of its <function_calls> block
+        """
+        self.legacy_tags = frozenset(legacy_tags)
+        self.emit_invokes = emit_invokes
+        self._max_tag_len = max([len(self.FUNCTION_CALLS_TAG)] + [len(tag) for tag in self.legacy_tags])
+
+        # Text outside a block that may be the beginning of an opening tag
+        self._pending = ""
+        # Whether a <function_calls> block was seen, which turns off legacy tags
+        self._seen_function_calls = False
+        # State of the block being collected, if any
+        self._block_tag: Optional[str] = None
+        self._block_parts: List[str] = []
+        self._block_len = 0
+        self._depth = 0
+        # Offset in the open block of the <invoke> being collected, if any
+        self._invoke_start = -1
+        # Last characters of the open block, to match tags split across deltas
+        self._tail = ""
+
+    @property
+    def in_block(self) -> bool:
+        """Whether the scanner is inside an unfinished tool call block."""
+        return self._block_tag is not None
+
+    def feed(self, text: str) -> List[ScannedXMLChunk]:
+        """
+        Consume the next streamed delta.
+
+        Args:
+            text: The new content delta
+
+        Returns:
+            Complete XML chunks that were closed by this delta, in order
+        """
+        chunks = []
+        data = self._pending + text
+        self._pending = ""
+
+        while data:
+            if self._block_tag is None:
+                start, tag, name_end = self._find_block_start(data)
+                if start == -1:
+                    # Nothing but a possibly partial opening tag is worth keeping
+                    self._pending = data[name_end:]
+                    break
+                # Keep the delimiter after the name with the opening text so the
+                # nesting scan does not count the opening tag itself
+                self._open_block(tag, data[start:name_end + 1])
+                data = data[name_end + 1:]
+            else:
+                end, invoke_spans = self._find_block_end(data)
+                self._append_to_block(data if end == -1 else data[:end])
+
+                block_text = "".join(self._block_parts) if invoke_spans or end != -1 else ""
+                for invoke_start, invoke_end in invoke_spans:
+                    invoke_text = block_text[invoke_start:invoke_end]
+                    chunks.append(ScannedXMLChunk(
+                        raw=invoke_text,
+                        xml=f"<{self.FUNCTION_CALLS_TAG}>\n{invoke_text}\n</{self.FUNCTION_CALLS_TAG}>",
+                        is_invoke=True
+                    ))
+                if end == -1:
+                    break
+
+                # The invokes of a block were already returned one by one
+                if not (self.emit_invokes and self._block_tag == self.FUNCTION_CALLS_TAG):
+                    chunks.append(ScannedXMLChunk(raw=block_text, xml=block_text))
+                self._close_block()
+                data = data[end:]
+
+        return chunks
+
+    def _find_block_start(self, data: str) -> Tuple[int, Optional[str], int]:
+        """Find the next opening tag of a tool call block.
+
+        Returns:
+            (start index, tag name, index of the delimiter after the name) for a match, or
+            (-1, None, index from which data must be kept for the next delta)
+        """
+        pos = 0
+        while True:
+            lt = data.find('<', pos)
+            if lt == -1:
+                return -1, None, len(data)
+
+            name_end = lt + 1
+            limit = min(len(data), lt + self._max_tag_len + 2)
+            while name_end < limit and data[name_end] not in TAG_NAME_DELIMITERS:
+                name_end += 1
+
+            if name_end == len(data):
+                # The tag name may continue in the next delta
+                if name_end - lt <= self._max_tag_len + 1:
+                    return -1, None, lt
+                pos = lt + 1
+                continue
+
+            name = data[lt + 1:name_end]
+            if name == self.FUNCTION_CALLS_TAG and data[name_end] == '>':
+                return lt, name, name_end
+            if name in self.legacy_tags and name != self.FUNCTION_CALLS_TAG and not self._seen_function_calls:
+                return lt, name, name_end
+            pos = lt + 1
+
+    def _find_block_end(self, data: str) -> Tuple[int, List[Tuple[int, int]]]:
+        """Find the end of the open block in data.
+
+        Returns:
+            (index in data just after the matching closing tag, or -1 if the block
+            is still open after data; (start, end) offsets in the block of every
+            <invoke> closed in data when emitting invokes)
+        """
+        search = self._tail + data
+        base = len(self._tail)
+        # Offset in the block of search[0]
+        offset = self._block_len - base
+        close_pattern = f'</{self._block_tag}>'
+        open_pattern = f'<{self._block_tag}'
+        # Nesting is only tracked for legacy tags, as in the non-streaming extraction
+        track_nesting = self._block_tag != self.FUNCTION_CALLS_TAG
+        track_invokes = self.emit_invokes and self._block_tag == self.FUNCTION_CALLS_TAG
+        invoke_open_pattern = f'<{self.INVOKE_TAG}'
+        invoke_close_pattern = f'</{self.INVOKE_TAG}>'
+        invoke_spans = []
+
+        # Start where a match could still end inside the new data
+        close_pos = max(0, base - len(close_pattern) + 1)
+        open_pos = max(0, base - len(open_pattern))
+        invoke_open_pos = max(0, base - len(invoke_open_pattern))
+        invoke_close_pos = max(0, base - len(invoke_close_pattern) + 1)
+
+        while True:
+            next_close = search.find(close_pattern, close_pos)
+            next_open = self._find_nested_open(search, open_pattern, open_pos) if track_nesting else -1
+
+            if track_invokes:
+                limit = next_close if next_close != -1 else len(search)
+                if self._invoke_start == -1:
+                    next_invoke = self._find_nested_open(search, invoke_open_pattern, invoke_open_pos)
+                    if next_invoke != -1 and next_invoke < limit:
+                        self._invoke_start = offset + next_invoke
+                        invoke_open_pos = next_invoke + len(invoke_open_pattern) + 1
+                        invoke_close_pos = max(invoke_close_pos, invoke_open_pos)
+                        continue
+                else:
+                    next_invoke_close = search.find(invoke_close_pattern, invoke_close_pos)
+                    if next_invoke_close != -1 and next_invoke_close < limit:
+                        invoke_end = next_invoke_close + len(invoke_close_pattern)
+                        invoke_spans.append((self._invoke_start, offset + invoke_end))
+                        self._invoke_start = -1
+                        invoke_close_pos = invoke_end
+                        invoke_open_pos = max(invoke_open_pos, invoke_end)
+                        continue
+
+            if next_open != -1 and (next_close == -1 or next_open < next_close):
+                self._depth += 1
+                open_pos = next_open + len(open_pattern) + 1
+                continue
+            if next_close == -1:
+                return -1, invoke_spans
+
+            self._depth -= 1
+            close_end = next_close + len(close_pattern)
+            if self._depth == 0:
+                return close_end - base, invoke_spans
+            close_pos = close_end
+            open_pos = max(open_pos, close_end)
+
+    def _find_nested_open(self, search: str, open_pattern: str, pos: int) -> int:
+        """Find a nested opening tag of the block's tag, followed by a delimiter."""
+        while True:
+            found = search.find(open_pattern, pos)
+            after = found + len(open_pattern)
+            if found == -1 or after >= len(search):
+                # Not found, or the delimiter has not arrived yet; the tail keeps it
+                return -1
+            if search[after] in TAG_NAME_DELIMITERS:
+                return found
+            pos = found + 1
+
+    def _open_block(self, tag: str, opening_text: str):
+        if tag == self.FUNCTION_CALLS_TAG:
+            self._seen_function_calls = True
+        self._block_tag = tag
+        self._block_parts = [opening_text]
+        self._block_len = len(opening_text)
+        self._depth = 1
+        self._invoke_start = -1
+        self._tail = opening_text[-self._tail_len():]
+
+    def _append_to_block(self, data: str):
+        if not data:
+            return
+        self._block_parts.append(data)
+        self._block_len += len(data)
+        tail_len = self._tail_len()
+        self._tail = (self._tail + data)[-tail_len:] if len(data) < tail_len else data[-tail_len:]
+
+    def _tail_len(self) -> int:
+        # Long enough for the longest pattern searched in the block, minus one
+        # character, so patterns split across deltas are still found
+        return max(len(self._block_tag), len(self.INVOKE_TAG)) + 2
+
+    def _close_block(self):
+        self._block_tag = None
+        self._block_parts = []
+        self._block_len = 0
+        self._depth = 0
+        self._invoke_start = -1
+        self._tail = ""
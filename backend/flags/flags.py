@@ -1,18 +1,30 @@
+import asyncio
 import json
 import logging
 import os
+import time
 from datetime import datetime
 from typing import Dict, List, Optional
 from services import redis
 
 logger = logging.getLogger(__name__)
 
+# Seconds a flag snapshot is used before it is reloaded, even without an invalidation
+FLAG_SNAPSHOT_TTL = 30
+
 
 class FeatureFlagManager:
     def __init__(self):
         """Initialize with existing Redis service"""
         self.flag_prefix = "feature_flag:"
         self.flag_list_key = "feature_flags:list"
+        self.invalidation_channel = "feature_flags:invalidate"
+        # Per-process snapshot of all flags, refreshed on invalidation or after FLAG_SNAPSHOT_TTL
+        self._snapshot: Optional[Dict[str, Dict[str, str]]] = None
+        self._snapshot_loaded_at = 0.0
+        self._snapshot_generation = 0
+        self._load_lock = asyncio.Lock()
+        self._invalidation_task: Optional[asyncio.Task] = None
     
     async def set_flag(self, key: str, enabled: bool, description: str = "") -> bool:
         """Set a feature flag to enabled or disabled"""
@@ -28,6 +40,7 @@ class FeatureFlagManager:
             redis_client = await redis.get_client()
             await redis_client.hset(flag_key, mapping=flag_data)
             await redis_client.sadd(self.flag_list_key, key)
+            await self._publish_invalidation()
             
             logger.info(f"Set feature flag {key} to {enabled}")
             return True
@@ -38,10 +51,8 @@ class FeatureFlagManager:
     async def is_enabled(self, key: str) -> bool:
         """Check if a feature flag is enabled"""
         try:
-            flag_key = f"{self.flag_prefix}{key}"
-            redis_client = await redis.get_client()
-            enabled = await redis_client.hget(flag_key, 'enabled')
-            return enabled == 'true' if enabled else False
+            flag_data = (await self._get_snapshot()).get(key)
+            return flag_data.get('enabled') == 'true' if flag_data else False
         except Exception as e:
             logger.error(f"Failed to check feature flag {key}: {e}")
             # Return False by default if Redis is unavailable
@@ -50,10 +61,8 @@ class FeatureFlagManager:
     async def get_flag(self, key: str) -> Optional[Dict[str, str]]:
         """Get feature flag details"""
         try:
-            flag_key = f"{self.flag_prefix}{key}"
-            redis_client = await redis.get_client()
-            flag_data = await redis_client.hgetall(flag_key)
-            return flag_data if flag_data else None
+            flag_data = (await self._get_snapshot()).get(key)
+            return dict(flag_data) if flag_data else None
         except Exception as e:
             logger.error(f"Failed to get feature flag {key}: {e}")
             return None
@@ -66,6 +75,7 @@ class FeatureFlagManager:
             deleted = await redis_client.delete(flag_key)
             if deleted:
                 await redis_client.srem(self.flag_list_key, key)
+                await self._publish_invalidation()
                 logger.info(f"Deleted feature flag: {key}")
                 return True
             return False
@@ -76,14 +86,8 @@ class FeatureFlagManager:
     async def list_flags(self) -> Dict[str, bool]:
         """List all feature flags with their status"""
         try:
-            redis_client = await redis.get_client()
-            flag_keys = await redis_client.smembers(self.flag_list_key)
-            flags = {}
-            
-            for key in flag_keys:
-                flags[key] = await self.is_enabled(key)
-            
-            return flags
+            snapshot = await self._get_snapshot()
+            return {key: flag_data.get('enabled') == 'true' for key, flag_data in snapshot.items()}
         except Exception as e:
             logger.error(f"Failed to list feature flags: {e}")
             return {}
@@ -91,20 +95,87 @@ class FeatureFlagManager:
     async def get_all_flags_details(self) -> Dict[str, Dict[str, str]]:
         """Get all feature flags with detailed information"""
         try:
-            redis_client = await redis.get_client()
-            flag_keys = await redis_client.smembers(self.flag_list_key)
-            flags = {}
-            
-            for key in flag_keys:
-                flag_data = await self.get_flag(key)
-                if flag_data:
-                    flags[key] = flag_data
-            
-            return flags
+            snapshot = await self._get_snapshot()
+            return {key: dict(flag_data) for key, flag_data in snapshot.items()}
         except Exception as e:
             logger.error(f"Failed to get all flags details: {e}")
             return {}
 
+    
+    def invalidate(self):
+        """Expire the local snapshot so the next check reloads all flags"""
+        self._snapshot_loaded_at = 0.0
+        self._snapshot_generation += 1
+    
+    async def _get_snapshot(self) -> Dict[str, Dict[str, str]]:
+        """Get the flag snapshot, reloading it when invalidated or older than FLAG_SNAPSHOT_TTL"""
+        self._ensure_invalidation_listener()
+        if self._snapshot is not None and time.monotonic() - self._snapshot_loaded_at < FLAG_SNAPSHOT_TTL:
+            return self._snapshot
+        async with self._load_lock:
+            if self._snapshot is not None and time.monotonic() - self._snapshot_loaded_at < FLAG_SNAPSHOT_TTL:
+                return self._snapshot
+            try:
+                generation = self._snapshot_generation
+                snapshot = await self._load_snapshot()
+                # A snapshot loaded across an invalidation is served once, then reloaded
+                self._snapshot = snapshot
+                self._snapshot_loaded_at = time.monotonic() if generation == self._snapshot_generation else 0.0
+                return snapshot
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                # Keep serving the stale snapshot until Redis is reachable again
+                logger.warning(f"Failed to reload feature flags, using previous snapshot: {e}")
+            return self._snapshot
+    
+    async def _load_snapshot(self) -> Dict[str, Dict[str, str]]:
+        """Load every flag with one pipelined round-trip after listing them"""
+        redis_client = await redis.get_client()
+        flag_keys = list(await redis_client.smembers(self.flag_list_key))
+        pipe = redis_client.pipeline(transaction=False)
+        for key in flag_keys:
+            pipe.hgetall(f"{self.flag_prefix}{key}")
+        results = await pipe.execute() if flag_keys else []
+        return {key: flag_data for key, flag_data in zip(flag_keys, results) if flag_data}
+    
+    async def _publish_invalidation(self):
+        self.invalidate()
+        try:
+            await redis.publish(self.invalidation_channel, "invalidate")
+        except Exception as e:
+            logger.warning(f"Failed to publish feature flag invalidation: {e}")
+    
+    def _ensure_invalidation_listener(self):
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = asyncio.create_task(self._listen_for_invalidations())
+    
+    async def _listen_for_invalidations(self):
+        """Drop the snapshot whenever any process changes a flag"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.subscribe(self.invalidation_channel)
+                # Changes made before the subscription was active may be missed
+                self.invalidate()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The snapshot TTL bounds staleness until the subscription is back
+                logger.warning(f"Feature flag invalidation listener failed, resubscribing: {e}")
+                await asyncio.sleep(1.0)
+            finally:
+                if pubsub:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+
 
 _flag_manager: Optional[FeatureFlagManager] = None
 
@@ -4,12 +4,15 @@ import json
 import traceback
 from datetime import datetime, timezone
 from typing import Optional
-from services import redis
+from services import redis, usage, agent_run_stream, admission, active_runs
+from services.agent_run_archive import ResponseArchiver
+from services.agent_run_control import run_control_listener
 from agent.run import run_agent
 from utils.logger import logger
 import dramatiq
 import uuid
 from agentpress.thread_manager import ThreadManager
+from agentpress.context_manager import ContextManager
 from services.supabase import DBConnection
 from services import redis
 from dramatiq.brokers.rabbitmq import RabbitmqBroker
@@ -21,6 +24,12 @@ rabbitmq_port = int(os.getenv('RABBITMQ_PORT', 5672))
 rabbitmq_broker = RabbitmqBroker(host=rabbitmq_host, port=rabbitmq_port, middleware=[dramatiq.middleware.AsyncIO()])
 dramatiq.set_broker(rabbitmq_broker)
 
+# Seconds between refreshes of the active run key TTL while a run is in progress
+ACTIVE_RUN_REFRESH_SECONDS = 60
+
+# Seconds a stopped run gets to cancel its LLM stream and tool calls before the worker moves on
+STOP_GRACE_SECONDS = 15
+
 _initialized = False
 db = DBConnection()
 instance_id = "single"
@@ -96,52 +105,55 @@ async def run_agent_background(
 
     client = await db.client
     start_time = datetime.now(timezone.utc)
+    archiver = ResponseArchiver(client, agent_run_id)
     total_responses = 0
-    pubsub = None
+    stop_event = None
     stop_checker = None
+    agent_task = None
     stop_signal_received = False
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
-    instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
 
     async def check_for_stop_signal():
         nonlocal stop_signal_received
-        if not pubsub: return
         try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
+            while not stop_event.is_set():
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=ACTIVE_RUN_REFRESH_SECONDS)
+                except asyncio.TimeoutError:
+                    # Periodically renew the active run and admission slot leases
+                    try:
+                        await active_runs.heartbeat(instance_id, agent_run_id)
+                        await admission.heartbeat(agent_run_id)
+                    except Exception as ttl_err: logger.warning(f"Failed to renew leases of agent run {agent_run_id}: {ttl_err}")
+                    # Pick up runs queued while a dispatch was already in progress elsewhere
+                    await dispatch_queued_runs()
+            logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
+            stop_signal_received = True
         except asyncio.CancelledError:
             logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
         except Exception as e:
             logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
             stop_signal_received = True # Stop the run if the checker fails
 
+    async def cancel_agent_task(task: asyncio.Task):
+        """Cancel the agent and wait a bounded time for it to clean up."""
+        task.cancel()
+        _, still_running = await asyncio.wait({task}, timeout=STOP_GRACE_SECONDS)
+        if still_running:
+            logger.warning(f"Agent run {agent_run_id} did not finish cleaning up within {STOP_GRACE_SECONDS}s of stop; releasing the worker")
+        elif not task.cancelled() and task.exception():
+            logger.warning(f"Agent run {agent_run_id} raised while stopping: {task.exception()}")
+
     trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
-        await pubsub.subscribe(instance_control_channel, global_control_channel)
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
+        # Register with the worker's shared control listener for STOP signals
+        stop_event = await run_control_listener.register(agent_run_id)
         stop_checker = asyncio.create_task(check_for_stop_signal())
 
-        # Ensure active run key exists and has TTL
-        await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
+        # Ensure the run is registered as active on its instance
+        await active_runs.register(instance_id, agent_run_id)
 
 
         # Initialize agent generator
@@ -161,28 +173,44 @@ async def run_agent_background(
 
         pending_redis_operations = []
 
-        async for response in agent_gen:
-            if stop_signal_received:
-                logger.info(f"Agent run {agent_run_id} stopped by signal.")
-                final_status = "stopped"
-                trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
-                break
-
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
-            total_responses += 1
-
-            # Check for agent-signaled completion or error
-            if response.get('type') == 'status':
-                 status_val = response.get('status')
-                 if status_val in ['completed', 'failed', 'stopped']:
-                     logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
-                     final_status = status_val
-                     if status_val == 'failed' or status_val == 'stopped':
-                         error_message = response.get('message', f"Run ended with status: {status_val}")
-                     break
+        async def consume_agent_responses():
+            nonlocal final_status, error_message, total_responses
+            async for response in agent_gen:
+                if stop_signal_received:
+                    logger.info(f"Agent run {agent_run_id} stopped by signal.")
+                    final_status = "stopped"
+                    trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
+                    break
+
+                # Append response to the run stream; readers block on it, no notification needed
+                pending_redis_operations.append(asyncio.create_task(agent_run_stream.append_response(agent_run_id, response)))
+                archiver.add(response)
+                total_responses += 1
+
+                # Check for agent-signaled completion or error
+                if response.get('type') == 'status':
+                     status_val = response.get('status')
+                     if status_val in ['completed', 'failed', 'stopped']:
+                         logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
+                         final_status = status_val
+                         if status_val == 'failed' or status_val == 'stopped':
+                             error_message = response.get('message', f"Run ended with status: {status_val}")
+                         break
+
+        # Consume the agent in its own task so a STOP can cancel it mid-stream,
+        # including the LLM stream and tool calls it is waiting on
+        agent_task = asyncio.create_task(consume_agent_responses())
+        await asyncio.wait({agent_task, stop_checker}, return_when=asyncio.FIRST_COMPLETED)
+        if not agent_task.done() and not stop_signal_received:
+            await asyncio.wait({agent_task})
+
+        if not agent_task.done():
+            logger.info(f"Agent run {agent_run_id} stopped by signal, cancelling in-flight work.")
+            final_status = "stopped"
+            trace.span(name="agent_run_stopped").end(status_message="agent_run_stopped", level="WARNING")
+            await cancel_agent_task(agent_task)
+        else:
+            agent_task.result() # Re-raise errors of the agent run
 
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
@@ -191,18 +219,18 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await agent_run_stream.append_response(agent_run_id, completion_message)
+             archiver.add(completion_message)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Archive the remaining responses before the run is marked as finished
+        await archiver.close()
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
 
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
+        await agent_run_stream.append_control(agent_run_id, control_signal)
         try:
             await redis.publish(global_control_channel, control_signal)
             # No need to publish to instance channel as the run is ending on this instance
@@ -218,27 +246,20 @@ async def run_agent_background(
         final_status = "failed"
         trace.span(name="agent_run_failed").end(status_message=error_message, level="ERROR")
 
-        # Push error message to Redis list
+        # Append error message to the run stream
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await agent_run_stream.append_response(agent_run_id, error_response)
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
-
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+        archiver.add(error_response)
+        await archiver.close()
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}", responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
         # Publish ERROR signal
+        await agent_run_stream.append_control(agent_run_id, "ERROR")
         try:
             await redis.publish(global_control_channel, "ERROR")
             logger.debug(f"Published ERROR signal to {global_control_channel}")
@@ -246,6 +267,10 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
+        # The actor itself may be interrupted while the agent is still running
+        if agent_task and not agent_task.done():
+            await cancel_agent_task(agent_task)
+
         # Cleanup stop checker task
         if stop_checker and not stop_checker.done():
             stop_checker.cancel()
@@ -253,24 +278,28 @@ async def run_agent_background(
             except asyncio.CancelledError: pass
             except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
 
-        # Close pubsub connection
-        if pubsub:
-            try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
-            except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+        # Stop routing control signals to this run
+        run_control_listener.unregister(agent_run_id)
 
-        # Set TTL on the response list in Redis
+        # Write any responses not archived yet, e.g. when the actor was interrupted
+        await archiver.close()
+
+        # Set TTL on the response stream in Redis
         await _cleanup_redis_response_list(agent_run_id)
 
-        # Remove the instance-specific active run key
-        await _cleanup_redis_instance_key(agent_run_id)
+        # Remove the run from its instance's active runs
+        await _cleanup_redis_instance_key(agent_run_id, instance_id)
 
         # Clean up the run lock
         await _cleanup_redis_run_lock(agent_run_id)
 
+        # Free the admission slot and start the next queued run
+        try:
+            await admission.release(agent_run_id)
+        except Exception as e:
+            logger.warning(f"Failed to release admission slot of agent run {agent_run_id}: {str(e)}")
+        await dispatch_queued_runs()
+
         # Wait for all pending redis operations to complete, with timeout
         try:
             await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
@@ -279,18 +308,85 @@ async def run_agent_background(
 
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
-async def _cleanup_redis_instance_key(agent_run_id: str):
-    """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
-        logger.warning("Instance ID not set, cannot clean up instance key.")
+@dramatiq.actor
+async def summarize_thread_background(thread_id: str, model: str = "gpt-4o-mini", prompt_tokens: int = 0):
+    """Summarize a thread ahead of time so the next agent turn starts from a compact context."""
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    logger.info(f"Starting background summarization for thread: {thread_id} (model: {model})")
+    try:
+        thread_manager = ThreadManager()
+        # Re-check the window against the threshold it was scheduled on, in case a summary was written since
+        context_manager = ContextManager(token_threshold=thread_manager.context_manager.summary_window_threshold(prompt_tokens))
+        summarized = await context_manager.check_and_summarize_if_needed(
+            thread_id=thread_id,
+            add_message_callback=thread_manager.add_message,
+            model=model
+        )
+        logger.info(f"Background summarization for thread {thread_id} finished (summarized: {summarized})")
+    except Exception as e:
+        logger.error(f"Error in background summarization for thread {thread_id}: {str(e)}", exc_info=True)
+    finally:
+        try:
+            await redis.delete(f"thread_summary_lock:{thread_id}")
+        except Exception as e:
+            logger.warning(f"Failed to release summarization lock for thread {thread_id}: {str(e)}")
+
+async def _start_queued_run(agent_run_id: str, queued_run: dict):
+    """Mark an admitted queued run as running and send it to a worker.
+
+    A run that cannot be started is marked failed, so it is not left queued or
+    running without a worker.
+    """
+    run_kwargs = queued_run['run_kwargs']
+    client = await db.client
+    try:
+        started_at = datetime.now(timezone.utc).isoformat()
+        update_result = await client.table('agent_runs').update({"status": "running", "started_at": started_at}) \
+            .eq("id", agent_run_id).eq("status", "queued").execute()
+        if not update_result.data:
+            logger.info(f"Queued agent run {agent_run_id} is no longer queued, not starting it")
+            await admission.release(agent_run_id)
+            return
+
+        await usage.record_run_started(queued_run['account_id'], agent_run_id, started_at)
+        try:
+            await active_runs.register(run_kwargs['instance_id'], agent_run_id)
+        except Exception as e:
+            logger.warning(f"Failed to register agent run {agent_run_id} as active on instance {run_kwargs['instance_id']}: {str(e)}")
+        run_agent_background.send(**run_kwargs)
+    except Exception as e:
+        logger.error(f"Failed to start queued agent run {agent_run_id}: {str(e)}", exc_info=True)
+        error = f"Failed to start agent run: {str(e)}"
+        if not await finish_queued_run(client, agent_run_id, "failed", error=error) \
+                and not await update_agent_run_status(client, agent_run_id, "failed", error=error):
+            raise
+        await _cleanup_redis_instance_key(agent_run_id, run_kwargs.get('instance_id'))
+        await admission.release(agent_run_id)
+        return
+    logger.info(f"Started queued agent run {agent_run_id} of account {queued_run['account_id']}")
+
+async def dispatch_queued_runs():
+    """Start queued agent runs while admission slots are free."""
+    try:
+        await admission.dispatch(_start_queued_run)
+    except Exception as e:
+        logger.error(f"Failed to dispatch queued agent runs: {str(e)}")
+
+async def _cleanup_redis_instance_key(agent_run_id: str, run_instance_id: str):
+    """Remove an agent run from the active runs of the instance that started it."""
+    if not run_instance_id:
+        logger.warning("Instance ID not set, cannot clean up active run entry.")
         return
-    key = f"active_run:{instance_id}:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis instance key: {key}")
+    logger.debug(f"Removing agent run {agent_run_id} from active runs of instance {run_instance_id}")
     try:
-        await redis.delete(key)
-        logger.debug(f"Successfully cleaned up Redis key: {key}")
+        await active_runs.unregister(run_instance_id, agent_run_id)
     except Exception as e:
-        logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
+        logger.warning(f"Failed to remove agent run {agent_run_id} from active runs of instance {run_instance_id}: {str(e)}")
 
 async def _cleanup_redis_run_lock(agent_run_id: str):
     """Clean up the run lock Redis key for an agent run."""
@@ -302,42 +398,64 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
     except Exception as e:
         logger.warning(f"Failed to clean up Redis run lock key {run_lock_key}: {str(e)}")
 
-# TTL for Redis response lists (24 hours)
+# TTL for Redis response streams and lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the Redis response stream (and legacy response list)."""
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await agent_run_stream.expire(agent_run_id, REDIS_RESPONSE_LIST_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response stream of agent run {agent_run_id}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on response stream of agent run {agent_run_id}: {str(e)}")
+
+async def finish_queued_run(
+    client,
+    agent_run_id: str,
+    status: str,
+    error: Optional[str] = None
+) -> bool:
+    """
+    Finalize a run that is still queued, i.e. never started.
+    Its start and completion are set to the same time, so the queue wait is not counted as usage.
+    Returns True if the run was still queued.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    update_data = {"status": status, "started_at": now, "completed_at": now}
+    if error:
+        update_data["error"] = error
+    try:
+        update_result = await client.table('agent_runs').update(update_data) \
+            .eq("id", agent_run_id).eq("status", "queued").execute()
+    except Exception as e:
+        logger.warning(f"Failed to finalize queued agent run {agent_run_id}: {str(e)}")
+        return False
+    if not update_result.data:
+        return False
+    logger.info(f"Finalized queued agent run {agent_run_id} with status '{status}' before it started")
+    return True
 
 async def update_agent_run_status(
     client,
     agent_run_id: str,
     status: str,
-    error: Optional[str] = None,
-    responses: Optional[list[any]] = None # Expects parsed list of dicts
+    error: Optional[str] = None
 ) -> bool:
     """
     Centralized function to update agent run status.
+    Responses are archived separately by ResponseArchiver, so this is a small status write.
     Returns True if update was successful.
     """
     try:
+        completed_at = datetime.now(timezone.utc)
         update_data = {
             "status": status,
-            "completed_at": datetime.now(timezone.utc).isoformat()
+            "completed_at": completed_at.isoformat()
         }
 
         if error:
             update_data["error"] = error
 
-        if responses:
-            # Ensure responses are stored correctly as JSONB
-            update_data["responses"] = responses
-
         # Retry up to 3 times
         for retry in range(3):
             try:
@@ -345,13 +463,7 @@ async def update_agent_run_status(
 
                 if hasattr(update_result, 'data') and update_result.data:
                     logger.info(f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})")
-
-                    # Verify the update
-                    verify_result = await client.table('agent_runs').select('status', 'completed_at').eq("id", agent_run_id).execute()
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get('status')
-                        completed_at = verify_result.data[0].get('completed_at')
-                        logger.info(f"Verified agent run update: status={actual_status}, completed_at={completed_at}")
+                    await usage.record_run_finished(client, agent_run_id, completed_at)
                     return True
                 else:
                     logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}")
@@ -0,0 +1,72 @@
+"""
+Registry of the agent runs in progress on each API instance.
+
+Runs are indexed in two Redis sorted sets scored by lease expiry, so lookups
+never scan the keyspace:
+
+- active_runs:instance:{instance_id}: runs started by the instance
+- active_runs:run:{agent_run_id}: instances a run is registered with
+
+The worker executing a run renews its lease periodically. Entries whose lease
+expired, e.g. of a crashed instance or worker, are ignored and pruned.
+"""
+
+import time
+from typing import List
+
+from services import redis
+from utils.logger import logger
+
+# Seconds an entry stays active without a heartbeat
+ACTIVE_RUN_LEASE_SECONDS = 300
+
+
+def instance_runs_key(instance_id: str) -> str:
+    return f"active_runs:instance:{instance_id}"
+
+
+def run_instances_key(agent_run_id: str) -> str:
+    return f"active_runs:run:{agent_run_id}"
+
+
+async def register(instance_id: str, agent_run_id: str):
+    """Register a run as active on an instance, or renew its lease."""
+    expires_at = time.time() + ACTIVE_RUN_LEASE_SECONDS
+    for key, member in ((instance_runs_key(instance_id), agent_run_id), (run_instances_key(agent_run_id), instance_id)):
+        await redis.zadd(key, {member: expires_at})
+        await redis.expire(key, ACTIVE_RUN_LEASE_SECONDS)
+
+
+async def heartbeat(instance_id: str, agent_run_id: str):
+    """Renew the lease of an active run."""
+    await register(instance_id, agent_run_id)
+
+
+async def unregister(instance_id: str, agent_run_id: str):
+    """Remove a run from the registry of an instance."""
+    await redis.zrem(instance_runs_key(instance_id), agent_run_id)
+    await redis.zrem(run_instances_key(agent_run_id), instance_id)
+
+
+async def _get_active(key: str) -> List[str]:
+    now = time.time()
+    await redis.zremrangebyscore(key, '-inf', now)
+    return await redis.zrangebyscore(key, now, '+inf')
+
+
+async def get_instance_runs(instance_id: str) -> List[str]:
+    """Get the active runs of an instance."""
+    try:
+        return await _get_active(instance_runs_key(instance_id))
+    except Exception as e:
+        logger.error(f"Failed to get active runs of instance {instance_id}: {str(e)}")
+        return []
+
+
+async def get_run_instances(agent_run_id: str) -> List[str]:
+    """Get the instances a run is active on."""
+    try:
+        return await _get_active(run_instances_key(agent_run_id))
+    except Exception as e:
+        logger.error(f"Failed to get instances of agent run {agent_run_id}: {str(e)}")
+        return []
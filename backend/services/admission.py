@@ -0,0 +1,314 @@
+"""
+Admission control and per-account fair queuing for agent runs.
+
+Agent runs hold a slot while they execute. Slots are capped globally and per
+account, and tracked in Redis sorted sets scored by lease expiry, so slots of
+crashed workers free themselves. Workers renew the lease while the run is in
+progress and release the slot when it ends.
+
+Runs over a cap wait in a queue instead of being sent to Dramatiq:
+
+- admission:queue:{account_id}: run IDs of the account, oldest first
+- admission:lane:{lane}: ring of accounts with queued runs in the lane
+- admission:runs: run ID -> queued run (account, lane, actor arguments)
+
+When a slot is released the dispatcher takes the next account of a lane in
+round-robin order and starts its oldest run, so one account cannot starve the
+others. Paid accounts get LANE_WEIGHTS["paid"] turns for each free turn.
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+MAX_RUNNING_GLOBAL = int(os.getenv('AGENT_RUNS_MAX_GLOBAL', 200))
+MAX_RUNNING_PER_ACCOUNT = {
+    'paid': int(os.getenv('AGENT_RUNS_MAX_PER_ACCOUNT_PAID', 5)),
+    'free': int(os.getenv('AGENT_RUNS_MAX_PER_ACCOUNT_FREE', 2)),
+}
+LANE_WEIGHTS = {'paid': 3, 'free': 1}
+# Seconds a slot is held without a heartbeat
+SLOT_LEASE_SECONDS = 300
+DISPATCH_LOCK_SECONDS = 30
+
+RUNNING_KEY = "admission:running"
+SLOT_ACCOUNTS_KEY = "admission:slot_accounts"
+QUEUED_RUNS_KEY = "admission:runs"
+LANE_CURSOR_KEY = "admission:lane_cursor"
+DISPATCH_LOCK_KEY = "admission:dispatch_lock"
+# Set by dispatch calls that found the lock taken
+DISPATCH_AGAIN_KEY = "admission:dispatch_again"
+
+# Result codes of the admission script
+ADMITTED = 1
+GLOBAL_FULL = 0
+ACCOUNT_FULL = -1
+
+# KEYS: global running set, account running set, slot accounts hash
+# ARGV: run_id, account_id, now, lease expiry, global cap, account cap
+_ADMIT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 1
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[5]) then
+    return 0
+end
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[6]) then
+    return -1
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[4]) - tonumber(ARGV[3]))
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+return 1
+"""
+
+# KEYS: dispatch lock; ARGV: lock token. Deletes the lock only if it is still ours
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: dispatch lock, dispatch-again flag; ARGV: lock token, lock seconds
+# Returns 1 if the lock is kept for another pass, 0 if it was released or is not ours
+_DISPATCH_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return 0
+"""
+
+
+def account_running_key(account_id: str) -> str:
+    return f"admission:running:{account_id}"
+
+
+def account_queue_key(account_id: str) -> str:
+    return f"admission:queue:{account_id}"
+
+
+def lane_key(lane: str) -> str:
+    return f"admission:lane:{lane}"
+
+
+def lane_for_subscription(subscription: Optional[Dict]) -> str:
+    """Get the priority lane of an account from its subscription info."""
+    if not subscription:
+        return 'free'
+    price_id = subscription.get('price_id')
+    if subscription.get('items') and subscription['items'].get('data'):
+        price_id = subscription['items']['data'][0]['price']['id']
+    return 'free' if price_id in (None, config.STRIPE_FREE_TIER_ID) else 'paid'
+
+
+
+async def try_admit(agent_run_id: str, account_id: str, lane: str) -> int:
+    """Take a slot for a run if the global and account caps allow it.
+
+    Returns:
+        ADMITTED, GLOBAL_FULL or ACCOUNT_FULL
+    """
+    now = time.time()
+    return int(await redis.eval(
+        _ADMIT_SCRIPT,
+        [RUNNING_KEY, account_running_key(account_id), SLOT_ACCOUNTS_KEY],
+        [agent_run_id, account_id, now, now + SLOT_LEASE_SECONDS, MAX_RUNNING_GLOBAL, MAX_RUNNING_PER_ACCOUNT[lane]]
+    ))
+
+
+async def admit(agent_run_id: str, account_id: str, lane: str) -> bool:
+    """Take a slot for a new run unless it has to queue.
+
+    Runs of an account with queued runs queue behind them.
+    """
+    if await redis.llen(account_queue_key(account_id)):
+        return False
+    return await try_admit(agent_run_id, account_id, lane) == ADMITTED
+
+
+async def enqueue(agent_run_id: str, account_id: str, lane: str, run_kwargs: Dict[str, Any]):
+    """Queue a run that was not admitted, with the arguments to start it later."""
+    await redis.hset(QUEUED_RUNS_KEY, agent_run_id, json.dumps({
+        'account_id': account_id,
+        'lane': lane,
+        'run_kwargs': run_kwargs,
+        'queued_at': datetime.now(timezone.utc).isoformat()
+    }))
+    if await redis.rpush(account_queue_key(account_id), agent_run_id) == 1:
+        # First queued run of the account: give it a place in the lane
+        await redis.lrem(lane_key(lane), 0, account_id)
+        await redis.rpush(lane_key(lane), account_id)
+    logger.info(f"Queued agent run {agent_run_id} of account {account_id} ({lane} lane)")
+
+
+async def cancel_queued(agent_run_id: str) -> bool:
+    """Remove a run from its queue. Returns True if it was queued."""
+    raw = await redis.hget(QUEUED_RUNS_KEY, agent_run_id)
+    if not raw:
+        return False
+    entry = json.loads(raw)
+    await redis.lrem(account_queue_key(entry['account_id']), 0, agent_run_id)
+    await redis.hdel(QUEUED_RUNS_KEY, agent_run_id)
+    logger.info(f"Removed queued agent run {agent_run_id} of account {entry['account_id']}")
+    return True
+
+
+async def heartbeat(agent_run_id: str):
+    """Renew the lease of a run's slot."""
+    account_id = await redis.hget(SLOT_ACCOUNTS_KEY, agent_run_id)
+    if not account_id:
+        return
+    expires_at = time.time() + SLOT_LEASE_SECONDS
+    await redis.zadd(RUNNING_KEY, {agent_run_id: expires_at}, xx=True)
+    await redis.zadd(account_running_key(account_id), {agent_run_id: expires_at}, xx=True)
+
+
+async def release(agent_run_id: str):
+    """Free the slot of a finished run."""
+    account_id = await redis.hget(SLOT_ACCOUNTS_KEY, agent_run_id)
+    await redis.zrem(RUNNING_KEY, agent_run_id)
+    if account_id:
+        await redis.zrem(account_running_key(account_id), agent_run_id)
+        await redis.hdel(SLOT_ACCOUNTS_KEY, agent_run_id)
+
+
+async def _lane_order() -> List[str]:
+    """Lanes to try for the next dispatch, following the weighted schedule."""
+    schedule = [lane for lane, weight in LANE_WEIGHTS.items() for _ in range(weight)]
+    first = schedule[await redis.incr(LANE_CURSOR_KEY) % len(schedule)]
+    return [first] + [lane for lane in LANE_WEIGHTS if lane != first]
+
+
+async def _dispatch_from_lane(lane: str, start_run: Callable[[str, Dict[str, Any]], Awaitable[None]]) -> Optional[int]:
+    """Start the next run of the lane, visiting each account at most once.
+
+    Returns:
+        ADMITTED, GLOBAL_FULL, or None when no account of the lane can start a run
+    """
+    for _ in range(await redis.llen(lane_key(lane))):
+        account_id = await redis.lpop(lane_key(lane))
+        if not account_id:
+            return None
+        queue_key = account_queue_key(account_id)
+        agent_run_id = await redis.lindex(queue_key, 0)
+        if not agent_run_id:
+            continue  # Queue emptied by cancellations; the account leaves the ring
+        raw = await redis.hget(QUEUED_RUNS_KEY, agent_run_id)
+        if not raw:
+            await redis.lrem(queue_key, 1, agent_run_id)
+            if await redis.llen(queue_key):
+                await redis.rpush(lane_key(lane), account_id)
+            continue
+
+        result = await try_admit(agent_run_id, account_id, lane)
+        if result == GLOBAL_FULL:
+            await redis.lpush(lane_key(lane), account_id)
+            return GLOBAL_FULL
+        if result == ACCOUNT_FULL:
+            await redis.rpush(lane_key(lane), account_id)
+            continue
+
+        await redis.lrem(queue_key, 1, agent_run_id)
+        await redis.hdel(QUEUED_RUNS_KEY, agent_run_id)
+        if await redis.llen(queue_key):
+            await redis.rpush(lane_key(lane), account_id)
+        queued_run = json.loads(raw)
+        try:
+            await start_run(agent_run_id, queued_run)
+        except Exception as e:
+            # start_run could not settle the run; queue it again at the head of its account
+            logger.error(f"Failed to start queued agent run {agent_run_id}, requeueing it: {str(e)}", exc_info=True)
+            await release(agent_run_id)
+            await redis.hset(QUEUED_RUNS_KEY, agent_run_id, raw)
+            if await redis.lpush(queue_key, agent_run_id) == 1:
+                await redis.rpush(lane_key(lane), account_id)
+            return None
+        return ADMITTED
+    return None
+
+
+async def _dispatch_pass(start_run: Callable[[str, Dict[str, Any]], Awaitable[None]]) -> int:
+    """Start queued runs until no lane can start one. Returns the number started."""
+    started = 0
+    while True:
+        result = None
+        for lane in await _lane_order():
+            result = await _dispatch_from_lane(lane, start_run)
+            if result is not None:
+                break
+        if result != ADMITTED:
+            return started
+        started += 1
+
+
+async def dispatch(start_run: Callable[[str, Dict[str, Any]], Awaitable[None]]) -> int:
+    """Start queued runs while slots are free.
+
+    Only one process dispatches at a time. A call that finds the lock taken
+    sets the dispatch-again flag, and the holder makes another pass for it
+    before unlocking, so slots freed during a pass are not missed.
+
+    Args:
+        start_run: Called with the run ID and queued run of each admitted run.
+            It marks runs it cannot start as failed; runs it raises for are requeued.
+
+    Returns:
+        Number of runs started
+    """
+    token = uuid.uuid4().hex
+    if not await redis.set(DISPATCH_LOCK_KEY, token, nx=True, ex=DISPATCH_LOCK_SECONDS):
+        await redis.set(DISPATCH_AGAIN_KEY, "1", ex=DISPATCH_LOCK_SECONDS)
+        # The holder may have unlocked before the flag was set
+        if not await redis.set(DISPATCH_LOCK_KEY, token, nx=True, ex=DISPATCH_LOCK_SECONDS):
+            return 0  # The holder dispatches again for this call
+    started = 0
+    try:
+        while True:
+            # This pass covers every release flagged so far
+            await redis.delete(DISPATCH_AGAIN_KEY)
+            started += await _dispatch_pass(start_run)
+            if not await redis.eval(_DISPATCH_UNLOCK_SCRIPT, [DISPATCH_LOCK_KEY, DISPATCH_AGAIN_KEY], [token, DISPATCH_LOCK_SECONDS]):
+                break
+    except Exception as e:
+        logger.error(f"Error dispatching queued agent runs: {str(e)}", exc_info=True)
+        await redis.eval(_RELEASE_LOCK_SCRIPT, [DISPATCH_LOCK_KEY], [token])
+    if started:
+        logger.info(f"Dispatched {started} queued agent runs")
+    return started
+
+
+async def get_queue_depth(account_id: Optional[str] = None) -> Dict[str, Any]:
+    """Get running and queued run counts, globally and for an account."""
+    now = time.time()
+    depth: Dict[str, Any] = {
+        'running': await redis.zcount(RUNNING_KEY, now, '+inf'),
+        'max_running': MAX_RUNNING_GLOBAL,
+        'queued': {}
+    }
+    for lane in LANE_WEIGHTS:
+        queued = 0
+        for lane_account in await redis.lrange(lane_key(lane), 0, -1):
+            queued += await redis.llen(account_queue_key(lane_account))
+        depth['queued'][lane] = queued
+    if account_id:
+        depth['account'] = {
+            'running': await redis.zcount(account_running_key(account_id), now, '+inf'),
+            'queued': await redis.llen(account_queue_key(account_id))
+        }
+    return depth
@@ -0,0 +1,112 @@
+"""
+Incremental archival of agent run responses.
+
+Responses are collected while the run produces them and written to the
+agent_run_response_segments table in gzip-compressed segments, so finishing a
+run does not read back and write its whole response history at once.
+
+The archive is read back by GET /agent-run/{id}?include_responses=true and by
+the stream endpoint, which replays it once the Redis stream of a finished run
+has expired.
+"""
+
+import asyncio
+import base64
+import gzip
+import json
+from typing import Any, Dict, List
+
+from utils.logger import logger
+
+# Responses per archived segment
+SEGMENT_SIZE = 500
+# Uncompressed bytes after which a segment is written early
+MAX_SEGMENT_BYTES = 1024 * 1024
+# Attempts per segment write before the segment is dropped
+MAX_WRITE_ATTEMPTS = 3
+SEGMENT_ENCODING = "gzip+base64"
+
+
+def encode_segment(responses_json: List[str]) -> str:
+    """Compress a segment of JSON-encoded responses."""
+    raw = ("[" + ",".join(responses_json) + "]").encode()
+    return base64.b64encode(gzip.compress(raw)).decode()
+
+
+def decode_segment(content: str) -> List[Dict[str, Any]]:
+    """Decompress a segment written by encode_segment."""
+    return json.loads(gzip.decompress(base64.b64decode(content)))
+
+
+class ResponseArchiver:
+    """Archives the responses of one agent run in compressed segments.
+
+    add() only buffers; full segments are written by background tasks in order,
+    and close() writes the remainder and waits for every write.
+    """
+
+    def __init__(self, client, agent_run_id: str):
+        self.client = client
+        self.agent_run_id = agent_run_id
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._next_segment_index = 0
+        self._write_lock = asyncio.Lock()
+        self._write_tasks: List[asyncio.Task] = []
+
+    def add(self, response: Dict[str, Any]):
+        """Buffer a response, writing the segment in the background once it is full."""
+        response_json = json.dumps(response)
+        self._buffer.append(response_json)
+        self._buffer_bytes += len(response_json)
+        if len(self._buffer) >= SEGMENT_SIZE or self._buffer_bytes >= MAX_SEGMENT_BYTES:
+            self._schedule_write()
+
+    def _schedule_write(self):
+        if not self._buffer:
+            return
+        segment, index = self._buffer, self._next_segment_index
+        self._buffer, self._buffer_bytes = [], 0
+        self._next_segment_index += 1
+        self._write_tasks = [task for task in self._write_tasks if not task.done()]
+        self._write_tasks.append(asyncio.create_task(self._write_segment(index, segment)))
+
+    async def _write_segment(self, index: int, segment: List[str]):
+        async with self._write_lock:
+            row = {
+                'agent_run_id': self.agent_run_id,
+                'segment_index': index,
+                'response_count': len(segment),
+                'encoding': SEGMENT_ENCODING,
+                'content': encode_segment(segment)
+            }
+            for attempt in range(MAX_WRITE_ATTEMPTS):
+                try:
+                    await self.client.table('agent_run_response_segments').upsert(row, returning='minimal').execute()
+                    logger.debug(f"Archived segment {index} ({len(segment)} responses) of agent run {self.agent_run_id}")
+                    return
+                except Exception as e:
+                    logger.warning(f"Failed to archive segment {index} of agent run {self.agent_run_id} (attempt {attempt + 1}): {str(e)}")
+                    if attempt < MAX_WRITE_ATTEMPTS - 1:
+                        await asyncio.sleep(0.5 * (2 ** attempt))
+            logger.error(f"Dropping segment {index} ({len(segment)} responses) of agent run {self.agent_run_id} after {MAX_WRITE_ATTEMPTS} attempts")
+
+    async def close(self):
+        """Write the buffered responses and wait for all segment writes."""
+        self._schedule_write()
+        if self._write_tasks:
+            await asyncio.gather(*self._write_tasks, return_exceptions=True)
+            self._write_tasks = []
+
+
+async def load_responses(client, agent_run_id: str) -> List[Dict[str, Any]]:
+    """Get the archived responses of an agent run in order."""
+    result = await client.table('agent_run_response_segments') \
+        .select('content') \
+        .eq('agent_run_id', agent_run_id) \
+        .order('segment_index') \
+        .execute()
+    responses = []
+    for segment in result.data or []:
+        responses.extend(decode_segment(segment['content']))
+    return responses
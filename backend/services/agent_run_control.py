@@ -0,0 +1,90 @@
+"""
+Control-plane listener for agent runs executing in this worker process.
+
+One pattern subscription to agent_run:*:control* is shared by every run of the
+process, instead of one pub/sub connection and polling loop per run. STOP
+signals are routed to the asyncio.Event of the matching run.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from services import redis
+from utils.logger import logger
+
+CONTROL_PATTERN = "agent_run:*:control*"
+# Seconds get_message waits for a signal before checking the listener state again
+POLL_TIMEOUT = 1.0
+# Seconds to wait before resubscribing after a Redis error
+RECONNECT_DELAY = 1.0
+
+
+def _agent_run_id_from_channel(channel: str) -> Optional[str]:
+    # agent_run:{id}:control or agent_run:{id}:control:{instance_id}
+    parts = channel.split(":")
+    if len(parts) >= 3 and parts[0] == "agent_run" and parts[2] == "control":
+        return parts[1]
+    return None
+
+
+class RunControlListener:
+    """Routes STOP signals to the runs registered in this process."""
+
+    def __init__(self):
+        self._stop_events: Dict[str, asyncio.Event] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+    async def register(self, agent_run_id: str) -> asyncio.Event:
+        """Get the event set when a STOP signal for the run is published."""
+        event = asyncio.Event()
+        self._stop_events[agent_run_id] = event
+        async with self._start_lock:
+            if self._listener_task is None or self._listener_task.done():
+                ready = asyncio.Event()
+                self._listener_task = asyncio.create_task(self._listen(ready))
+                # Signals published before the subscription is active are missed
+                await ready.wait()
+        return event
+
+    def unregister(self, agent_run_id: str):
+        self._stop_events.pop(agent_run_id, None)
+
+    async def _listen(self, ready: asyncio.Event):
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.psubscribe(CONTROL_PATTERN)
+                logger.info(f"Subscribed to agent run control channels ({CONTROL_PATTERN})")
+                ready.set()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=POLL_TIMEOUT)
+                    if message and message.get("type") == "pmessage":
+                        self._dispatch(message.get("channel"), message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent run control listener failed, resubscribing: {e}")
+                ready.set()
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                if pubsub:
+                    try:
+                        await pubsub.close()
+                    except Exception as e:
+                        logger.debug(f"Error closing control pubsub: {e}")
+
+    def _dispatch(self, channel, data):
+        if isinstance(channel, bytes): channel = channel.decode('utf-8')
+        if isinstance(data, bytes): data = data.decode('utf-8')
+        if data != "STOP":
+            return
+        agent_run_id = _agent_run_id_from_channel(channel)
+        event = self._stop_events.get(agent_run_id)
+        if event:
+            logger.info(f"Received STOP signal for agent run {agent_run_id} on {channel}")
+            event.set()
+
+
+run_control_listener = RunControlListener()
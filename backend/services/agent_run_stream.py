@@ -0,0 +1,219 @@
+"""
+Redis Streams transport for agent run responses.
+
+The worker appends every response of a run to agent_run:{id}:stream with XADD,
+and API processes tail it with XREAD BLOCK, using entry IDs as resumable
+cursors. Control signals (STOP, END_STREAM, ERROR) are appended as entries too,
+so a reader blocked on the stream wakes up for them without a pub/sub channel.
+Streams are trimmed to about STREAM_MAXLEN entries.
+
+API processes share one reader per run through run_stream_hub: it tails the
+stream with a single XREAD BLOCK loop while the run has local subscribers and
+fans entries out to their in-memory queues.
+
+Runs started before this transport push to the agent_run:{id}:responses list and
+notify readers on agent_run:{id}:new_response; readers fall back to that list
+for runs that have no stream.
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from services import redis
+from utils.logger import logger
+
+# Approximate number of entries kept per run stream
+STREAM_MAXLEN = 20000
+# Keep XREAD BLOCK below the Redis client socket timeout
+READ_BLOCK_MS = 2000
+CONTROL_SIGNALS = ("STOP", "END_STREAM", "ERROR")
+# Consecutive read failures after which hub subscribers are told the feed failed
+MAX_READ_FAILURES = 3
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:stream"
+
+
+def legacy_response_list_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:responses"
+
+
+def legacy_response_channel(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:new_response"
+
+
+@dataclass
+class StreamEntry:
+    """An entry of a run stream: either a response or a control signal."""
+    entry_id: str
+    response: Optional[Dict[str, Any]] = None
+    control: Optional[str] = None
+
+
+def _parse_entries(raw_entries) -> List[StreamEntry]:
+    entries = []
+    for entry_id, fields in raw_entries or []:
+        if 'control' in fields:
+            entries.append(StreamEntry(entry_id=entry_id, control=fields['control']))
+        elif 'data' in fields:
+            entries.append(StreamEntry(entry_id=entry_id, response=json.loads(fields['data'])))
+    return entries
+
+
+async def append_response(agent_run_id: str, response: Dict[str, Any]) -> str:
+    """Append a response to the run stream. Returns its entry ID."""
+    return await redis.xadd(response_stream_key(agent_run_id), {'data': json.dumps(response)}, maxlen=STREAM_MAXLEN)
+
+
+async def append_control(agent_run_id: str, signal: str) -> Optional[str]:
+    """Append a control signal to the run stream so blocked readers see it. Errors are logged."""
+    try:
+        return await redis.xadd(response_stream_key(agent_run_id), {'control': signal}, maxlen=STREAM_MAXLEN)
+    except Exception as e:
+        logger.warning(f"Failed to append control signal {signal} to stream of agent run {agent_run_id}: {str(e)}")
+        return None
+
+
+async def read_range(agent_run_id: str, after_id: Optional[str] = None, count: Optional[int] = None) -> List[StreamEntry]:
+    """Get the entries stored in the run stream, after `after_id` if given."""
+    min_id = f"({after_id}" if after_id else "-"
+    return _parse_entries(await redis.xrange(response_stream_key(agent_run_id), min=min_id, count=count))
+
+
+def is_entry_id(value: str) -> bool:
+    """Whether `value` looks like a stream entry ID (<ms>-<seq>)."""
+    ms, _, seq = value.partition('-')
+    return ms.isdigit() and seq.isdigit()
+
+
+def entry_id_after(entry_id: str, other_id: Optional[str]) -> bool:
+    """Whether stream entry `entry_id` comes after `other_id` (None means the start)."""
+    if other_id is None:
+        return True
+    return _parse_entry_id(entry_id) > _parse_entry_id(other_id)
+
+
+def _parse_entry_id(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+async def get_last_entry_id(agent_run_id: str) -> Optional[str]:
+    """Get the ID of the latest entry of the run stream, None if it is empty."""
+    entries = await redis.xrevrange(response_stream_key(agent_run_id), count=1)
+    return entries[0][0] if entries else None
+
+
+async def read_entries(agent_run_id: str, after_id: str = "0-0", block_ms: int = READ_BLOCK_MS, count: Optional[int] = None) -> List[StreamEntry]:
+    """Wait up to `block_ms` for entries after `after_id`. Returns an empty list on timeout."""
+    key = response_stream_key(agent_run_id)
+    result = await redis.xread({key: after_id}, count=count, block=block_ms)
+    for stream_key, raw_entries in result or []:
+        if stream_key == key:
+            return _parse_entries(raw_entries)
+    return []
+
+
+async def uses_legacy_list(agent_run_id: str) -> bool:
+    """Whether the run was started by a worker that still writes to the response list."""
+    if await redis.exists(response_stream_key(agent_run_id)):
+        return False
+    return await redis.llen(legacy_response_list_key(agent_run_id)) > 0
+
+
+async def expire(agent_run_id: str, ttl: int):
+    """Set a TTL on the run stream and legacy list."""
+    await redis.expire(response_stream_key(agent_run_id), ttl)
+    await redis.expire(legacy_response_list_key(agent_run_id), ttl)
+
+
+@dataclass
+class _RunFeed:
+    agent_run_id: str
+    last_entry_id: str
+    subscribers: Set[asyncio.Queue] = field(default_factory=set)
+    reader_task: Optional[asyncio.Task] = None
+
+
+class RunStreamHub:
+    """Shares one stream reader per run among the SSE clients of this process.
+
+    Subscribers get an asyncio.Queue of StreamEntry items; None is put when the
+    reader gives up after repeated Redis errors. The reader starts with the first
+    subscriber of a run and stops with the last one.
+    """
+
+    def __init__(self):
+        self._feeds: Dict[str, _RunFeed] = {}
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, agent_run_id: str) -> AsyncIterator[asyncio.Queue]:
+        """Receive the entries added to the run stream from now on.
+
+        Entries already in the stream, and a few read just before subscribing,
+        are not delivered; replay them with read_range and skip duplicates by ID.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        async with self._lock:
+            feed = self._feeds.get(agent_run_id)
+            if feed is None:
+                feed = _RunFeed(agent_run_id=agent_run_id, last_entry_id=await get_last_entry_id(agent_run_id) or "0-0")
+                self._feeds[agent_run_id] = feed
+            feed.subscribers.add(queue)
+            if feed.reader_task is None or feed.reader_task.done():
+                feed.reader_task = asyncio.create_task(self._read_feed(feed))
+        logger.debug(f"Subscribed to agent run {agent_run_id} feed ({len(feed.subscribers)} local subscribers)")
+        try:
+            yield queue
+        finally:
+            await self._unsubscribe(feed, queue)
+
+    async def _unsubscribe(self, feed: _RunFeed, queue: asyncio.Queue):
+        async with self._lock:
+            feed.subscribers.discard(queue)
+            if feed.subscribers:
+                return
+            if self._feeds.get(feed.agent_run_id) is feed:
+                del self._feeds[feed.agent_run_id]
+            reader_task = feed.reader_task
+        if reader_task and not reader_task.done():
+            reader_task.cancel()
+            try:
+                await reader_task
+            except asyncio.CancelledError:
+                pass
+        logger.debug(f"Closed agent run {feed.agent_run_id} feed")
+
+    async def _read_feed(self, feed: _RunFeed):
+        failures = 0
+        while feed.subscribers:
+            try:
+                entries = await read_entries(feed.agent_run_id, after_id=feed.last_entry_id)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Failed to read stream of agent run {feed.agent_run_id} (attempt {failures}): {str(e)}")
+                if failures >= MAX_READ_FAILURES:
+                    for queue in list(feed.subscribers):
+                        queue.put_nowait(None)
+                    return
+                await asyncio.sleep(0.5 * failures)
+                continue
+
+            for entry in entries:
+                feed.last_entry_id = entry.entry_id
+                for queue in list(feed.subscribers):
+                    queue.put_nowait(entry)
+            if any(entry.control is not None for entry in entries):
+                # The run has ended; late subscribers replay the stream instead
+                return
+
+
+run_stream_hub = RunStreamHub()
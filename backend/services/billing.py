@@ -7,10 +7,13 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import Optional, Dict, Tuple
 import stripe
+import json
+import asyncio
 from datetime import datetime, timezone
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services import redis, usage
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES
@@ -20,6 +23,10 @@ stripe.api_key = config.STRIPE_SECRET_KEY
 # Initialize router
 router = APIRouter(prefix="/billing", tags=["billing"])
 
+# Redis caches, invalidated by the Stripe webhook
+SUBSCRIPTION_CACHE_TTL = 300  # Stripe subscription of an account
+ENTITLEMENT_CACHE_TTL = 30    # Result of check_billing_status, bounded by usage drift
+
 
 SUBSCRIPTION_TIERS = {
     config.STRIPE_FREE_TIER_ID: {'name': 'free', 'minutes': 60},
@@ -86,118 +93,137 @@ async def create_stripe_customer(client, user_id: str, email: str) -> str:
     
     return customer.id
 
-async def get_user_subscription(user_id: str) -> Optional[Dict]:
-    """Get the current subscription for a user from Stripe."""
+def _subscription_cache_key(user_id: str) -> str:
+    return f"billing:subscription:{user_id}"
+
+def _entitlement_cache_key(user_id: str) -> str:
+    return f"billing:entitlement:{user_id}"
+
+async def _get_cached_json(key: str):
+    """Read a JSON value from Redis. Returns (found, value); errors count as a miss."""
     try:
-        # Get customer ID
-        db = DBConnection()
-        client = await db.client
-        customer_id = await get_stripe_customer_id(client, user_id)
-        
-        if not customer_id:
-            return None
-            
-        # Get all active subscriptions for the customer
-        subscriptions = stripe.Subscription.list(
-            customer=customer_id,
-            status='active'
-        )
-        # print("Found subscriptions:", subscriptions)
-        
-        # Check if we have any subscriptions
-        if not subscriptions or not subscriptions.get('data'):
-            return None
-            
-        # Filter subscriptions to only include our product's subscriptions
-        our_subscriptions = []
-        for sub in subscriptions['data']:
-            # Get the first subscription item
-            if sub.get('items') and sub['items'].get('data') and len(sub['items']['data']) > 0:
-                item = sub['items']['data'][0]
-                if item.get('price') and item['price'].get('id') in [
-                    config.STRIPE_FREE_TIER_ID,
-                    config.STRIPE_TIER_2_20_ID,
-                    config.STRIPE_TIER_6_50_ID,
-                    config.STRIPE_TIER_12_100_ID,
-                    config.STRIPE_TIER_25_200_ID,
-                    config.STRIPE_TIER_50_400_ID,
-                    config.STRIPE_TIER_125_800_ID,
-                    config.STRIPE_TIER_200_1000_ID
-                ]:
-                    our_subscriptions.append(sub)
-        
-        if not our_subscriptions:
-            return None
-            
-        # If there are multiple active subscriptions, we need to handle this
-        if len(our_subscriptions) > 1:
-            logger.warning(f"User {user_id} has multiple active subscriptions: {[sub['id'] for sub in our_subscriptions]}")
-            
-            # Get the most recent subscription
-            most_recent = max(our_subscriptions, key=lambda x: x['created'])
-            
-            # Cancel all other subscriptions
-            for sub in our_subscriptions:
-                if sub['id'] != most_recent['id']:
-                    try:
-                        stripe.Subscription.modify(
-                            sub['id'],
-                            cancel_at_period_end=True
-                        )
-                        logger.info(f"Cancelled subscription {sub['id']} for user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Error cancelling subscription {sub['id']}: {str(e)}")
-            
-            return most_recent
-            
-        return our_subscriptions[0]
-        
+        raw = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Billing cache read failed for {key}: {str(e)}")
+        return False, None
+    if raw is None:
+        return False, None
+    return True, json.loads(raw)
+
+async def _set_cached_json(key: str, value, ttl: int):
+    try:
+        await redis.set(key, json.dumps(value, default=str), ex=ttl)
+    except Exception as e:
+        logger.warning(f"Billing cache write failed for {key}: {str(e)}")
+
+async def invalidate_billing_cache(user_id: str):
+    """Drop the cached subscription and entitlement of an account."""
+    try:
+        await redis.delete(_subscription_cache_key(user_id))
+        await redis.delete(_entitlement_cache_key(user_id))
+        logger.info(f"Invalidated billing cache for account {user_id}")
+    except Exception as e:
+        logger.error(f"Failed to invalidate billing cache for account {user_id}: {str(e)}")
+
+async def get_user_subscription(user_id: str, use_cache: bool = False) -> Optional[Dict]:
+    """Get the current subscription for a user from Stripe.
+    
+    With use_cache, a subscription (or its absence) fetched in the last
+    SUBSCRIPTION_CACHE_TTL seconds is returned from Redis as a plain dict.
+    Returns None when the lookup fails; failures are never cached.
+    """
+    try:
+        if use_cache:
+            return await _get_cached_subscription(user_id)
+        return await _fetch_user_subscription(user_id)
     except Exception as e:
         logger.error(f"Error getting subscription from Stripe: {str(e)}")
         return None
 
-async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    # Get start of current month in UTC
-    now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    
-    # First get all threads for this user
-    threads_result = await client.table('threads') \
-        .select('thread_id') \
-        .eq('account_id', user_id) \
-        .execute()
-    
-    if not threads_result.data:
-        return 0.0
-    
-    thread_ids = [t['thread_id'] for t in threads_result.data]
-    
-    # Then get all agent runs for these threads in current month
-    runs_result = await client.table('agent_runs') \
-        .select('started_at, completed_at') \
-        .in_('thread_id', thread_ids) \
-        .gte('started_at', start_of_month.isoformat()) \
-        .execute()
-    
-    if not runs_result.data:
-        return 0.0
+async def _get_cached_subscription(user_id: str) -> Optional[Dict]:
+    """Get the subscription through the Redis cache. Lookup errors are raised, not cached."""
+    found, cached = await _get_cached_json(_subscription_cache_key(user_id))
+    if found:
+        return cached
+    subscription = await _fetch_user_subscription(user_id)
+    await _set_cached_json(_subscription_cache_key(user_id), subscription, SUBSCRIPTION_CACHE_TTL)
+    return subscription
+
+async def _fetch_user_subscription(user_id: str) -> Optional[Dict]:
+    """Fetch the subscription from Stripe. Returns None if there is none; errors are raised."""
+    # Get customer ID
+    db = DBConnection()
+    client = await db.client
+    customer_id = await get_stripe_customer_id(client, user_id)
     
-    # Calculate total minutes
-    total_seconds = 0
-    now_ts = now.timestamp()
+    if not customer_id:
+        return None
+        
+    # Get all active subscriptions for the customer
+    # Stripe's client is synchronous; keep it off the event loop
+    subscriptions = await asyncio.to_thread(
+        stripe.Subscription.list,
+        customer=customer_id,
+        status='active'
+    )
+    # print("Found subscriptions:", subscriptions)
     
-    for run in runs_result.data:
-        start_time = datetime.fromisoformat(run['started_at'].replace('Z', '+00:00')).timestamp()
-        if run['completed_at']:
-            end_time = datetime.fromisoformat(run['completed_at'].replace('Z', '+00:00')).timestamp()
-        else:
-            # For running jobs, use current time
-            end_time = now_ts
+    # Check if we have any subscriptions
+    if not subscriptions or not subscriptions.get('data'):
+        return None
         
-        total_seconds += (end_time - start_time)
+    # Filter subscriptions to only include our product's subscriptions
+    our_subscriptions = []
+    for sub in subscriptions['data']:
+        # Get the first subscription item
+        if sub.get('items') and sub['items'].get('data') and len(sub['items']['data']) > 0:
+            item = sub['items']['data'][0]
+            if item.get('price') and item['price'].get('id') in [
+                config.STRIPE_FREE_TIER_ID,
+                config.STRIPE_TIER_2_20_ID,
+                config.STRIPE_TIER_6_50_ID,
+                config.STRIPE_TIER_12_100_ID,
+                config.STRIPE_TIER_25_200_ID,
+                config.STRIPE_TIER_50_400_ID,
+                config.STRIPE_TIER_125_800_ID,
+                config.STRIPE_TIER_200_1000_ID
+            ]:
+                our_subscriptions.append(sub)
     
-    return total_seconds / 60  # Convert to minutes
+    if not our_subscriptions:
+        return None
+        
+    # If there are multiple active subscriptions, we need to handle this
+    if len(our_subscriptions) > 1:
+        logger.warning(f"User {user_id} has multiple active subscriptions: {[sub['id'] for sub in our_subscriptions]}")
+        
+        # Get the most recent subscription
+        most_recent = max(our_subscriptions, key=lambda x: x['created'])
+        
+        # Cancel all other subscriptions
+        for sub in our_subscriptions:
+            if sub['id'] != most_recent['id']:
+                try:
+                    await asyncio.to_thread(
+                        stripe.Subscription.modify,
+                        sub['id'],
+                        cancel_at_period_end=True
+                    )
+                    logger.info(f"Cancelled subscription {sub['id']} for user {user_id}")
+                except Exception as e:
+                    logger.error(f"Error cancelling subscription {sub['id']}: {str(e)}")
+        
+        return most_recent
+        
+    return our_subscriptions[0]
+
+async def calculate_monthly_usage(client, user_id: str) -> float:
+    """Calculate total agent run minutes for the current month for a user.
+
+    Reads the running usage counter kept by services.usage; agent_runs are only
+    scanned when the counter has to be rebuilt.
+    """
+    return await usage.get_monthly_usage_minutes(client, user_id)
 
 async def get_allowed_models_for_user(client, user_id: str):
     """
@@ -207,7 +233,7 @@ async def get_allowed_models_for_user(client, user_id: str):
         List of model names allowed for the user's subscription tier.
     """
 
-    subscription = await get_user_subscription(user_id)
+    subscription = await get_user_subscription(user_id, use_cache=True)
     tier_name = 'free'
     
     if subscription:
@@ -246,6 +272,9 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
     """
     Check if a user can run agents based on their subscription and usage.
     
+    The result is cached per account for ENTITLEMENT_CACHE_TTL seconds, so
+    repeated checks (e.g. every agent iteration) cost a single Redis read.
+    
     Returns:
         Tuple[bool, str, Optional[Dict]]: (can_run, message, subscription_info)
     """
@@ -257,9 +286,24 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "minutes_limit": "no limit"
         }
     
-    # Get current subscription
-    subscription = await get_user_subscription(user_id)
-    # print("Current subscription:", subscription)
+    found, cached = await _get_cached_json(_entitlement_cache_key(user_id))
+    if found:
+        return tuple(cached)
+    
+    try:
+        subscription = await _get_cached_subscription(user_id)
+    except Exception as e:
+        # Answer from the free tier for this check only; a transient Stripe or DB error
+        # must not downgrade the account for the cache TTL
+        logger.error(f"Error getting subscription from Stripe, not caching billing status: {str(e)}")
+        return await _compute_billing_status(client, user_id, None)
+    
+    result = await _compute_billing_status(client, user_id, subscription)
+    await _set_cached_json(_entitlement_cache_key(user_id), list(result), ENTITLEMENT_CACHE_TTL)
+    return result
+
+async def _compute_billing_status(client, user_id: str, subscription: Optional[Dict]) -> Tuple[bool, str, Optional[Dict]]:
+    """Check subscription tier and monthly usage without the entitlement cache."""
     
     # If no subscription, they can use free tier
     if not subscription:
@@ -827,11 +871,12 @@ async def stripe_webhook(request: Request):
                 else:
                     # Subscription is not active (e.g., past_due, canceled, etc.)
                     # Check if customer has any other active subscriptions before updating status
-                    has_active = len(stripe.Subscription.list(
+                    has_active = len((await asyncio.to_thread(
+                        stripe.Subscription.list,
                         customer=customer_id,
                         status='active',
                         limit=1
-                    ).get('data', [])) > 0
+                    )).get('data', [])) > 0
                     
                     if not has_active:
                         await client.schema('basejump').from_('billing_customers').update(
@@ -841,11 +886,12 @@ async def stripe_webhook(request: Request):
             
             elif event.type == 'customer.subscription.deleted':
                 # Check if customer has any other active subscriptions
-                has_active = len(stripe.Subscription.list(
+                has_active = len((await asyncio.to_thread(
+                    stripe.Subscription.list,
                     customer=customer_id,
                     status='active',
                     limit=1
-                ).get('data', [])) > 0
+                )).get('data', [])) > 0
                 
                 if not has_active:
                     # If no active subscriptions left, set active to false
@@ -854,6 +900,14 @@ async def stripe_webhook(request: Request):
                     ).eq('id', customer_id).execute()
                     logger.info(f"Webhook: Updated customer {customer_id} active status to FALSE after subscription deletion")
             
+            # Drop cached subscription and entitlement of the customer's account
+            customer_result = await client.schema('basejump').from_('billing_customers') \
+                .select('account_id') \
+                .eq('id', customer_id) \
+                .execute()
+            for customer in customer_result.data or []:
+                await invalidate_billing_cache(customer['account_id'])
+            
             logger.info(f"Processed {event.type} event for customer {customer_id}")
         
         return {"status": "success"}
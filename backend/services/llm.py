@@ -8,14 +8,18 @@ This module provides a unified interface for making API calls to different LLM p
 - Retry logic with exponential backoff
 - Model-specific configurations
 - Comprehensive error handling and logging
+- Opt-in Redis cache of non-streaming responses
 """
 
 from typing import Union, Dict, Any, Optional, AsyncGenerator, List
 import os
 import json
+import time
 import asyncio
+import hashlib
 from openai import OpenAIError
 import litellm
+from services import redis
 from utils.logger import logger
 from utils.config import config
 
@@ -27,6 +31,13 @@ MAX_RETRIES = 2
 RATE_LIMIT_DELAY = 30
 RETRY_DELAY = 0.1
 
+# Response cache for auxiliary calls (titles, prompt enhancement, summaries)
+AUXILIARY_CACHE_TTL = 3600 * 24
+LLM_CACHE_PREFIX = "llm_cache"
+LLM_CACHE_INDEX_KEY = "llm_cache:index"
+LLM_CACHE_MAX_ENTRIES = 10000
+LLM_CACHE_MAX_ENTRY_BYTES = 256 * 1024
+
 class LLMError(Exception):
     """Base exception for LLM-related errors."""
     pass
@@ -239,6 +250,45 @@ def prepare_params(
 
     return params
 
+def _response_cache_key(model_name: str, messages: List[Dict[str, Any]], **sampling_params) -> str:
+    """Build a content-addressed cache key from the model, messages and sampling parameters."""
+    payload = json.dumps({
+        "model": model_name,
+        "messages": messages,
+        "params": sampling_params
+    }, sort_keys=True, separators=(',', ':'), default=str)
+    return f"{LLM_CACHE_PREFIX}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+async def _get_cached_response(cache_key: str) -> Optional[litellm.ModelResponse]:
+    """Get a cached response. Cache errors are logged and treated as a miss."""
+    try:
+        raw = await redis.get(cache_key)
+        if raw is None:
+            return None
+        return litellm.ModelResponse(**json.loads(raw))
+    except Exception as e:
+        logger.warning(f"LLM response cache lookup failed: {str(e)}")
+        return None
+
+async def _cache_response(cache_key: str, response: Any, ttl: int) -> None:
+    """Store a response, evicting the oldest entries beyond LLM_CACHE_MAX_ENTRIES."""
+    try:
+        raw = json.dumps(response.model_dump(), default=str)
+        if len(raw) > LLM_CACHE_MAX_ENTRY_BYTES:
+            logger.debug(f"Not caching LLM response of {len(raw)} chars")
+            return
+        await redis.set(cache_key, raw, ex=ttl)
+        await redis.zadd(LLM_CACHE_INDEX_KEY, {cache_key: time.time()})
+        excess = await redis.zcard(LLM_CACHE_INDEX_KEY) - LLM_CACHE_MAX_ENTRIES
+        if excess > 0:
+            evicted = await redis.zrange(LLM_CACHE_INDEX_KEY, 0, excess - 1)
+            for key in evicted:
+                await redis.delete(key)
+            if evicted:
+                await redis.zrem(LLM_CACHE_INDEX_KEY, *evicted)
+    except Exception as e:
+        logger.warning(f"LLM response cache store failed: {str(e)}")
+
 async def make_llm_api_call(
     messages: List[Dict[str, Any]],
     model_name: str,
@@ -253,7 +303,8 @@ async def make_llm_api_call(
     top_p: Optional[float] = None,
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
-    reasoning_effort: Optional[str] = 'low'
+    reasoning_effort: Optional[str] = 'low',
+    cache_ttl: Optional[int] = None
 ) -> Union[Dict[str, Any], AsyncGenerator]:
     """
     Make an API call to a language model using LiteLLM.
@@ -273,6 +324,8 @@ async def make_llm_api_call(
         model_id: Optional ARN for Bedrock inference profiles
         enable_thinking: Whether to enable thinking
         reasoning_effort: Level of reasoning effort
+        cache_ttl: Cache the response in Redis for this many seconds and reuse it for
+            identical calls. Only for non-streaming calls without tools.
 
     Returns:
         Union[Dict[str, Any], AsyncGenerator]: API response or stream
@@ -284,6 +337,21 @@ async def make_llm_api_call(
     # debug <timestamp>.json messages
     logger.info(f"Making LLM API call to model: {model_name} (Thinking: {enable_thinking}, Effort: {reasoning_effort})")
     logger.info(f"📡 API Call: Using model {model_name}")
+
+    # Key on the caller's arguments; prepare_params may add provider-specific fields to messages
+    cache_key = None
+    if cache_ttl and not stream and not tools:
+        cache_key = _response_cache_key(
+            model_name, messages,
+            temperature=temperature, max_tokens=max_tokens, top_p=top_p,
+            response_format=response_format, model_id=model_id,
+            enable_thinking=enable_thinking, reasoning_effort=reasoning_effort
+        )
+        cached_response = await _get_cached_response(cache_key)
+        if cached_response is not None:
+            logger.info(f"Using cached LLM response for model {model_name}")
+            return cached_response
+
     params = prepare_params(
         messages=messages,
         model_name=model_name,
@@ -309,6 +377,8 @@ async def make_llm_api_call(
             response = await litellm.acompletion(**params)
             logger.debug(f"Successfully received API response from {model_name}")
             logger.debug(f"Response: {response}")
+            if cache_key:
+                await _cache_response(cache_key, response, cache_ttl)
             return response
 
         except (litellm.exceptions.RateLimitError, OpenAIError, json.JSONDecodeError) as e:
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional, Tuple
 
 # Redis client
 client: redis.Redis | None = None
@@ -146,7 +146,153 @@ async def llen(key: str) -> int:
     return await redis_client.llen(key)
 
 
+async def lpush(key: str, *values: Any):
+    """Prepend one or more values to a list."""
+    redis_client = await get_client()
+    return await redis_client.lpush(key, *values)
+
+
+async def lpop(key: str) -> str | None:
+    """Remove and get the first element of a list."""
+    redis_client = await get_client()
+    return await redis_client.lpop(key)
+
+
+async def lindex(key: str, index: int) -> str | None:
+    """Get an element of a list by its index."""
+    redis_client = await get_client()
+    return await redis_client.lindex(key, index)
+
+
+async def lrem(key: str, count: int, value: str) -> int:
+    """Remove occurrences of a value from a list. Returns the number removed."""
+    redis_client = await get_client()
+    return await redis_client.lrem(key, count, value)
+
+
+# Stream operations
+async def xadd(key: str, fields: Dict[str, str], maxlen: Optional[int] = None, approximate: bool = True) -> str:
+    """Append an entry to a stream, optionally trimming it to about `maxlen` entries. Returns the entry ID."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=approximate)
+
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+    """Read entries after the given IDs from one or more streams, blocking up to `block` ms.
+
+    Keep `block` below the client socket timeout.
+    """
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+
+async def xrange(key: str, min: str = "-", max: str = "+", count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Get a range of entries from a stream."""
+    redis_client = await get_client()
+    return await redis_client.xrange(key, min=min, max=max, count=count)
+
+
+async def xrevrange(key: str, max: str = "+", min: str = "-", count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Get a range of entries from a stream, newest first."""
+    redis_client = await get_client()
+    return await redis_client.xrevrange(key, max=max, min=min, count=count)
+
+
+# Sorted set operations
+async def zadd(key: str, mapping: Dict[str, float], xx: bool = False) -> int:
+    """Add members to a sorted set, or only update existing ones with `xx`."""
+    redis_client = await get_client()
+    return await redis_client.zadd(key, mapping, xx=xx)
+
+
+async def zrem(key: str, *members: str) -> int:
+    """Remove members from a sorted set."""
+    redis_client = await get_client()
+    return await redis_client.zrem(key, *members)
+
+
+async def zcount(key: str, min: float | str, max: float | str) -> int:
+    """Count the members of a sorted set with scores between min and max."""
+    redis_client = await get_client()
+    return await redis_client.zcount(key, min, max)
+
+
+async def zrangebyscore(key: str, min: float | str, max: float | str) -> List[str]:
+    """Get the members of a sorted set with scores between min and max."""
+    redis_client = await get_client()
+    return await redis_client.zrangebyscore(key, min, max)
+
+
+async def zremrangebyscore(key: str, min: float | str, max: float | str) -> int:
+    """Remove the members of a sorted set with scores between min and max."""
+    redis_client = await get_client()
+    return await redis_client.zremrangebyscore(key, min, max)
+
+
+async def zcard(key: str) -> int:
+    """Get the number of members of a sorted set."""
+    redis_client = await get_client()
+    return await redis_client.zcard(key)
+
+
+async def zrange(key: str, start: int, end: int) -> List[str]:
+    """Get a range of members of a sorted set by rank, lowest score first."""
+    redis_client = await get_client()
+    return await redis_client.zrange(key, start, end)
+
+
+# Hash operations
+async def hincrby(key: str, field: str, amount: int = 1) -> int:
+    """Increment the integer value of a hash field."""
+    redis_client = await get_client()
+    return await redis_client.hincrby(key, field, amount)
+
+
+async def hset(key: str, field: str, value: str) -> int:
+    """Set a hash field."""
+    redis_client = await get_client()
+    return await redis_client.hset(key, field, value)
+
+
+async def hget(key: str, field: str) -> str | None:
+    """Get a hash field."""
+    redis_client = await get_client()
+    return await redis_client.hget(key, field)
+
+
+async def hdel(key: str, *fields: str) -> int:
+    """Delete hash fields. Returns the number of fields removed."""
+    redis_client = await get_client()
+    return await redis_client.hdel(key, *fields)
+
+
+async def hgetall(key: str) -> Dict[str, str]:
+    """Get all fields and values of a hash."""
+    redis_client = await get_client()
+    return await redis_client.hgetall(key)
+
+
+# Counter operations
+async def incr(key: str) -> int:
+    """Increment the integer value of a key."""
+    redis_client = await get_client()
+    return await redis_client.incr(key)
+
+
+# Scripting
+async def eval(script: str, keys: List[str], args: List[Any]) -> Any:
+    """Run a Lua script atomically."""
+    redis_client = await get_client()
+    return await redis_client.eval(script, len(keys), *keys, *args)
+
+
 # Key management
+async def exists(key: str) -> bool:
+    """Check whether a key exists."""
+    redis_client = await get_client()
+    return await redis_client.exists(key) > 0
+
+
 async def expire(key: str, time: int):
     """Set a key's time to live in seconds."""
     redis_client = await get_client()
@@ -0,0 +1,239 @@
+"""
+Running counters of agent run time per account and month.
+
+Billing limits are checked against the agent run minutes an account used in the
+current month. Instead of scanning threads and agent_runs on every check, usage
+is kept in Redis:
+
+- billing:usage:{account_id}:{YYYY-MM}: seconds of finished runs started that month
+- billing:active_runs:{account_id}: run_id -> started_at of runs still running
+- billing:run_account:{run_id}: account of a running run, to finalize it
+
+A run is added to the active index when it is created and moved into the month
+counter when update_agent_run_status finalizes it. Removing it from the index is
+the idempotency guard: only the call that removes it adds its duration. The
+counters can be rebuilt from agent_runs with reconcile_usage_counters.
+
+Queued runs are not usage: started_at is reset when a queued run starts, and a
+run finalized while still queued gets the same start and completion time.
+
+A finished run is only added to a counter that exists. A missing counter (new
+month, Redis flush or eviction) is rebuilt from agent_runs on the next read,
+which includes the run; creating it from one run would hide the others.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from services import redis
+from utils.logger import logger
+
+# Counters outlive their month so late finalizations and reconciliation still find them
+USAGE_COUNTER_TTL = 3600 * 24 * 62
+# PostgREST page size for reconciliation scans
+SCAN_PAGE_SIZE = 1000
+
+# KEYS: month counter; ARGV: seconds, counter TTL. Returns 0 if the counter does not exist
+_ADD_TO_COUNTER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('INCRBYFLOAT', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def usage_counter_key(account_id: str, month: str) -> str:
+    return f"billing:usage:{account_id}:{month}"
+
+
+def active_runs_key(account_id: str) -> str:
+    return f"billing:active_runs:{account_id}"
+
+
+def run_account_key(agent_run_id: str) -> str:
+    return f"billing:run_account:{agent_run_id}"
+
+
+def _month_of(ts: datetime) -> str:
+    return ts.strftime('%Y-%m')
+
+
+def _month_start(now: datetime) -> datetime:
+    return datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+
+
+def _parse_ts(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+async def record_run_started(account_id: str, agent_run_id: str, started_at: str):
+    """Add a newly created run to the account's active-run index."""
+    try:
+        await redis.hset(active_runs_key(account_id), agent_run_id, started_at)
+        await redis.set(run_account_key(agent_run_id), account_id, ex=redis.REDIS_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to record start of agent run {agent_run_id} for usage: {str(e)}")
+
+
+async def record_run_finished(client, agent_run_id: str, completed_at: datetime):
+    """Move a finished run from the active-run index into its month counter.
+
+    Safe to call more than once per run: only the first call counts it.
+    """
+    try:
+        account_id = await redis.get(run_account_key(agent_run_id))
+        if not account_id:
+            account_id = await _lookup_run_account(client, agent_run_id)
+            if not account_id:
+                logger.warning(f"No account found for agent run {agent_run_id}, usage not recorded")
+                return
+
+        started_at = await redis.hget(active_runs_key(account_id), agent_run_id)
+        removed = await redis.hdel(active_runs_key(account_id), agent_run_id)
+        if not removed or not started_at:
+            # Already finalized, or not registered; reconciliation covers the latter
+            return
+
+        started = _parse_ts(started_at)
+        seconds = max(0.0, (completed_at - started).total_seconds())
+        counter_key = usage_counter_key(account_id, _month_of(started))
+        added = await redis.eval(_ADD_TO_COUNTER_SCRIPT, [counter_key], [seconds, USAGE_COUNTER_TTL])
+        await redis.delete(run_account_key(agent_run_id))
+        if added:
+            logger.debug(f"Recorded {seconds:.1f}s of usage for agent run {agent_run_id} (account {account_id})")
+        else:
+            logger.debug(f"No usage counter {counter_key} for agent run {agent_run_id}; it is rebuilt on the next read")
+    except Exception as e:
+        logger.error(f"Failed to record usage of agent run {agent_run_id}: {str(e)}")
+
+
+async def _lookup_run_account(client, agent_run_id: str) -> Optional[str]:
+    run_result = await client.table('agent_runs').select('thread_id').eq('id', agent_run_id).execute()
+    if not run_result.data:
+        return None
+    thread_result = await client.table('threads').select('account_id').eq('thread_id', run_result.data[0]['thread_id']).execute()
+    return thread_result.data[0]['account_id'] if thread_result.data else None
+
+
+async def get_monthly_usage_minutes(client, account_id: str) -> float:
+    """Agent run minutes of the current month: the month counter plus runs still running.
+
+    The counter is rebuilt from agent_runs when it does not exist yet.
+    """
+    now = datetime.now(timezone.utc)
+    month = _month_of(now)
+    month_start = _month_start(now)
+
+    counter = await redis.get(usage_counter_key(account_id, month))
+    if counter is None:
+        await reconcile_usage_counters(client, account_ids=[account_id])
+        counter = await redis.get(usage_counter_key(account_id, month), "0")
+
+    total_seconds = float(counter)
+    for started_at in (await redis.hgetall(active_runs_key(account_id))).values():
+        started = _parse_ts(started_at)
+        if started >= month_start:
+            total_seconds += max(0.0, (now - started).total_seconds())
+
+    return total_seconds / 60
+
+
+async def _scan_month_runs(client, month_start: datetime, account_ids: Optional[List[str]] = None) -> Tuple[Dict[str, float], Dict[str, Dict[str, str]]]:
+    """Scan agent_runs of the month.
+
+    Returns:
+        (seconds of finished runs per account, {account_id: {run_id: started_at}} of running runs)
+    """
+    thread_accounts: Dict[str, str] = {}
+    if account_ids is not None:
+        for account_id in account_ids:
+            offset = 0
+            while True:
+                threads_result = await client.table('threads') \
+                    .select('thread_id') \
+                    .eq('account_id', account_id) \
+                    .range(offset, offset + SCAN_PAGE_SIZE - 1) \
+                    .execute()
+                for thread in threads_result.data or []:
+                    thread_accounts[thread['thread_id']] = account_id
+                if not threads_result.data or len(threads_result.data) < SCAN_PAGE_SIZE:
+                    break
+                offset += SCAN_PAGE_SIZE
+
+    runs = []
+    offset = 0
+    while True:
+        query = client.table('agent_runs') \
+            .select('id, thread_id, status, started_at, completed_at') \
+            .gte('started_at', month_start.isoformat())
+        if account_ids is not None:
+            if not thread_accounts:
+                break
+            query = query.in_('thread_id', list(thread_accounts.keys()))
+        runs_result = await query.order('started_at').range(offset, offset + SCAN_PAGE_SIZE - 1).execute()
+        runs.extend(runs_result.data or [])
+        if not runs_result.data or len(runs_result.data) < SCAN_PAGE_SIZE:
+            break
+        offset += SCAN_PAGE_SIZE
+
+    if account_ids is None:
+        # Resolve the accounts of every thread with runs this month
+        missing = list({run['thread_id'] for run in runs})
+        for i in range(0, len(missing), SCAN_PAGE_SIZE):
+            threads_result = await client.table('threads') \
+                .select('thread_id, account_id') \
+                .in_('thread_id', missing[i:i + SCAN_PAGE_SIZE]) \
+                .execute()
+            for thread in threads_result.data or []:
+                thread_accounts[thread['thread_id']] = thread['account_id']
+
+    finished: Dict[str, float] = {account_id: 0.0 for account_id in (account_ids or [])}
+    running: Dict[str, Dict[str, str]] = {account_id: {} for account_id in (account_ids or [])}
+    for run in runs:
+        account_id = thread_accounts.get(run['thread_id'])
+        if not account_id:
+            continue
+        finished.setdefault(account_id, 0.0)
+        running.setdefault(account_id, {})
+        if run['status'] == 'queued':
+            continue  # Waiting for admission; started_at is reset when it starts
+        if run['completed_at']:
+            finished[account_id] += (_parse_ts(run['completed_at']) - _parse_ts(run['started_at'])).total_seconds()
+        else:
+            running[account_id][run['id']] = run['started_at']
+    return finished, running
+
+
+async def reconcile_usage_counters(client, account_ids: Optional[List[str]] = None) -> int:
+    """Rebuild the current month's counters and active-run indexes from agent_runs.
+
+    Args:
+        client: Supabase client
+        account_ids: Accounts to rebuild; all accounts with runs this month if None
+
+    Returns:
+        Number of accounts rebuilt
+    """
+    now = datetime.now(timezone.utc)
+    month = _month_of(now)
+    finished, running = await _scan_month_runs(client, _month_start(now), account_ids)
+
+    for account_id, seconds in finished.items():
+        counter_key = usage_counter_key(account_id, month)
+        await redis.set(counter_key, str(seconds), ex=USAGE_COUNTER_TTL)
+
+        index_key = active_runs_key(account_id)
+        indexed = await redis.hgetall(index_key)
+        # Drop runs that finished without being finalized here (e.g. a crashed worker)
+        stale = [run_id for run_id, started_at in indexed.items()
+                 if run_id not in running[account_id] and _parse_ts(started_at) >= _month_start(now)]
+        if stale:
+            await redis.hdel(index_key, *stale)
+        for run_id, started_at in running[account_id].items():
+            await redis.hset(index_key, run_id, started_at)
+            await redis.set(run_account_key(run_id), account_id, ex=redis.REDIS_KEY_TTL)
+
+    logger.info(f"Reconciled usage counters for {len(finished)} accounts ({month})")
+    return len(finished)
@@ -0,0 +1,81 @@
+BEGIN;
+
+-- Fast lookup of the latest summary message of a thread
+CREATE INDEX IF NOT EXISTS idx_messages_thread_summary
+    ON messages(thread_id, created_at DESC)
+    WHERE type = 'summary' AND is_llm_message = TRUE;
+
+-- Return the LLM context window of a thread: the latest summary followed by every
+-- message after it, or the whole thread when no summary exists. A summary may record
+-- the created_at of the last message it covers in metadata.summarized_until; messages
+-- written while the summary was being generated are then kept in the window.
+CREATE OR REPLACE FUNCTION get_llm_message_window(p_thread_id UUID)
+RETURNS TABLE (
+    message_id UUID,
+    type TEXT,
+    content JSONB,
+    metadata JSONB,
+    created_at TIMESTAMP WITH TIME ZONE
+)
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    has_access BOOLEAN;
+    current_role TEXT;
+    is_project_public BOOLEAN;
+    latest_summary_id UUID;
+    window_start TIMESTAMP WITH TIME ZONE;
+BEGIN
+    SELECT current_user INTO current_role;
+
+    SELECT p.is_public INTO is_project_public
+    FROM threads t
+    LEFT JOIN projects p ON t.project_id = p.project_id
+    WHERE t.thread_id = p_thread_id;
+
+    -- Skip access check for service_role or public projects
+    IF current_role = 'authenticated' AND NOT is_project_public THEN
+        SELECT EXISTS (
+            SELECT 1 FROM threads t
+            LEFT JOIN projects p ON t.project_id = p.project_id
+            WHERE t.thread_id = p_thread_id
+            AND (
+                basejump.has_role_on_account(t.account_id) = true OR
+                basejump.has_role_on_account(p.account_id) = true
+            )
+        ) INTO has_access;
+
+        IF NOT has_access THEN
+            RAISE EXCEPTION 'Thread not found or access denied';
+        END IF;
+    END IF;
+
+    SELECT m.message_id,
+           COALESCE((m.metadata->>'summarized_until')::TIMESTAMP WITH TIME ZONE, m.created_at)
+    INTO latest_summary_id, window_start
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type = 'summary'
+    AND m.is_llm_message = TRUE
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    RETURN QUERY
+    SELECT m.message_id, m.type, m.content, m.metadata, m.created_at
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.is_llm_message = TRUE
+    AND (
+        latest_summary_id IS NULL
+        OR m.message_id = latest_summary_id
+        OR (m.created_at > window_start AND m.type <> 'summary')
+    )
+    -- The summary always opens the window
+    ORDER BY (m.message_id = latest_summary_id) IS TRUE DESC, m.created_at;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_llm_message_window TO authenticated, service_role;
+
+COMMIT;
@@ -0,0 +1,108 @@
+BEGIN;
+
+-- Fast lookup of the latest message of a given type in a thread
+CREATE INDEX IF NOT EXISTS idx_messages_thread_type_created_at
+    ON messages(thread_id, type, created_at DESC);
+
+-- Message content may be stored as a JSON-encoded string; decode it when it
+-- holds JSON and return it unchanged otherwise
+CREATE OR REPLACE FUNCTION decode_message_content(p_content JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+BEGIN
+    IF jsonb_typeof(p_content) = 'string' THEN
+        RETURN (p_content #>> '{}')::JSONB;
+    END IF;
+    RETURN p_content;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN p_content;
+END;
+$$;
+
+-- Return everything the agent loop needs before an iteration in one round-trip:
+--   latest_message_type: type of the latest assistant, tool or user message
+--   browser_state: content of the latest browser_state message; the base64
+--                  screenshot is dropped when an uploaded image_url is present
+--   image_context: content of the latest image_context message
+--   image_context_id: its message_id; the agent deletes the message once the
+--                     iteration proceeds, since it is only shown to the model once
+CREATE OR REPLACE FUNCTION get_agent_iteration_snapshot(p_thread_id UUID)
+RETURNS JSONB
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    has_access BOOLEAN;
+    current_role TEXT;
+    is_project_public BOOLEAN;
+    latest_type TEXT;
+    browser_content JSONB;
+    image_context_id UUID;
+    image_context_content JSONB;
+BEGIN
+    SELECT current_user INTO current_role;
+
+    SELECT p.is_public INTO is_project_public
+    FROM threads t
+    LEFT JOIN projects p ON t.project_id = p.project_id
+    WHERE t.thread_id = p_thread_id;
+
+    -- Skip access check for service_role or public projects
+    IF current_role = 'authenticated' AND NOT is_project_public THEN
+        SELECT EXISTS (
+            SELECT 1 FROM threads t
+            LEFT JOIN projects p ON t.project_id = p.project_id
+            WHERE t.thread_id = p_thread_id
+            AND (
+                basejump.has_role_on_account(t.account_id) = true OR
+                basejump.has_role_on_account(p.account_id) = true
+            )
+        ) INTO has_access;
+
+        IF NOT has_access THEN
+            RAISE EXCEPTION 'Thread not found or access denied';
+        END IF;
+    END IF;
+
+    SELECT m.type INTO latest_type
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type IN ('assistant', 'tool', 'user')
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    SELECT decode_message_content(m.content)
+    INTO browser_content
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type = 'browser_state'
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    IF jsonb_typeof(browser_content) = 'object' AND COALESCE(browser_content->>'image_url', '') <> '' THEN
+        browser_content := browser_content - 'screenshot_base64';
+    END IF;
+
+    SELECT m.message_id,
+           decode_message_content(m.content)
+    INTO image_context_id, image_context_content
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+    AND m.type = 'image_context'
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    RETURN jsonb_build_object(
+        'latest_message_type', latest_type,
+        'browser_state', browser_content,
+        'image_context', image_context_content,
+        'image_context_id', image_context_id
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION get_agent_iteration_snapshot TO authenticated, service_role;
+
+COMMIT;
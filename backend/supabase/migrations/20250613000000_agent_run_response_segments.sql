@@ -0,0 +1,37 @@
+BEGIN;
+
+-- Responses of agent runs, archived while the run is in progress in compressed
+-- segments of consecutive responses instead of one agent_runs.responses write
+-- at the end. content is the gzipped JSON array of the segment, base64-encoded.
+CREATE TABLE IF NOT EXISTS agent_run_response_segments (
+    agent_run_id UUID NOT NULL REFERENCES agent_runs(id) ON DELETE CASCADE,
+    segment_index INTEGER NOT NULL,
+    response_count INTEGER NOT NULL,
+    encoding TEXT NOT NULL DEFAULT 'gzip+base64',
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    PRIMARY KEY (agent_run_id, segment_index)
+);
+
+ALTER TABLE agent_run_response_segments ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY agent_run_response_segment_select_policy ON agent_run_response_segments
+    FOR SELECT
+    USING (
+        EXISTS (
+            SELECT 1 FROM agent_runs
+            JOIN threads ON threads.thread_id = agent_runs.thread_id
+            LEFT JOIN projects ON threads.project_id = projects.project_id
+            WHERE agent_runs.id = agent_run_response_segments.agent_run_id
+            AND (
+                projects.is_public = TRUE OR
+                basejump.has_role_on_account(threads.account_id) = true OR
+                basejump.has_role_on_account(projects.account_id) = true
+            )
+        )
+    );
+
+GRANT SELECT ON TABLE agent_run_response_segments TO authenticated;
+GRANT ALL PRIVILEGES ON TABLE agent_run_response_segments TO service_role;
+
+COMMIT;
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for streaming XML tool call detection.
+
+Usage:
+    python benchmark_xml_stream_scanner.py [--size BYTES] [--delta-size CHARS] [--repeat N]
+
+This script:
+1. Builds a synthetic assistant response (~50KB by default) with prose and a few
+   <function_calls> blocks, including one large file-content parameter
+2. Replays it in small deltas, the way a streaming LLM response arrives
+3. Times the previous approach (re-running the _extract_xml_chunks logic over the
+   whole accumulated content on every delta, then str.replace) against the
+   incremental StreamingXMLScanner, and checks both find the same blocks
+
+Only the scanner module is imported, so no API keys or services are needed.
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from agentpress.xml_stream_scanner import StreamingXMLScanner
+
+LEGACY_TAGS = ['create-file', 'str-replace', 'full-file-rewrite', 'delete-file', 'execute-command', 'web-search', 'ask', 'complete']
+
+
+def build_response(size: int) -> str:
+    """Build a synthetic response of roughly `size` characters."""
+    prose = "The quick brown fox jumps over the lazy dog while the agent reasons about the task. "
+    small_call = (
+        '<function_calls>\n<invoke name="execute_command">\n'
+        '<parameter name="command">ls -la /workspace</parameter>\n'
+        '</invoke>\n</function_calls>\n'
+    )
+    file_body = "\n".join(f"line {i}: some <b>generated</b> content" for i in range(size // 80))
+    big_call = (
+        '<function_calls>\n<invoke name="create_file">\n'
+        '<parameter name="file_path">src/generated.html</parameter>\n'
+        f'<parameter name="file_contents">{file_body}</parameter>\n'
+        '</invoke>\n</function_calls>\n'
+    )
+    parts = []
+    while sum(len(p) for p in parts) < size // 2:
+        parts.append(prose)
+        if len(parts) % 20 == 0:
+            parts.append(small_call)
+    parts.append(big_call)
+    parts.append(prose * 3)
+    parts.append(small_call)
+    return "".join(parts)
+
+
+def split_deltas(content: str, delta_size: int) -> List[str]:
+    return [content[i:i + delta_size] for i in range(0, len(content), delta_size)]
+
+
+def extract_xml_chunks(content: str) -> List[str]:
+    """Copy of ResponseProcessor._extract_xml_chunks, the previous per-delta extraction."""
+    chunks = []
+    pos = 0
+    while pos < len(content):
+        start_pos = content.find('<function_calls>', pos)
+        if start_pos == -1:
+            break
+        end_pos = content.find('</function_calls>', start_pos)
+        if end_pos == -1:
+            break
+        pos = end_pos + len('</function_calls>')
+        chunks.append(content[start_pos:pos])
+
+    # Legacy tags are only searched when no <function_calls> block was found
+    if not chunks:
+        pos = 0
+        while pos < len(content):
+            next_tag_start = -1
+            current_tag = None
+            for tag_name in LEGACY_TAGS:
+                tag_pos = content.find(f'<{tag_name}', pos)
+                if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
+                    next_tag_start = tag_pos
+                    current_tag = tag_name
+            if next_tag_start == -1:
+                break
+
+            end_pattern = f'</{current_tag}>'
+            tag_stack = []
+            current_pos = next_tag_start
+            while current_pos < len(content):
+                next_start = content.find(f'<{current_tag}', current_pos + 1)
+                next_end = content.find(end_pattern, current_pos)
+                if next_end == -1:
+                    break
+                if next_start != -1 and next_start < next_end:
+                    tag_stack.append(next_start)
+                    current_pos = next_start + 1
+                elif not tag_stack:
+                    pos = next_end + len(end_pattern)
+                    chunks.append(content[next_tag_start:pos])
+                    break
+                else:
+                    tag_stack.pop()
+                    current_pos = next_end + 1
+            if current_pos >= len(content):
+                break
+            pos = max(pos + 1, current_pos)
+    return chunks
+
+
+def run_rescan(deltas: List[str]) -> List[str]:
+    """Previous approach: rescan the accumulated content on every delta."""
+    current_xml_content = ""
+    found = []
+    for delta in deltas:
+        current_xml_content += delta
+        for xml_chunk in extract_xml_chunks(current_xml_content):
+            current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+            found.append(xml_chunk)
+    return found
+
+
+def run_scanner(deltas: List[str]) -> List[str]:
+    """Incremental approach: feed each delta to the scanner once."""
+    scanner = StreamingXMLScanner(LEGACY_TAGS)
+    found = []
+    for delta in deltas:
+        found.extend(chunk.raw for chunk in scanner.feed(delta))
+    return found
+
+
+def benchmark(fn, deltas: List[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(deltas)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming XML tool call detection')
+    parser.add_argument('--size', type=int, default=50 * 1024, help='Approximate response size in characters')
+    parser.add_argument('--delta-size', type=int, default=16, help='Characters per streamed delta')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions, the best time is reported')
+    args = parser.parse_args()
+
+    content = build_response(args.size)
+    deltas = split_deltas(content, args.delta_size)
+
+    rescan_chunks = run_rescan(deltas)
+    scanner_chunks = run_scanner(deltas)
+    if rescan_chunks != scanner_chunks:
+        raise SystemExit(f"Mismatch: rescan found {len(rescan_chunks)} blocks, scanner found {len(scanner_chunks)}")
+
+    rescan_time = benchmark(run_rescan, deltas, args.repeat)
+    scanner_time = benchmark(run_scanner, deltas, args.repeat)
+
+    print(f"Response size: {len(content)} chars in {len(deltas)} deltas of {args.delta_size} chars")
+    print(f"XML blocks found: {len(scanner_chunks)}")
+    print(f"Rescan per delta:     {rescan_time * 1000:9.2f} ms")
+    print(f"Incremental scanner:  {scanner_time * 1000:9.2f} ms")
+    print(f"Speedup:              {rescan_time / scanner_time:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Script to rebuild the monthly usage counters from agent_runs.
+
+Usage:
+    python reconcile_usage_counters.py [--account-id ACCOUNT_ID ...]
+
+This script:
+1. Scans the agent runs started this month, for all accounts or the given ones
+2. Rewrites each account's usage counter from its finished runs
+3. Rewrites each account's active-run index from its running runs
+
+Run it periodically to correct drift, e.g. runs whose worker died before
+finalizing them, or after Redis data loss.
+
+Make sure your environment variables are properly set:
+- SUPABASE_URL
+- SUPABASE_SERVICE_ROLE_KEY
+- REDIS_HOST
+- REDIS_PORT
+- REDIS_PASSWORD
+"""
+
+import asyncio
+import argparse
+import sys
+from dotenv import load_dotenv
+
+# Load script-specific environment variables
+load_dotenv(".env")
+
+from services.supabase import DBConnection
+from services import redis
+from services.usage import reconcile_usage_counters
+from utils.logger import logger
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Rebuild the monthly usage counters from agent_runs')
+    parser.add_argument('--account-id', action='append', dest='account_ids', help='Account to rebuild (repeatable); all accounts if omitted')
+    args = parser.parse_args()
+
+    db = DBConnection()
+    await redis.initialize_async()
+    try:
+        client = await db.client
+        count = await reconcile_usage_counters(client, account_ids=args.account_ids)
+        print(f"Rebuilt usage counters for {count} accounts")
+    except Exception as e:
+        logger.error(f"Error reconciling usage counters: {str(e)}")
+        sys.exit(1)
+    finally:
+        await redis.close()
+        await DBConnection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
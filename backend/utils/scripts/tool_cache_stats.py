@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Script to report tool result cache hit and miss counts.
+
+Usage:
+    python tool_cache_stats.py [--reset]
+
+This script:
+1. Reads the per-function hit/miss counters kept in Redis by the tool result cache
+2. Prints them with the hit rate of each function
+3. Optionally resets the counters
+
+Make sure your environment variables are properly set:
+- REDIS_HOST
+- REDIS_PORT
+- REDIS_PASSWORD
+"""
+
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+# Load script-specific environment variables
+load_dotenv(".env")
+
+from services import redis
+from agentpress.tool_cache import tool_result_cache
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Report tool result cache hit and miss counts')
+    parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+    args = parser.parse_args()
+
+    await redis.initialize_async()
+    try:
+        stats = await tool_result_cache.get_stats()
+        if not stats:
+            print("No tool cache lookups recorded")
+        for name, counts in sorted(stats.items()):
+            total = counts["hits"] + counts["misses"]
+            hit_rate = counts["hits"] / total * 100 if total else 0.0
+            print(f"{name:40} hits={counts['hits']:8} misses={counts['misses']:8} hit rate={hit_rate:5.1f}%")
+
+        if args.reset:
+            await redis.delete(tool_result_cache.STATS_KEY)
+            print("Counters reset")
+    finally:
+        await redis.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
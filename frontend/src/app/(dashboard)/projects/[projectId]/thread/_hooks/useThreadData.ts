@@ -1,6 +1,6 @@
 import { useEffect, useRef, useState } from 'react';
 import { toast } from 'sonner';
-import { Project } from '@/lib/api';
+import { Project, isAgentRunActive } from '@/lib/api';
 import { useThreadQuery } from '@/hooks/react-query/threads/use-threads';
 import { useMessagesQuery } from '@/hooks/react-query/threads/use-messages';
 import { useProjectQuery } from '@/hooks/react-query/threads/use-project';
@@ -98,7 +98,7 @@ export function useThreadData(threadId: string, projectId: string): UseThreadDat
           console.log('[PAGE] Checking for active agent runs...');
           agentRunsCheckedRef.current = true;
 
-          const activeRun = agentRunsQuery.data.find((run) => run.status === 'running');
+          const activeRun = agentRunsQuery.data.find((run) => isAgentRunActive(run.status));
           if (activeRun && isMounted) {
             console.log('[PAGE] Found active run on load:', activeRun.id);
             setAgentRunId(activeRun.id);
@@ -2,6 +2,7 @@ import { useState, useEffect, useRef, useCallback, useMemo } from 'react';
 import {
   streamAgent,
   getAgentStatus,
+  isAgentRunActive,
   stopAgent,
   AgentRun,
   getMessages,
@@ -458,7 +459,7 @@ export function useAgentStream(
         console.log(
           `[useAgentStream] Agent status after stream close for ${runId}: ${agentStatus.status}`,
         );
-        if (agentStatus.status === 'running') {
+        if (isAgentRunActive(agentStatus.status)) {
           console.warn(
             `[useAgentStream] Stream closed for ${runId}, but agent is still running. Finalizing with error.`,
           );
@@ -555,7 +556,7 @@ export function useAgentStream(
         const agentStatus = await getAgentStatus(runId);
         if (!isMountedRef.current) return; // Check mount status after async call
 
-        if (agentStatus.status !== 'running') {
+        if (!isAgentRunActive(agentStatus.status)) {
           console.warn(
             `[useAgentStream] Agent run ${runId} is not in running state (status: ${agentStatus.status}). Cannot start stream.`,
           );
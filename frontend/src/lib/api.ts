@@ -73,7 +73,7 @@ export type Message = {
 export type AgentRun = {
   id: string;
   thread_id: string;
-  status: 'running' | 'completed' | 'stopped' | 'error';
+  status: 'queued' | 'running' | 'completed' | 'stopped' | 'error';
   started_at: string;
   completed_at: string | null;
   responses: Message[];
@@ -761,8 +761,8 @@ export const getAgentStatus = async (agentRunId: string): Promise<AgentRun> => {
     const data = await response.json();
     console.log(`[API] Successfully got agent status:`, data);
 
-    // If agent is not running, add to non-running set
-    if (data.status !== 'running') {
+    // If agent is not running or queued, add to non-running set
+    if (!isAgentRunActive(data.status)) {
       nonRunningAgentRuns.add(agentRunId);
     }
 
@@ -774,6 +774,10 @@ export const getAgentStatus = async (agentRunId: string): Promise<AgentRun> => {
   }
 };
 
+// Queued runs wait for a free slot and then run; their stream stays open meanwhile
+export const isAgentRunActive = (status: string): boolean =>
+  status === 'running' || status === 'queued';
+
 export const getAgentRuns = async (threadId: string): Promise<AgentRun[]> => {
   try {
     const supabase = createClient();
@@ -851,7 +855,7 @@ export const streamAgent = (
       // First verify the agent is actually running
       try {
         const status = await getAgentStatus(agentRunId);
-        if (status.status !== 'running') {
+        if (!isAgentRunActive(status.status)) {
           console.log(
             `[STREAM] Agent run ${agentRunId} is not running (status: ${status.status}), not creating stream`,
           );
@@ -1034,7 +1038,7 @@ export const streamAgent = (
         // Check if the agent is still running
         getAgentStatus(agentRunId)
           .then((status) => {
-            if (status.status !== 'running') {
+            if (!isAgentRunActive(status.status)) {
               console.log(
                 `[STREAM] Agent run ${agentRunId} is not running after error, closing stream`,
               );